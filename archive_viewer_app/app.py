@@ -1,5 +1,5 @@
 # coding: utf-8
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, Response, g, request, jsonify, render_template, send_file, redirect, url_for
 import os
 import shutil
 import time
@@ -11,9 +11,41 @@ import py7zr    # For .7z files
 import re
 import subprocess
 import json
+import struct
+import zlib
+import bz2
+import lzma
+import sqlite3
+import io
+import gzip
+import stat
+import mimetypes
+import sys
+import array
+import bisect
 import hashlib
+import contextlib
+import collections
+import cProfile
+import pstats
+import heapq
+import queue
+import functools
+import itertools
 import logging # For better logging
-from urllib.parse import urlparse # Added for URL parsing
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from urllib.parse import urlparse, quote # Added for URL parsing
+from requests.adapters import HTTPAdapter
+import thumbnails # توليد الصور المصغرة في عمليات منفصلة (Pillow اختياري)
+import extract_workers # فك ضغط ZIP في عمليات منفصلة
+try:
+    import fcntl # أقفال الملفات بين العمليات (غير متوفر على Windows)
+except ImportError:
+    fcntl = None
 
 # --- إعداد التسجيل ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -28,8 +60,9 @@ BASE_APP_DIR = _current_file_dir # المسار إلى مجلد 'archive_viewer_
 TEMPLATE_DIR = os.path.join(BASE_APP_DIR, 'templates')
 STATIC_DIR = os.path.join(BASE_APP_DIR, 'static')
 
-# مجلدات التحميل ستكون داخل BASE_APP_DIR (أي داخل archive_viewer_app)
-UPLOAD_DIR_FLASK_APP = os.path.join(BASE_APP_DIR, 'uploads_flask')
+# مجلدات التحميل ستكون داخل BASE_APP_DIR (أي داخل archive_viewer_app) ما لم يُحدد ARCHIVE_UPLOAD_DIR
+# (مثل قياسات الأداء التي تعمل في مجلد مؤقت)
+UPLOAD_DIR_FLASK_APP = os.environ.get("ARCHIVE_UPLOAD_DIR", os.path.join(BASE_APP_DIR, 'uploads_flask'))
 TEMP_ARCHIVE_DIR_FLASK_APP = os.path.join(UPLOAD_DIR_FLASK_APP, 'temp_archive')
 EXTRACTED_FILES_DIR_FLASK_APP = os.path.join(UPLOAD_DIR_FLASK_APP, 'extracted_files')
 
@@ -43,38 +76,129 @@ REQUESTS_READ_TIMEOUT = 1800   # seconds (30 minutes)
 MEGADL_TIMEOUT = 3600          # seconds (1 hour)
 DOWNLOAD_CHUNK_SIZE = 8192 * 4 # 32KB chunk size for downloads
 
+# -- ملفات داخلية في مجلد كل جلسة (لا تظهر في شجرة الملفات ولا تُخدم عبر /view-file) --
+STRUCTURE_FILENAME = '.archive_structure.json'
+LAZY_SOURCE_DIRNAME = '.lazy_source'              # الأرشيف الأصلي للجلسات في الوضع الكسول
+LAZY_SOURCE_META_FILENAME = '.lazy_source.json'   # نوع الأرشيف واسمه للجلسات في الوضع الكسول
+SESSION_ACCESS_FILENAME = '.last_access'         # يُحدّث وقت تعديله عند كل وصول للجلسة (لحذف LRU)
+SESSION_BUILDING_FILENAME = '.building'           # موجود أثناء تحميل الجلسة وبنائها (انظر session_building)
+ARCHIVE_INDEX_FILENAME = '.archive_index'         # فهرس ثنائي للهيكل (انظر write_archive_index)
+THUMBNAILS_DIRNAME = '.thumbs'                    # الصور المصغرة المولدة (تُحذف مع الجلسة)
+PRECOMPRESSED_DIRNAME = '.precompressed'          # نسخ gzip للملفات النصية المخدومة عبر /view-file
+SEARCH_INDEX_FILENAME = '.search_index'           # جدول الأسماء لـ /search (انظر write_search_index)
+NESTED_DIRNAME = '.nested'                        # الأرشيفات المتداخلة المركّبة كجلسات فرعية (انظر mount_nested_archive)
+SESSION_INTERNAL_NAMES = {STRUCTURE_FILENAME, LAZY_SOURCE_DIRNAME, LAZY_SOURCE_META_FILENAME, SESSION_ACCESS_FILENAME, SESSION_BUILDING_FILENAME,
+                          ARCHIVE_INDEX_FILENAME, THUMBNAILS_DIRNAME, PRECOMPRESSED_DIRNAME, SEARCH_INDEX_FILENAME, NESTED_DIRNAME}
+NESTED_SESSION_SEPARATOR = '--n'                  # معرّف الجلسة الفرعية: <معرّف الأم>--n<بصمة مسار الأرشيف>
+NESTED_ARCHIVE_MAX_DEPTH = 3                      # أقصى عدد مستويات أرشيف داخل أرشيف
+LAZY_MEMBER_CACHE_MAX_BYTES = 512 * 1024 * 1024   # حد حجم العناصر المستخرجة عند الطلب لكل جلسة
+ARCHIVE_MODES = ('auto', 'extract', 'lazy', 'remote')
+LISTING_DEFAULT_PER_PAGE = 50                     # حجم الصفحة الافتراضي لـ /list و/images
+LISTING_MAX_PER_PAGE = 1000
+
+# عند التشغيل بـ python app.py تعيد spawn تنفيذ هذا الملف باسم __mp_main__ في كل عملية عاملة لمجمعات
+# العمليات (فك الضغط والصور المصغرة)؛ تُتخطى فيها تهيئة التخزين (المجلدات وقاعدة الكاش وترحيلها).
+IS_POOL_WORKER_PROCESS = __name__ == '__mp_main__'
+
 # إنشاء المجلدات إذا لم تكن موجودة (مهم عند التشغيل لأول مرة)
-for dir_path in [TEMPLATE_DIR, STATIC_DIR, UPLOAD_DIR_FLASK_APP, TEMP_ARCHIVE_DIR_FLASK_APP, EXTRACTED_FILES_DIR_FLASK_APP]:
-    os.makedirs(dir_path, exist_ok=True)
+if not IS_POOL_WORKER_PROCESS:
+    for dir_path in [TEMPLATE_DIR, STATIC_DIR, UPLOAD_DIR_FLASK_APP, TEMP_ARCHIVE_DIR_FLASK_APP, EXTRACTED_FILES_DIR_FLASK_APP]:
+        os.makedirs(dir_path, exist_ok=True)
 
 app = Flask(__name__, template_folder=TEMPLATE_DIR, static_folder=STATIC_DIR)
+# خلف nginx/Apache مع X-Sendfile: يرسل الخادم الأمامي الملف (مع Range) دون المرور عبر Python
+app.config['USE_X_SENDFILE'] = os.environ.get("ARCHIVE_USE_X_SENDFILE", "0") == "1"
 
 # --- ذاكرة التخزين المؤقت للروابط المعالجة ---
-url_cache = {}
-CACHE_FILENAME = os.path.join(UPLOAD_DIR_FLASK_APP, '.url_cache.json') # ملف لتخزين الكاش
-
-def load_cache():
-    global url_cache
-    if os.path.exists(CACHE_FILENAME):
-        try:
-            with open(CACHE_FILENAME, 'r', encoding='utf-8') as f:
-                url_cache = json.load(f)
-            logger.info(f"تم تحميل ذاكرة التخزين المؤقت للروابط من {CACHE_FILENAME}")
-        except Exception as e:
-            logger.error(f"خطأ في تحميل ذاكرة التخزين المؤقت: {e}")
-            url_cache = {}
-    else:
-        url_cache = {}
-
-def save_cache():
+# مخزن SQLite (وضع WAL) بدل ملف JSON: إدراج/تحديث لكل مفتاح على حدة، وآمن للوصول المتزامن من
+# عدة عمليات gunicorn، ولا يحتاج إلى قراءة الملف كاملًا عند بدء التشغيل.
+CACHE_DB_FILENAME = os.path.join(UPLOAD_DIR_FLASK_APP, '.url_cache.sqlite3')
+LEGACY_CACHE_FILENAME = os.path.join(UPLOAD_DIR_FLASK_APP, '.url_cache.json') # الصيغة القديمة، تُرحّل مرة واحدة
+CACHE_DB_TIMEOUT = 30 # ثوانٍ انتظار قفل الكتابة من عملية أخرى
+
+_cache_db_local = threading.local()
+
+def get_cache_db():
+    """ اتصال SQLite خاص بكل خيط (اتصالات sqlite3 لا تُشارك بين الخيوط). """
+    connection = getattr(_cache_db_local, 'connection', None)
+    if connection is None:
+        connection = sqlite3.connect(CACHE_DB_FILENAME, timeout=CACHE_DB_TIMEOUT)
+        connection.row_factory = sqlite3.Row
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        _cache_db_local.connection = connection
+    return connection
+
+def init_cache_db():
+    connection = get_cache_db()
+    with connection:
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS url_cache (
+                url_hash TEXT PRIMARY KEY,
+                session_id TEXT NOT NULL,
+                structure_file TEXT,
+                archive_type TEXT,
+                mode TEXT,
+                size_bytes INTEGER,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )""")
+        connection.execute('CREATE INDEX IF NOT EXISTS url_cache_session_id ON url_cache (session_id)')
+        # حالة مهام وضع المهام: تُنفذ المهمة في عملية واحدة ويُستعلم عنها من أي عملية (انظر save_job_state)
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                snapshot TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )""")
+    migrate_legacy_cache()
+
+def migrate_legacy_cache():
+    """ نقل مدخلات .url_cache.json القديمة إلى SQLite ثم إعادة تسمية الملف. """
+    if not os.path.exists(LEGACY_CACHE_FILENAME):
+        return
     try:
-        with open(CACHE_FILENAME, 'w', encoding='utf-8') as f:
-            json.dump(url_cache, f, ensure_ascii=False, indent=2)
-        logger.info(f"تم حفظ ذاكرة التخزين المؤقت للروابط في {CACHE_FILENAME}")
+        with open(LEGACY_CACHE_FILENAME, 'r', encoding='utf-8') as f:
+            legacy_entries = json.load(f)
+        now = time.time()
+        with get_cache_db() as connection:
+            connection.executemany(
+                'INSERT OR IGNORE INTO url_cache (url_hash, session_id, structure_file, created_at, last_access) VALUES (?, ?, ?, ?, ?)',
+                [(url_hash, entry['session_id'], entry.get('structure_file'), now, now)
+                 for url_hash, entry in legacy_entries.items() if entry.get('session_id')])
+        os.replace(LEGACY_CACHE_FILENAME, LEGACY_CACHE_FILENAME + '.migrated')
+        logger.info(f"تم ترحيل {len(legacy_entries)} مدخلًا من {LEGACY_CACHE_FILENAME} إلى {CACHE_DB_FILENAME}")
     except Exception as e:
-        logger.error(f"خطأ في حفظ ذاكرة التخزين المؤقت: {e}")
-
-load_cache() # تحميل الكاش عند بدء تشغيل التطبيق
+        logger.error(f"خطأ في ترحيل ذاكرة التخزين المؤقت القديمة: {e}")
+
+def cache_get(url_hash):
+    row = get_cache_db().execute('SELECT * FROM url_cache WHERE url_hash = ?', (url_hash,)).fetchone()
+    return dict(row) if row else None
+
+def cache_put(url_hash, session_id, structure_file, archive_type=None, mode=None, size_bytes=None):
+    now = time.time()
+    with get_cache_db() as connection:
+        connection.execute("""
+            INSERT INTO url_cache (url_hash, session_id, structure_file, archive_type, mode, size_bytes, created_at, last_access)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(url_hash) DO UPDATE SET
+                session_id = excluded.session_id, structure_file = excluded.structure_file,
+                archive_type = excluded.archive_type, mode = excluded.mode, size_bytes = excluded.size_bytes,
+                created_at = excluded.created_at, last_access = excluded.last_access""",
+            (url_hash, session_id, structure_file, archive_type, mode, size_bytes, now, now))
+
+def cache_touch(url_hash):
+    with get_cache_db() as connection:
+        connection.execute('UPDATE url_cache SET last_access = ? WHERE url_hash = ?', (time.time(), url_hash))
+
+def cache_delete_session(session_id):
+    """ حذف كل المدخلات التي تشير إلى الجلسة، وإرجاع عددها. """
+    with get_cache_db() as connection:
+        return connection.execute('DELETE FROM url_cache WHERE session_id = ?', (session_id,)).rowcount
+
+if not IS_POOL_WORKER_PROCESS:
+    init_cache_db() # إنشاء الجدول (وترحيل الكاش القديم) عند بدء تشغيل التطبيق
 
 # --- دوال مساعدة ---
 def get_google_drive_direct_link(sharing_url):
@@ -88,10 +212,31 @@ def get_google_drive_direct_link(sharing_url):
         logger.warning(f"لم يمكن استخلاص معرّف الملف من رابط جوجل درايف: {sharing_url}.")
         return sharing_url
 
+SESSION_ID_PATTERN = re.compile(r'^[0-9A-Za-z_-]+$')
+
+def get_session_folder(session_id):
+    """ المسار المطلق لمجلد الجلسة المستخرجة (أو الجلسة الفرعية لأرشيف متداخل)، أو None إذا كان المعرّف غير صالح. """
+    if not session_id or not SESSION_ID_PATTERN.match(session_id):
+        return None
+    root_session_id, *nested_ids = session_id.split(NESTED_SESSION_SEPARATOR)
+    if not root_session_id or not all(nested_ids) or len(nested_ids) > NESTED_ARCHIVE_MAX_DEPTH:
+        return None
+    session_folder = os.path.join(EXTRACTED_FILES_DIR_FLASK_APP, root_session_id)
+    for nested_id in nested_ids:
+        session_folder = os.path.join(session_folder, NESTED_DIRNAME, nested_id)
+    return os.path.abspath(session_folder)
+
+def get_root_session_id(session_id):
+    """ معرّف الجلسة العليا التي يُحذف معها الأرشيف المتداخل (المعرّف نفسه لغير المتداخلة). """
+    return session_id.split(NESTED_SESSION_SEPARATOR, 1)[0]
+
+def get_nested_depth(session_id):
+    return session_id.count(NESTED_SESSION_SEPARATOR)
+
 def cleanup_old_session_data(session_id):
     logger.info(f"محاولة تنظيف بيانات الجلسة للمعرّف: {session_id}")
     temp_session_folder = os.path.join(TEMP_ARCHIVE_DIR_FLASK_APP, session_id)
-    # extracted_session_folder = os.path.join(EXTRACTED_FILES_DIR_FLASK_APP, session_id) # لا تحذف المستخرجة للاستفادة من الكاش
+    # لا تحذف المستخرجة هنا للاستفادة من الكاش؛ يحذفها عامل LRU عند تجاوز ميزانية التخزين
 
     try:
         if os.path.exists(temp_session_folder):
@@ -101,10 +246,503 @@ def cleanup_old_session_data(session_id):
         logger.error(f"خطأ أثناء حذف المجلد المؤقت {temp_session_folder}: {e}")
     pass
 
+# --- إدارة مساحة الجلسات المستخرجة (LRU ضمن ميزانية بايتات) ---
+# تبقى extracted_files/<session_id> بعد المعالجة للاستفادة من url_cache، لكن عامل خلفية يحذف
+# الجلسات الأقدم وصولًا (مع مدخلاتها في url_cache) عندما يتجاوز الحجم الكلي الميزانية المحددة.
+# لا تُحذف جلسة قيد الاستخراج أو الخدمة، ولا جلسة وُصل إليها خلال EVICTION_MIN_IDLE_SECONDS
+# (حماية للجلسات التي تخدمها عمليات gunicorn أخرى)، ولا جلسة فيها علامة بناء حديثة: العلامة على القرص
+# فيراها عامل الحذف في كل العمليات، وتُحدّث دوريًا حتى لا تُعد علامة عملية ماتت أثناء البناء سارية للأبد.
+EXTRACTED_FILES_MAX_BYTES = int(os.environ.get("ARCHIVE_STORAGE_BUDGET_BYTES", 20 * 1024 ** 3))
+EVICTION_INTERVAL_SECONDS = 300
+EVICTION_MIN_IDLE_SECONDS = 600
+SESSION_SIZE_CACHE_TTL = 3600      # إعادة حساب حجم الجلسة على القرص بعد هذه المدة
+SESSION_ACCESS_TOUCH_INTERVAL = 60 # لا يُحدّث ملف آخر وصول أكثر من مرة في الدقيقة
+SESSION_BUILDING_HEARTBEAT_SECONDS = 30
+SESSION_BUILDING_STALE_SECONDS = 300 # علامة بناء لم تُحدّث خلال هذه المدة تخص عملية توقفت
+
+active_sessions = collections.Counter() # الجلسات قيد الاستخراج أو الخدمة في هذه العملية
+active_sessions_lock = threading.Lock()
+session_size_cache = {}           # session_id -> (الحجم، وقت حسابه)؛ تُضاف إليه كتابات التطبيق في الجلسة أولًا بأول
+session_size_lock = threading.Lock()
+evictor_started = False
+evictor_lock = threading.Lock()
+
+def acquire_session(session_id):
+    session_id = get_root_session_id(session_id) # الجلسة الفرعية تُحذف مع جلستها العليا فقط
+    with active_sessions_lock:
+        active_sessions[session_id] += 1
+
+def release_session(session_id):
+    session_id = get_root_session_id(session_id)
+    with active_sessions_lock:
+        active_sessions[session_id] -= 1
+        if active_sessions[session_id] <= 0:
+            del active_sessions[session_id]
+
+def is_session_active(session_id):
+    with active_sessions_lock:
+        return active_sessions[session_id] > 0
+
+def touch_session(session_folder):
+    """ تحديث وقت آخر وصول للجلسة (ملف علامة داخل مجلدها، أو مجلد الجلسة العليا لأرشيف متداخل). """
+    session_folder = session_folder.split(os.sep + NESTED_DIRNAME + os.sep, 1)[0]
+    marker_path = os.path.join(session_folder, SESSION_ACCESS_FILENAME)
+    now = time.time()
+    try:
+        if now - os.stat(marker_path).st_mtime < SESSION_ACCESS_TOUCH_INTERVAL:
+            return
+        os.utime(marker_path, (now, now))
+    except FileNotFoundError:
+        if os.path.isdir(session_folder):
+            open(marker_path, 'a').close()
+    except OSError as e:
+        logger.debug(f"تعذر تحديث وقت آخر وصول للجلسة {session_folder}: {e}")
+
+@contextlib.contextmanager
+def session_building(session_folder):
+    """ علامة بناء على القرص طوال التحميل وفك الضغط، يحدّثها خيط دوري ويحذفها عند الانتهاء. """
+    marker_path = os.path.join(session_folder, SESSION_BUILDING_FILENAME)
+    open(marker_path, 'a').close()
+    stop_event = threading.Event()
+
+    def heartbeat():
+        while not stop_event.wait(SESSION_BUILDING_HEARTBEAT_SECONDS):
+            try:
+                os.utime(marker_path)
+            except OSError as e:
+                logger.debug(f"تعذر تحديث علامة البناء {marker_path}: {e}")
+
+    heartbeat_thread = threading.Thread(target=heartbeat, name='session-building-heartbeat', daemon=True)
+    heartbeat_thread.start()
+    try:
+        yield
+    finally:
+        stop_event.set()
+        heartbeat_thread.join()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(marker_path)
+
+def is_session_building(session_folder):
+    try:
+        return time.time() - os.stat(os.path.join(session_folder, SESSION_BUILDING_FILENAME)).st_mtime < SESSION_BUILDING_STALE_SECONDS
+    except OSError:
+        return False
+
+def get_session_last_access(session_folder):
+    try:
+        return os.stat(os.path.join(session_folder, SESSION_ACCESS_FILENAME)).st_mtime
+    except OSError:
+        return os.stat(session_folder).st_mtime
+
+def get_folder_size(folder):
+    total_bytes = 0
+    for root, dirs, files in os.walk(folder):
+        for f_name in files:
+            try:
+                total_bytes += os.lstat(os.path.join(root, f_name)).st_size
+            except OSError:
+                pass
+    return total_bytes
+
+def get_session_size(session_id, session_folder):
+    with session_size_lock:
+        cached = session_size_cache.get(session_id)
+    if cached and time.time() - cached[1] < SESSION_SIZE_CACHE_TTL:
+        return cached[0]
+    size = get_folder_size(session_folder)
+    with session_size_lock:
+        session_size_cache[session_id] = (size, time.time())
+    return size
+
+def forget_session_size(session_id):
+    with session_size_lock:
+        session_size_cache.pop(session_id, None)
+
+def add_session_bytes(session_folder, delta_bytes):
+    """ تعديل الحجم المخزن للجلسة العليا عند كتابة التطبيق فيها أو الحذف منها (عناصر الوضع الكسول، الصور
+    المصغرة، نسخ gzip، فهرس البحث، الأرشيفات المتداخلة)، فلا تتجاوز الميزانية حتى انتهاء SESSION_SIZE_CACHE_TTL. """
+    relative_folder = os.path.relpath(session_folder, EXTRACTED_FILES_DIR_FLASK_APP)
+    session_id = relative_folder.split(os.sep, 1)[0]
+    if not delta_bytes or session_id in ('.', '..'):
+        return
+    with session_size_lock:
+        cached = session_size_cache.get(session_id)
+        if cached: # غير محسوب بعد: سيُحسب من القرص شاملًا الكتابة
+            session_size_cache[session_id] = (max(0, cached[0] + delta_bytes), cached[1])
+
+def get_file_size_or_zero(file_path):
+    try:
+        return os.path.getsize(file_path)
+    except OSError:
+        return 0
+
+def delete_session(session_id):
+    """ حذف مجلد الجلسة المستخرجة وكل مدخلات url_cache التي تشير إليها. """
+    session_folder = get_session_folder(session_id)
+    if session_folder:
+        shutil.rmtree(session_folder, ignore_errors=True)
+    forget_session_size(session_id)
+    forget_member_cache(session_id)
+    cache_delete_session(session_id)
+
+def evict_sessions_over_budget():
+    """ حذف الجلسات الأقدم وصولًا حتى يعود الحجم الكلي ضمن EXTRACTED_FILES_MAX_BYTES. يعيد عدد الجلسات المحذوفة. """
+    sessions = []
+    total_bytes = 0
+    for entry in os.scandir(EXTRACTED_FILES_DIR_FLASK_APP):
+        if not entry.is_dir():
+            continue
+        size = get_session_size(entry.name, entry.path)
+        sessions.append((get_session_last_access(entry.path), entry.name, entry.path, size))
+        total_bytes += size
+
+    if total_bytes <= EXTRACTED_FILES_MAX_BYTES:
+        return 0
+
+    evicted = 0
+    now = time.time()
+    for last_access, session_id, session_folder, size in sorted(sessions):
+        if total_bytes <= EXTRACTED_FILES_MAX_BYTES:
+            break
+        if is_session_active(session_id) or now - last_access < EVICTION_MIN_IDLE_SECONDS or is_session_building(session_folder):
+            continue
+        delete_session(session_id)
+        total_bytes -= size
+        evicted += 1
+        logger.info(f"تم حذف الجلسة {session_id} ({size / (1024 * 1024):.2f} MB) لتجاوز ميزانية التخزين.")
+
+    if total_bytes > EXTRACTED_FILES_MAX_BYTES:
+        logger.warning(f"لا يزال حجم الجلسات ({total_bytes} بايت) أكبر من الميزانية بعد الحذف؛ الجلسات المتبقية قيد الاستخدام.")
+    return evicted
+
+def run_session_evictor():
+    while True:
+        try:
+            evict_sessions_over_budget()
+        except Exception as e:
+            logger.exception(f"خطأ في عامل حذف الجلسات: {e}")
+        time.sleep(EVICTION_INTERVAL_SECONDS)
+
+def start_session_evictor():
+    global evictor_started
+    with evictor_lock:
+        if evictor_started:
+            return
+        evictor_started = True
+    threading.Thread(target=run_session_evictor, name='session-evictor', daemon=True).start()
+    logger.info(f"تم تشغيل عامل حذف الجلسات (الميزانية: {EXTRACTED_FILES_MAX_BYTES} بايت).")
+
+# --- بناء هيكل الملفات وفهرسه الثنائي ---
+# يُبنى الهيكل في مرور واحد على قائمة (المسار، هل هو مجلد، الحجم) مع قاموس مسار -> عقدة، فيُعثر على
+# العقدة الأصل مباشرة بدل البحث الخطي في أبناء كل مستوى. يُحفظ الهيكل JSON مضغوطًا (بلا مسافات)
+# إلى جانب فهرس ثنائي (.archive_index) من مصفوفات متجاورة يُحمّل دون تحليل JSON:
+# الأصل، الحجم، الأعلام، موضع الاسم، وأول ابن وعدد الأبناء (ترتيب BFS يجعل أبناء كل مجلد متجاورين).
+# وتُحفظ الصور بترتيب DFS مع مدى صور كل مجلد فيها، فتُعرض صور أي مجلد (مع مجلداته الفرعية) كشريحة واحدة.
+# وعدد المجلدات والصور بين الأبناء المباشرين لكل مجلد، فتُحسب صفحات /list المصفّاة دون المرور على الأبناء.
+ARCHIVE_INDEX_MAGIC = b'AVIX'
+ARCHIVE_INDEX_VERSION = 4
+ARCHIVE_INDEX_HEADER = struct.Struct('<4sHxxIII') # التوقيع، الإصدار، عدد العقد، طول كتلة الأسماء، عدد الصور
+ARCHIVE_INDEX_NO_PARENT = 0xFFFFFFFF
+INDEX_FLAG_DIRECTORY = 1
+INDEX_FLAG_IMAGE = 2
+INDEX_FLAG_ARCHIVE = 4 # ملف أرشيف يمكن تركيبه كجلسة فرعية (حسب الامتداد، ويُتحقق من التوقيع عند التركيب)
+# (اسم المصفوفة، رمز النوع في وحدة array، طولها) بترتيب تخزينها في الملف
+ARCHIVE_INDEX_ARRAYS = (
+    ('parents', 'I', 'nodes'), ('sizes', 'Q', 'nodes'), ('flags', 'B', 'nodes'),
+    ('first_child', 'I', 'nodes'), ('child_count', 'I', 'nodes'), ('name_offsets', 'I', 'nodes+1'),
+    ('image_start', 'I', 'nodes'), ('image_count', 'I', 'nodes'), ('image_ids', 'I', 'images'),
+    ('directory_child_count', 'I', 'nodes'), ('image_child_count', 'I', 'nodes'),
+)
+
+def walk_session_entries(start_path):
+    """ سرد ملفات ومجلدات الجلسة على القرص كـ (المسار النسبي، هل هو مجلد، الحجم) دون الملفات الداخلية. """
+    pending = [('', start_path)]
+    while pending:
+        rel_dir, abs_dir = pending.pop()
+        try:
+            dir_entries = list(os.scandir(abs_dir))
+        except OSError as e:
+            logger.error(f"تعذر قراءة المجلد {abs_dir}: {e}. تخطي العناصر في هذا المسار.")
+            continue
+        for entry in dir_entries:
+            if not rel_dir and entry.name in SESSION_INTERNAL_NAMES:
+                continue
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                pending.append((rel_path, entry.path))
+                yield rel_path, True, 0
+            else:
+                try:
+                    size = entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    size = 0
+                yield rel_path, False, size
+
+def _build_tree_from_entries(entries):
+    """ بناء الهيكل الهرمي في مرور واحد؛ يعيد (الهيكل، قاموس مسار الملف -> الحجم). """
+    structure = {'name': 'root', 'type': 'directory', 'path': '', 'children': []}
+    dir_map = {'': structure}
+    file_sizes = {}
+
+    def get_dir_node(dir_path):
+        # حلقة لا تعاود: أقرب مجلد أب موجود، ثم إنشاء المجلدات الناقصة نزولًا (مسارات بآلاف المستويات)
+        missing_paths = []
+        node = dir_map.get(dir_path)
+        while node is None:
+            missing_paths.append(dir_path)
+            dir_path = dir_path.rpartition('/')[0]
+            node = dir_map.get(dir_path)
+        for missing_path in reversed(missing_paths):
+            child = {'name': missing_path.rpartition('/')[2], 'type': 'directory', 'path': missing_path, 'children': []}
+            node['children'].append(child)
+            dir_map[missing_path] = child
+            node = child
+        return node
+
+    for entry_path, is_dir, size in entries:
+        if is_dir:
+            get_dir_node(entry_path)
+            continue
+        parent_path, _, f_name = entry_path.rpartition('/')
+        is_image = f_name.lower().endswith(SUPPORTED_IMAGE_EXTENSIONS)
+        get_dir_node(parent_path)['children'].append({'name': f_name, 'type': 'file', 'path': entry_path, 'is_image': is_image})
+        file_sizes[entry_path] = size or 0
+
+    # المجلدات أولًا ثم الملفات، كل منها مرتب أبجديًا
+    for node in dir_map.values():
+        node['children'].sort(key=lambda c: (c['type'] != 'directory', c['name']))
+    return structure, file_sizes
+
+def write_archive_index(structure, file_sizes, index_file_path):
+    """ تسطيح الهيكل بترتيب BFS إلى مصفوفات متجاورة وكتابتها في ملف الفهرس الثنائي. """
+    nodes = [structure]
+    columns = {name: array.array(typecode) for name, typecode, _ in ARCHIVE_INDEX_ARRAYS}
+    columns['parents'].append(ARCHIVE_INDEX_NO_PARENT)
+    names_blob = bytearray()
+    position = 0
+    while position < len(nodes):
+        node = nodes[position]
+        children = node.get('children')
+        is_dir = node['type'] == 'directory'
+        columns['sizes'].append(0 if is_dir else file_sizes.get(node['path'], 0))
+        columns['flags'].append((INDEX_FLAG_DIRECTORY if is_dir else 0) | (INDEX_FLAG_IMAGE if node.get('is_image') else 0)
+                                | (INDEX_FLAG_ARCHIVE if not is_dir and get_archive_type_by_extension(node['name']) else 0))
+        columns['first_child'].append(len(nodes) if children else 0)
+        columns['child_count'].append(len(children) if children else 0)
+        columns['directory_child_count'].append(sum(1 for child in children if child['type'] == 'directory') if children else 0)
+        columns['image_child_count'].append(sum(1 for child in children if child.get('is_image')) if children else 0)
+        columns['name_offsets'].append(len(names_blob))
+        names_blob += ('' if position == 0 else node['name']).encode('utf-8')
+        if children:
+            nodes.extend(children)
+            columns['parents'].extend([position] * len(children))
+        position += 1
+    columns['name_offsets'].append(len(names_blob))
+
+    # مرور DFS (بنفس ترتيب عرض الشجرة) لترقيم الصور وحساب مدى صور كل عقدة
+    image_ids, image_start, image_count = columns['image_ids'], [0] * len(nodes), [0] * len(nodes)
+    pending = [(0, False)]
+    while pending:
+        node_id, leaving = pending.pop()
+        if leaving:
+            image_count[node_id] = len(image_ids) - image_start[node_id]
+            continue
+        image_start[node_id] = len(image_ids)
+        if columns['flags'][node_id] & INDEX_FLAG_IMAGE:
+            image_ids.append(node_id)
+        pending.append((node_id, True))
+        first = columns['first_child'][node_id]
+        pending.extend((child_id, False) for child_id in reversed(range(first, first + columns['child_count'][node_id])))
+    columns['image_start'].extend(image_start)
+    columns['image_count'].extend(image_count)
+
+    temp_path = index_file_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(ARCHIVE_INDEX_HEADER.pack(ARCHIVE_INDEX_MAGIC, ARCHIVE_INDEX_VERSION, len(nodes), len(names_blob), len(image_ids)))
+        for name, _, _ in ARCHIVE_INDEX_ARRAYS:
+            column = columns[name]
+            if sys.byteorder != 'little':
+                column.byteswap()
+            column.tofile(f)
+        f.write(names_blob)
+    os.replace(temp_path, index_file_path)
+
+class ArchiveIndex:
+    """ قراءة الفهرس الثنائي للجلسة: العقدة 0 هي الجذر وأبناء كل مجلد متجاورون ومرتبون. """
+
+    def __init__(self, index_file_path):
+        with open(index_file_path, 'rb') as f:
+            data = f.read()
+        magic, version, node_count, names_length, image_total = ARCHIVE_INDEX_HEADER.unpack_from(data)
+        if magic != ARCHIVE_INDEX_MAGIC or version != ARCHIVE_INDEX_VERSION:
+            raise ValueError(f"ملف فهرس غير صالح أو بإصدار غير مدعوم: {index_file_path}")
+        lengths = {'nodes': node_count, 'nodes+1': node_count + 1, 'images': image_total}
+        offset = ARCHIVE_INDEX_HEADER.size
+        for name, typecode, length in ARCHIVE_INDEX_ARRAYS:
+            column = array.array(typecode)
+            count = lengths[length]
+            column.frombytes(data[offset:offset + count * column.itemsize])
+            if sys.byteorder != 'little':
+                column.byteswap()
+            setattr(self, name, column)
+            offset += count * column.itemsize
+        self.names_blob = data[offset:offset + names_length]
+        self.node_count = node_count
+
+    def __len__(self):
+        return self.node_count
+
+    def name(self, node_id):
+        return self.names_blob[self.name_offsets[node_id]:self.name_offsets[node_id + 1]].decode('utf-8')
+
+    def is_dir(self, node_id):
+        return bool(self.flags[node_id] & INDEX_FLAG_DIRECTORY)
+
+    def is_image(self, node_id):
+        return bool(self.flags[node_id] & INDEX_FLAG_IMAGE)
+
+    def is_archive(self, node_id):
+        return bool(self.flags[node_id] & INDEX_FLAG_ARCHIVE)
+
+    def children(self, node_id):
+        first = self.first_child[node_id]
+        return range(first, first + self.child_count[node_id])
+
+    def path(self, node_id):
+        parts = []
+        while node_id:
+            parts.append(self.name(node_id))
+            node_id = self.parents[node_id]
+        return '/'.join(reversed(parts))
+
+    def _find_child(self, node_id, name):
+        # الأبناء مرتبون بالمفتاح (ليس مجلدًا، الاسم): بحث ثنائي في المجلدات ثم في الملفات
+        first, end = self.first_child[node_id], self.first_child[node_id] + self.child_count[node_id]
+        for is_file in (False, True):
+            low, high = first, end
+            while low < high:
+                middle = (low + high) // 2
+                if (not self.is_dir(middle), self.name(middle)) < (is_file, name):
+                    low = middle + 1
+                else:
+                    high = middle
+            if low < end and self.is_dir(low) != is_file and self.name(low) == name:
+                return low
+        return None
+
+    def find(self, path):
+        """ رقم العقدة للمسار النسبي، أو None إن لم يوجد. """
+        node_id = 0
+        for part in filter(None, path.split('/')):
+            if not self.is_dir(node_id):
+                return None
+            node_id = self._find_child(node_id, part)
+            if node_id is None:
+                return None
+        return node_id
+
+    def node_dict(self, node_id, path=None, max_depth=None):
+        """ تحويل العقدة (وأبنائها حتى العمق المطلوب) إلى نفس شكل عقد ملف الهيكل JSON. """
+        path = self.path(node_id) if path is None else path
+        if not self.is_dir(node_id):
+            return {'name': self.name(node_id), 'type': 'file', 'path': path, 'is_image': self.is_image(node_id),
+                    'is_archive': self.is_archive(node_id)}
+        node = {'name': self.name(node_id) if node_id else 'root', 'type': 'directory', 'path': path,
+                'child_count': self.child_count[node_id], 'children': []}
+        if max_depth is None or max_depth > 0:
+            next_depth = None if max_depth is None else max_depth - 1
+            for child_id in self.children(node_id):
+                child_name = self.name(child_id)
+                node['children'].append(self.node_dict(child_id, f"{path}/{child_name}" if path else child_name, next_depth))
+        return node
+
+    def item_dict(self, node_id, path):
+        """ وصف عنصر واحد في ردود القوائم المجزأة (دون أبنائه). """
+        item = {'name': self.name(node_id), 'type': 'directory' if self.is_dir(node_id) else 'file', 'path': path}
+        if self.is_dir(node_id):
+            item['child_count'] = self.child_count[node_id]
+            item['image_count'] = self.image_count[node_id]
+        else:
+            item['is_image'] = self.is_image(node_id)
+            item['is_archive'] = self.is_archive(node_id)
+            item['size'] = self.sizes[node_id]
+        return item
+
+    def children_of_kind(self, node_id, kind=None):
+        """ أبناء المجلد مصفّين حسب النوع (directory أو file أو image) كمدى أو شريحة، دون المرور عليهم. """
+        children = self.children(node_id)
+        if kind == 'directory': # المجلدات في بداية الأبناء
+            return children[:self.directory_child_count[node_id]]
+        if kind == 'file':
+            return children[self.directory_child_count[node_id]:]
+        if kind == 'image': # ترتيب DFS يضع صور المجلدات الفرعية أولًا ثم صور الأبناء المباشرين في نهاية المدى
+            end = self.image_start[node_id] + self.image_count[node_id]
+            return self.image_ids[end - self.image_child_count[node_id]:end]
+        return children
+
+    def images_under(self, node_id):
+        """ كل صور المجلد ومجلداته الفرعية بترتيب DFS (شريحة من image_ids). """
+        start = self.image_start[node_id]
+        return self.image_ids[start:start + self.image_count[node_id]]
+
+@functools.lru_cache(maxsize=32)
+def _load_archive_index_cached(index_file_path, mtime_ns):
+    return ArchiveIndex(index_file_path)
+
+def load_archive_index(session_folder):
+    """ تحميل فهرس الجلسة (مع كاش في الذاكرة يُبطل عند تغير الملف)، أو None إن لم يوجد. """
+    index_file_path = os.path.join(session_folder, ARCHIVE_INDEX_FILENAME)
+    try:
+        return _load_archive_index_cached(index_file_path, os.stat(index_file_path).st_mtime_ns)
+    except (OSError, ValueError, struct.error) as e:
+        logger.debug(f"تعذر تحميل فهرس الجلسة {index_file_path}: {e}")
+        return None
+
+def ensure_archive_index(session_folder):
+    """ تحميل فهرس الجلسة، أو إعادة بنائه من ملف الهيكل JSON (جلسات قديمة أو فهرس بإصدار سابق). """
+    archive_index = load_archive_index(session_folder)
+    if archive_index is not None:
+        return archive_index
+    structure_file_path = os.path.join(session_folder, STRUCTURE_FILENAME)
+    try:
+        with open(structure_file_path, 'r', encoding='utf-8') as f:
+            structure = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"تعذر إعادة بناء فهرس الجلسة من {structure_file_path}: {e}")
+        return None
+    file_sizes = {}
+    pending = [structure]
+    while pending:
+        node = pending.pop()
+        for child in node.get('children', []):
+            if child['type'] == 'directory':
+                pending.append(child)
+                continue
+            try:
+                file_sizes[child['path']] = os.path.getsize(os.path.join(session_folder, child['path']))
+            except OSError: # عنصر لم يُستخرج بعد في الجلسات الكسولة
+                pass
+    write_archive_index(structure, file_sizes, os.path.join(session_folder, ARCHIVE_INDEX_FILENAME))
+    logger.info(f"تمت إعادة بناء فهرس الجلسة من ملف الهيكل: {session_folder}")
+    return load_archive_index(session_folder)
+
+def save_structure_files(structure, file_sizes, session_id):
+    """ حفظ ملف الهيكل JSON المضغوط والفهرس الثنائي وفهرس البحث في مجلد الجلسة. """
+    session_folder = get_session_folder(session_id)
+    structure_file_path = os.path.join(session_folder, STRUCTURE_FILENAME)
+    try:
+        with open(structure_file_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(structure, ensure_ascii=False, separators=(',', ':'))) # dumps يستخدم المُرمّز المكتوب بـ C بخلاف dump
+        archive_index_file_path = os.path.join(session_folder, ARCHIVE_INDEX_FILENAME)
+        write_archive_index(structure, file_sizes, archive_index_file_path)
+        write_search_index(ArchiveIndex(archive_index_file_path), os.path.join(session_folder, SEARCH_INDEX_FILENAME))
+        logger.info(f"تم حفظ الهيكل والفهرس وفهرس البحث في مجلد الجلسة: {session_folder}")
+    except Exception as e:
+        logger.error(f"خطأ في حفظ ملف الهيكل {structure_file_path}: {e}")
+
 def build_file_structure(start_path, session_id):
     """ بناء هيكل هرمي للملفات والمجلدات. """
-    structure = {'name': 'root', 'type': 'directory', 'path': '', 'children': []}
-    structure_file_path = os.path.join(EXTRACTED_FILES_DIR_FLASK_APP, session_id, '.archive_structure.json')
+    structure_file_path = os.path.join(EXTRACTED_FILES_DIR_FLASK_APP, session_id, STRUCTURE_FILENAME)
 
     if os.path.exists(structure_file_path):
         try:
@@ -114,364 +752,2700 @@ def build_file_structure(start_path, session_id):
         except Exception as e:
             logger.error(f"خطأ في تحميل ملف الهيكل الم缓存 {structure_file_path}: {e}. إعادة البناء.")
 
-    dir_map = {start_path: structure}
-
-    for root, dirs, files in os.walk(start_path):
-        rel_root = os.path.relpath(root, start_path)
-        if rel_root == '.': rel_root = ''
-
-        parent_node = structure
-        if rel_root:
-            path_parts = rel_root.split(os.sep)
-            current_search_node = structure
-            found = True
-            for part in path_parts:
-                child_node = next((c for c in current_search_node['children'] if c['name'] == part and c['type'] == 'directory'), None)
-                if child_node:
-                    current_search_node = child_node
-                else:
-                    found = False; break
-            if found:
-                 parent_node = current_search_node
-            else:
-                logger.error(f"لم يتم العثور على العقدة الأصل لـ {rel_root}. تخطي العناصر في هذا المسار.")
-                continue
-
-        for d_name in sorted(dirs):
-            dir_path_abs = os.path.join(root, d_name)
-            dir_path_rel = os.path.relpath(dir_path_abs, start_path).replace(os.sep, '/')
-            dir_node = {'name': d_name, 'type': 'directory', 'path': dir_path_rel, 'children': []}
-            parent_node['children'].append(dir_node)
-
-        for f_name in sorted(files):
-            if f_name == '.archive_structure.json': continue
-            file_path_abs = os.path.join(root, f_name)
-            file_path_rel = os.path.relpath(file_path_abs, start_path).replace(os.sep, '/')
-            is_image = f_name.lower().endswith(SUPPORTED_IMAGE_EXTENSIONS)
-            file_node = {'name': f_name, 'type': 'file', 'path': file_path_rel, 'is_image': is_image}
-            parent_node['children'].append(file_node)
+    structure, file_sizes = _build_tree_from_entries(walk_session_entries(start_path))
+    save_structure_files(structure, file_sizes, session_id)
+    return structure
 
+# --- فهرس البحث في أسماء الملفات ---
+# يُبنى مع الفهرس الثنائي: أسماء كل العقد بأحرف صغيرة (UTF-8) في كتلة واحدة تنتهي فيها الأسماء بـ \0،
+# بترتيب أرقام العقد نفسه، مع موضع بداية كل اسم. البحث مسح للكتلة بـ bytes.find (مكتوب بلغة C) ثم
+# تحويل كل موضع إلى رقم عقدة ببحث ثنائي في المواضع، دون فك ترميز الأسماء أثناء المسح. الجذر بلا اسم
+# فيسبق \0 كل اسم آخر: البحث عن البادئة هو البحث عن "\0" + الاستعلام، والتطابق التام بإضافة \0 بعده.
+SEARCH_INDEX_MAGIC = b'AVSI'
+SEARCH_INDEX_VERSION = 1
+SEARCH_INDEX_HEADER = struct.Struct('<4sHxxII') # التوقيع، الإصدار، عدد العقد، طول كتلة الأسماء
+SEARCH_MAX_RESULTS = 10000      # حد النتائج المرتبة لكل استعلام (complete=false عند بلوغه)
+SEARCH_MAX_QUERY_LENGTH = 256
+SEARCH_WORD_SEPARATORS = b' _-.()[]{}+,'
+
+def write_search_index(archive_index, search_index_file_path):
+    """ كتابة جدول الأسماء بأحرف صغيرة لكل عقد الفهرس الثنائي. """
+    names_blob = ('\0'.join(archive_index.name(node_id) if node_id else '' for node_id in range(len(archive_index))) + '\0').lower().encode('utf-8')
+    offsets = array.array('I', itertools.accumulate((len(name) + 1 for name in names_blob.split(b'\0')[:-1]), initial=0))
+
+    temp_path = search_index_file_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(SEARCH_INDEX_HEADER.pack(SEARCH_INDEX_MAGIC, SEARCH_INDEX_VERSION, len(archive_index), len(names_blob)))
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        offsets.tofile(f)
+        f.write(names_blob)
+    os.replace(temp_path, search_index_file_path)
+
+class SearchIndex:
+    """ قراءة جدول أسماء البحث والبحث فيه؛ أرقام العقد هي نفسها في ArchiveIndex. """
+
+    def __init__(self, search_index_file_path):
+        with open(search_index_file_path, 'rb') as f:
+            data = f.read()
+        magic, version, node_count, names_length = SEARCH_INDEX_HEADER.unpack_from(data)
+        if magic != SEARCH_INDEX_MAGIC or version != SEARCH_INDEX_VERSION:
+            raise ValueError(f"ملف فهرس بحث غير صالح أو بإصدار غير مدعوم: {search_index_file_path}")
+        offset = SEARCH_INDEX_HEADER.size
+        self.offsets = array.array('I')
+        self.offsets.frombytes(data[offset:offset + (node_count + 1) * self.offsets.itemsize])
+        if sys.byteorder != 'little':
+            self.offsets.byteswap()
+        offset += (node_count + 1) * self.offsets.itemsize
+        self.names_blob = data[offset:offset + names_length]
+        self.node_count = node_count
+
+    def lower_name(self, node_id):
+        return self.names_blob[self.offsets[node_id]:self.offsets[node_id + 1] - 1]
+
+    def _scan(self, needle, accept, seen, limit):
+        """ العقد التي يحتوي اسمها needle بترتيب أرقامها، دون المكررة في seen، حتى limit عقدة. """
+        found = []
+        find, offsets = self.names_blob.find, self.offsets
+        shift = 1 if needle.startswith(b'\0') else 0 # الموضع عندها هو نهاية الاسم السابق
+        start = 0
+        while len(found) < limit:
+            position = find(needle, start)
+            if position < 0:
+                break
+            node_id = bisect.bisect_right(offsets, position + shift) - 1
+            start = offsets[node_id + 1] - shift
+            if node_id and node_id not in seen and accept(node_id):
+                seen.add(node_id)
+                found.append(node_id)
+        return found
+
+    def search(self, archive_index, query, extensions=(), is_image=None, limit=SEARCH_MAX_RESULTS):
+        """ بحث بلا حساسية لحالة الأحرف؛ يعيد (أرقام العقد مرتبة، هل النتائج كاملة). """
+        def accept(node_id):
+            if is_image is not None and archive_index.is_image(node_id) != is_image:
+                return False
+            return not extensions or (not archive_index.is_dir(node_id) and self.lower_name(node_id).endswith(extensions))
+
+        query = query.lower().replace('\0', '').strip()
+        if '/' in query.strip('/'):
+            # استعلام مسار: آخر جزء منه بداية اسم العقدة، وما قبله نهاية مسار المجلد الأصل
+            # المجلدات المطابقة لما قبل الجزء الأخير أولًا (عادة قليلة)، ثم أبناؤها المتجاورون في الفهرس
+            head, last_part = query.strip('/').rsplit('/', 1)
+            head_tail, last_part = head.rsplit('/', 1)[-1].encode('utf-8'), last_part.encode('utf-8')
+            def is_matching_parent(node_id):
+                return (archive_index.is_dir(node_id) and self.lower_name(node_id).endswith(head_tail)
+                        and archive_index.path(node_id).lower().endswith(head))
+            results = []
+            for parent_id in self._scan(head_tail, is_matching_parent, set(), self.node_count) if head_tail else ():
+                results.extend(child_id for child_id in archive_index.children(parent_id)
+                               if self.lower_name(child_id).startswith(last_part) and accept(child_id))
+                if len(results) > limit:
+                    break
+            results.sort(key=lambda node_id: (self.offsets[node_id + 1] - self.offsets[node_id], node_id))
+        else:
+            needle = query.strip('/').encode('utf-8')
+            if not needle:
+                return [], True
+            # الترتيب: تطابق تام، ثم بداية الاسم، ثم بداية كلمة، ثم أي موضع؛ الأسماء الأقصر أولًا
+            seen = set()
+            results = self._scan(b'\0' + needle + b'\0', accept, seen, limit + 1)
+            prefix_matches = self._scan(b'\0' + needle, accept, seen, limit + 1 - len(results))
+            other_matches = self._scan(needle, accept, seen, limit + 1 - len(results) - len(prefix_matches))
+
+            def word_start_rank(node_id):
+                name = self.lower_name(node_id)
+                return (name[name.find(needle) - 1] not in SEARCH_WORD_SEPARATORS, len(name), node_id)
+            prefix_matches.sort(key=lambda node_id: (self.offsets[node_id + 1] - self.offsets[node_id], node_id))
+            other_matches.sort(key=word_start_rank)
+            results += prefix_matches + other_matches
+        return results[:limit], len(results) <= limit
+
+@functools.lru_cache(maxsize=32)
+def _load_search_index_cached(search_index_file_path, mtime_ns):
+    return SearchIndex(search_index_file_path)
+
+def ensure_search_index(session_folder, archive_index):
+    """ تحميل فهرس البحث للجلسة، أو بناؤه من الفهرس الثنائي إن لم يوجد أو كان أقدم منه. """
+    search_index_file_path = os.path.join(session_folder, SEARCH_INDEX_FILENAME)
+    archive_index_mtime = os.stat(os.path.join(session_folder, ARCHIVE_INDEX_FILENAME)).st_mtime_ns
     try:
-        with open(structure_file_path, 'w', encoding='utf-8') as f:
-            json.dump(structure, f, ensure_ascii=False, indent=2)
-        logger.info(f"تم حفظ الهيكل الجديد في ملف الكاش: {structure_file_path}")
-    except Exception as e:
-        logger.error(f"خطأ في حفظ ملف الهيكل {structure_file_path}: {e}")
+        mtime_ns = os.stat(search_index_file_path).st_mtime_ns
+        if mtime_ns >= archive_index_mtime:
+            search_index = _load_search_index_cached(search_index_file_path, mtime_ns)
+            if len(search_index.offsets) == len(archive_index) + 1:
+                return search_index
+    except (OSError, ValueError, struct.error) as e:
+        logger.debug(f"تعذر تحميل فهرس البحث {search_index_file_path}: {e}")
+    previous_size = get_file_size_or_zero(search_index_file_path)
+    write_search_index(archive_index, search_index_file_path)
+    add_session_bytes(session_folder, get_file_size_or_zero(search_index_file_path) - previous_size)
+    logger.info(f"تم بناء فهرس البحث للجلسة: {session_folder}")
+    return _load_search_index_cached(search_index_file_path, os.stat(search_index_file_path).st_mtime_ns)
+
+@functools.lru_cache(maxsize=128)
+def _search_session_cached(session_folder, archive_index_mtime_ns, query, extensions, is_image):
+    archive_index = load_archive_index(session_folder)
+    return ensure_search_index(session_folder, archive_index).search(archive_index, query, extensions, is_image)
+
+def search_session(session_folder, query, extensions=(), is_image=None):
+    """ نتائج البحث في الجلسة، مع كاش للاستعلامات الأخيرة حتى يكون التنقل بين الصفحات فوريًا. """
+    archive_index_mtime_ns = os.stat(os.path.join(session_folder, ARCHIVE_INDEX_FILENAME)).st_mtime_ns
+    return _search_session_cached(session_folder, archive_index_mtime_ns, query, tuple(extensions), is_image)
+
+# --- كشف نوع الأرشيف من التواقيع (magic bytes) ---
+# قراءة واحدة لأول بضعة كيلوبايت (ونهاية الملف لـ ZIP فقط عند الحاجة) بدلًا من تجربة
+# rarfile/zipfile/tarfile/py7zr واحدًا تلو الآخر، مع تحديد الضغط المستخدم (codec).
+ARCHIVE_SNIFF_HEAD_BYTES = 8192
+ARCHIVE_SNIFF_TAIL_BYTES = 65536 + 22              # سجل EOCD مع أطول تعليق ممكن لـ ZIP
+ARCHIVE_SNIFF_MAX_DECOMPRESS_INPUT = 1024 * 1024   # bzip2 لا يخرج بيانات قبل اكتمال كتلة كاملة
+RAR5_SIGNATURE = b'Rar!\x1a\x07\x01\x00'
+RAR4_SIGNATURE = b'Rar!\x1a\x07\x00'
+SEVEN_ZIP_SIGNATURE = b'7z\xbc\xaf\x27\x1c'
+ZIP_LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+ZIP_EOCD_SIGNATURE = b'PK\x05\x06'
+ZIP_SPANNED_SIGNATURE = b'PK\x07\x08'
+ZIP_COMPRESSION_CODECS = {0: 'stored', 8: 'deflate', 9: 'deflate64', 12: 'bzip2', 14: 'lzma', 93: 'zstd', 95: 'xz', 98: 'ppmd', 99: 'aes'}
+# (التوقيع، اسم الضغط، منشئ فك الضغط أو None إذا لم تدعمه tarfile)
+TAR_WRAPPER_SIGNATURES = (
+    (b'\x1f\x8b', 'gzip', lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)),
+    (b'BZh', 'bzip2', bz2.BZ2Decompressor),
+    (b'\xfd7zXZ\x00', 'xz', lzma.LZMADecompressor),
+    (b'\x28\xb5\x2f\xfd', 'zstd', None),
+)
+ARCHIVE_EXTENSION_TYPES = (
+    ('.rar', 'rar'), ('.zip', 'zip'),
+    (('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz'), 'tar'),
+    ('.7z', '7z'),
+)
+
+def _is_tar_header(block):
+    """ التحقق من أن أول 512 بايت ترويسة tar (توقيع ustar أو مجموع تحقق صالح لصيغة v7). """
+    if len(block) < 512 or block[0] == 0:
+        return False
+    if block[257:262] == b'ustar':
+        return True
+    try:
+        stored_checksum = int(block[148:156].split(b'\0', 1)[0].strip() or b'-1', 8)
+    except ValueError:
+        return False
+    return stored_checksum == sum(block[:148]) + 8 * 32 + sum(block[156:512])
 
-    return structure
+def _zip_codec_from_local_header(header):
+    if len(header) < 10:
+        return None
+    method = struct.unpack('<H', header[8:10])[0]
+    return ZIP_COMPRESSION_CODECS.get(method, f'method-{method}')
+
+def _sniff_zip_tail(f, size):
+    """ البحث عن سجل EOCD في نهاية الملف (ZIP ذاتي الاستخراج أو فارغ) وقراءة ضغط أول عنصر. """
+    tail_start = max(0, size - ARCHIVE_SNIFF_TAIL_BYTES)
+    f.seek(tail_start)
+    tail = f.read()
+    eocd_pos = tail.rfind(ZIP_EOCD_SIGNATURE)
+    if eocd_pos < 0 or len(tail) - eocd_pos < 22:
+        return None
+    entries, _, cd_offset = struct.unpack('<HII', tail[eocd_pos + 10:eocd_pos + 20])
+    codec = None
+    if entries and cd_offset + 46 <= size:
+        f.seek(cd_offset)
+        central_header = f.read(46)
+        if central_header[:4] == b'PK\x01\x02':
+            method = struct.unpack('<H', central_header[10:12])[0]
+            codec = ZIP_COMPRESSION_CODECS.get(method, f'method-{method}')
+    return {'type': 'zip', 'codec': codec}
+
+def _sniff_compressed_tar(f, head, make_decompressor):
+    """ فك ضغط بداية الملف فقط للتحقق من وجود ترويسة tar داخل الغلاف المضغوط. """
+    decompressor = make_decompressor()
+    pending, consumed, output = head, len(head), b''
+    f.seek(consumed)
+    try:
+        while len(output) < 512:
+            # max_length يوقف فك الضغط عند أول ترويسة بدل إخراج كتلة bzip2 كاملة (~900KB)
+            output += decompressor.decompress(pending, 512 - len(output))
+            pending = getattr(decompressor, 'unconsumed_tail', b'') # zlib يعيد ما لم يُستهلك بدل تخزينه
+            if len(output) >= 512 or pending:
+                continue
+            if consumed >= ARCHIVE_SNIFF_MAX_DECOMPRESS_INPUT:
+                break
+            pending = f.read(ARCHIVE_SNIFF_HEAD_BYTES * 8)
+            if not pending:
+                break
+            consumed += len(pending)
+    except (zlib.error, OSError, EOFError, lzma.LZMAError):
+        return False
+    return _is_tar_header(output[:512])
+
+def sniff_archive(filepath):
+    """ تحديد صيغة الأرشيف وضغطه من التواقيع: {'type': rar|zip|tar|7z|None, 'codec': ...}. """
+    with open(filepath, 'rb') as f:
+        head = f.read(ARCHIVE_SNIFF_HEAD_BYTES)
+        if head.startswith(RAR5_SIGNATURE):
+            return {'type': 'rar', 'codec': 'rar5'}
+        if head.startswith(RAR4_SIGNATURE):
+            return {'type': 'rar', 'codec': 'rar4'}
+        if head.startswith(SEVEN_ZIP_SIGNATURE):
+            return {'type': '7z', 'codec': None} # الضغط مذكور في الترويسة النهائية (قد تكون مضغوطة بدورها)
+        if head.startswith(ZIP_LOCAL_HEADER_SIGNATURE):
+            return {'type': 'zip', 'codec': _zip_codec_from_local_header(head)}
+        if head.startswith(ZIP_SPANNED_SIGNATURE) and head[4:8] == ZIP_LOCAL_HEADER_SIGNATURE:
+            return {'type': 'zip', 'codec': _zip_codec_from_local_header(head[4:])}
+        for signature, codec, make_decompressor in TAR_WRAPPER_SIGNATURES:
+            if head.startswith(signature):
+                if make_decompressor and _sniff_compressed_tar(f, head, make_decompressor):
+                    return {'type': 'tar', 'codec': codec}
+                return {'type': None, 'codec': codec}
+        if _is_tar_header(head[:512]):
+            return {'type': 'tar', 'codec': None}
+        size = os.fstat(f.fileno()).st_size
+        sniffed_zip = _sniff_zip_tail(f, size)
+        if sniffed_zip:
+            return sniffed_zip
+    if head.startswith(b'MZ'): # ملف تنفيذي ذاتي الاستخراج: rarfile يبحث عن التوقيع داخل الملف
+        try:
+            if rarfile.is_rarfile(filepath):
+                return {'type': 'rar', 'codec': 'sfx'}
+        except Exception as e:
+            logger.debug(f"Error checking SFX RAR for {filepath}: {e}")
+    return {'type': None, 'codec': None}
+
+def get_archive_type_by_extension(filename):
+    filename = filename.lower()
+    for extensions, archive_type in ARCHIVE_EXTENSION_TYPES:
+        if filename.endswith(extensions):
+            return archive_type
+    return None
 
 def get_archive_type(filepath):
     if not os.path.exists(filepath): # Check existence once
         logger.warning(f"File not found for type checking: {filepath}")
         return None
 
-    filename = os.path.basename(filepath).lower()
-    archive_type_found = None
+    sniffed = sniff_archive(filepath)
+    if sniffed['type']:
+        logger.debug(f"Identified as {sniffed['type']} (codec: {sniffed['codec']}) by signature: {filepath}")
+        return sniffed['type']
 
-    # Attempt to identify by library checks first
-    try:
-        if rarfile.is_rarfile(filepath):
-            archive_type_found = 'rar'
-            logger.debug(f"Identified as RAR by rarfile: {filepath}")
-            return archive_type_found
-    except Exception as e:
-        logger.debug(f"Not a RAR file or error checking RAR for {filepath}: {e}")
-        pass # Continue to next check
+    # Fallback to extension-based check if the signature was not recognised
+    logger.debug(f"Falling back to extension-based type check for {filepath}")
+    archive_type = get_archive_type_by_extension(os.path.basename(filepath))
+    if archive_type:
+        logger.debug(f"Identified as {archive_type} by extension: {filepath}")
+        return archive_type
 
-    try:
-        if zipfile.is_zipfile(filepath):
-            archive_type_found = 'zip'
-            logger.debug(f"Identified as ZIP by zipfile: {filepath}")
-            return archive_type_found
-    except Exception as e:
-        logger.debug(f"Not a ZIP file or error checking ZIP for {filepath}: {e}")
-        pass
+    logger.info(f"Could not determine archive type for {filepath} using signatures or common extensions.")
+    return None
 
+class ArchiveProcessingError(Exception):
+    """ خطأ في المعالجة يحمل رسالة موجهة للمستخدم ورمز HTTP المناسب. """
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+# --- المقاييس (صيغة Prometheus النصية) ---
+# مدرجات زمنية لكل مرحلة من مراحل المعالجة وعدادات بايتات حسب المصدر (MEGA أو Google Drive أو رابط
+# مباشر) ونوع الأرشيف، تُعرض على /metrics. القيم خاصة بكل عملية: مع عدة عمليات gunicorn يُجمع
+# Prometheus قيم العملية التي أجابت على كل طلب، فيُفضل تشغيل المقاييس مع عامل واحد أو وسم لكل عملية.
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+metrics_lock = threading.Lock()
+
+def _format_metric_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values)) + (extra or [])
+    if not pairs:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+def _format_metric_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class MetricCounter:
+    """ عداد تراكمي بوسوم (labels) ثابتة الأسماء. """
+    def __init__(self, name, help_text, label_names=()):
+        self.name, self.help_text, self.label_names = name, help_text, tuple(label_names)
+        self.values = collections.defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name) or 'unknown' for name in self.label_names)
+        with metrics_lock:
+            self.values[key] += amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with metrics_lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{_format_metric_labels(self.label_names, key)} {_format_metric_value(value)}')
+        return lines
+
+class MetricHistogram:
+    """ مدرج تكراري تراكمي (buckets) مع المجموع والعدد لكل مجموعة وسوم. """
+    def __init__(self, name, help_text, label_names=(), buckets=METRICS_LATENCY_BUCKETS):
+        self.name, self.help_text, self.label_names = name, help_text, tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.series = {} # الوسوم -> [عدادات الفئات..., المجموع، العدد]
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name) or 'unknown' for name in self.label_names)
+        with metrics_lock:
+            series = self.series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with metrics_lock:
+            for key, series in sorted(self.series.items()):
+                for upper_bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{_format_metric_labels(self.label_names, key, [("le", f"{upper_bound:g}")])} {count}')
+                lines.append(f'{self.name}_bucket{_format_metric_labels(self.label_names, key, [("le", "+Inf")])} {series[-1]}')
+                lines.append(f'{self.name}_sum{_format_metric_labels(self.label_names, key)} {_format_metric_value(series[-2])}')
+                lines.append(f'{self.name}_count{_format_metric_labels(self.label_names, key)} {series[-1]}')
+        return lines
+
+def render_gauge(name, help_text, value):
+    return [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {_format_metric_value(value)}']
+
+STAGE_LABELS = ('stage', 'source', 'archive_type')
+STAGE_DURATION = MetricHistogram('archive_stage_duration_seconds', 'Duration of each archive processing stage.', STAGE_LABELS)
+STAGE_BYTES = MetricCounter('archive_stage_bytes_total', 'Bytes handled by each archive processing stage (rate() gives bytes/sec).', STAGE_LABELS)
+ARCHIVE_JOBS = MetricCounter('archive_jobs_total', 'Finished archive processing runs.', ('source', 'archive_type', 'outcome'))
+URL_CACHE_LOOKUPS = MetricCounter('url_cache_lookups_total', 'url_cache lookups for /process-archive.', ('result',))
+HTTP_REQUEST_DURATION = MetricHistogram('http_request_duration_seconds', 'Flask request latency (until the response is returned).', ('endpoint', 'method', 'status'))
+
+def archive_source(original_archive_url):
+    """ مصدر الرابط كما يفرّقه download_archive: mega أو google_drive أو direct. """
+    if "mega.nz" in original_archive_url or "mega.co.nz" in original_archive_url:
+        return 'mega'
+    if "drive.google.com" in original_archive_url:
+        return 'google_drive'
+    return 'direct'
+
+def observe_stage(progress, stage, seconds, byte_count=None):
+    """ تسجيل مدة مرحلة (وبايتاتها إن وُجدت) في المقاييس موسومة بمصدر المهمة ونوع أرشيفها. """
+    labels = {'stage': stage}
+    if progress is not None:
+        labels.update(source=progress.get('source'), archive_type=progress.get('archive_type'))
+        if byte_count is None: # مراحل بلا بايتات تظهر في stage_stats بمدتها فقط (record_stage_throughput يسجل الباقي)
+            with jobs_lock:
+                progress.setdefault('stage_stats', {})[stage] = {'seconds': round(seconds, 3)}
+    STAGE_DURATION.observe(seconds, **labels)
+    if byte_count is not None:
+        STAGE_BYTES.inc(byte_count, **labels)
+
+def get_extracted_files_usage():
+    """ (عدد الجلسات، الحجم الكلي) لمجلد extracted_files، من ذاكرة أحجام الجلسات قدر الإمكان. """
+    session_count = total_bytes = 0
     try:
-        # tarfile.is_tarfile can check for .tar, .tar.gz, .tar.bz2 etc.
-        if tarfile.is_tarfile(filepath):
-            archive_type_found = 'tar'
-            logger.debug(f"Identified as TAR by tarfile: {filepath}")
-            return archive_type_found
+        entries = list(os.scandir(EXTRACTED_FILES_DIR_FLASK_APP))
+    except FileNotFoundError:
+        return 0, 0
+    for entry in entries:
+        if entry.is_dir():
+            session_count += 1
+            total_bytes += get_session_size(entry.name, entry.path)
+    return session_count, total_bytes
+
+def render_metrics():
+    lines = []
+    for metric in (STAGE_DURATION, STAGE_BYTES, ARCHIVE_JOBS, URL_CACHE_LOOKUPS, HTTP_REQUEST_DURATION):
+        lines.extend(metric.render())
+    with metrics_lock:
+        hits = URL_CACHE_LOOKUPS.values.get(('hit',), 0)
+        lookups = hits + URL_CACHE_LOOKUPS.values.get(('miss',), 0)
+    lines.extend(render_gauge('url_cache_hit_ratio', 'Share of url_cache lookups that were hits.', hits / lookups if lookups else 0))
+    with jobs_lock:
+        in_flight = len(inflight_jobs)
+    lines.extend(render_gauge('archive_jobs_in_flight', 'Archive processing jobs currently queued or running.', in_flight))
+    session_count, disk_bytes = get_extracted_files_usage()
+    lines.extend(render_gauge('extracted_files_sessions', 'Sessions stored in extracted_files.', session_count))
+    lines.extend(render_gauge('extracted_files_disk_bytes', 'Disk usage of extracted_files.', disk_bytes))
+    lines.extend(render_gauge('extracted_files_budget_bytes', 'Storage budget for extracted_files.', EXTRACTED_FILES_MAX_BYTES))
+    return '\n'.join(lines) + '\n'
+
+# --- مهام المعالجة في الخلفية (وضع المهام) ---
+# مجمع عمال محدود يقوم بمراحل التحميل وفك الضغط وبناء الهيكل بعيدًا عن عمال الويب،
+# ويعيد الطلب معرّف مهمة فورًا يمكن الاستعلام عن حالتها عبر /job-status/<job_id>.
+# سجل المهام في ذاكرة العملية المنفذة، مع لقطة منه في جدول jobs بقاعدة SQLite: مع عدة عمليات gunicorn
+# قد يصل الاستعلام عن المهمة إلى عملية غير التي تنفذها.
+JOB_WORKERS = int(os.environ.get("ARCHIVE_JOB_WORKERS", 2))
+JOB_RETENTION_SECONDS = 3600 # مدة الاحتفاظ بالمهام المنتهية في الذاكرة وقاعدة البيانات
+JOB_STALE_SECONDS = 24 * 3600 # مهام لم تُحدَّث منذ يوم (عملية توقفت أثناء التنفيذ) تُحذف من قاعدة البيانات
+JOB_STATE_SAVE_INTERVAL = 1 # ثوانٍ بين حفظ تقدم المهمة في قاعدة البيانات؛ تغير الحالة أو المرحلة يُحفظ فورًا
+
+job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='archive-job')
+jobs = {}
+jobs_lock = threading.Lock()
+job_saved_at = {} # job_id -> وقت آخر حفظ للمهمة في قاعدة البيانات
+
+def new_progress(job_id=None, url_hash=None):
+    """ إنشاء سجل تقدم لمهمة (يستخدم أيضًا في الوضع المتزامن دون أن يُعرض). """
+    now = time.time()
+    return {
+        'job_id': job_id,
+        'url_hash': url_hash,
+        'status': 'queued',       # queued | running | done | error
+        'stage': 'queued',        # queued | downloading | detecting | extracting | indexing | building_structure | done
+        'bytes_downloaded': 0,
+        'bytes_total': None,
+        'bytes_extracted': 0,
+        'extract_total': None,
+        'archive_type': None,
+        'archive_codec': None,
+        'volumes_total': None,    # لمجموعات الأجزاء فقط
+        'volumes_downloaded': 0,
+        'source': None,           # mega | google_drive | direct (وسم المقاييس)
+        'stage_stats': {},        # المرحلة -> {bytes, seconds, mb_per_s}
+        'session_id': None,
+        'result': None,
+        'error': None,
+        'status_code': None,
+        'created_at': now,
+        'updated_at': now,
+    }
+
+PROGRESS_BYTE_FIELDS = ('bytes_downloaded', 'bytes_total')
+
+def new_volume_progress(progress):
+    """ سجل تقدم لجزء واحد من مجموعة: تحميل كل جزء يضبط bytes_total وbytes_downloaded بقيم الجزء نفسه،
+    فتُحوّل إلى فروق تُجمع في سجل المهمة (الأجزاء تُحمّل بالتوازي)؛ باقي حقوله (المرحلة) تخص الجزء وحده. """
+    if progress is None:
+        return None
+    return {'parent_progress': progress, 'bytes_downloaded': 0, 'bytes_total': 0}
+
+def update_progress(progress, **fields):
+    if progress is None:
+        return
+    parent_progress = progress.get('parent_progress')
+    with jobs_lock:
+        deltas = {field: (fields[field] or 0) - (progress.get(field) or 0)
+                  for field in PROGRESS_BYTE_FIELDS if parent_progress is not None and field in fields}
+        progress.update(fields)
+        progress['updated_at'] = time.time()
+    for field, delta in deltas.items():
+        add_progress_bytes(parent_progress, field, delta)
+    if parent_progress is None:
+        save_job_state(progress, force='status' in fields or 'stage' in fields)
+
+def add_progress_bytes(progress, field, amount):
+    if progress is None or not amount:
+        return
+    with jobs_lock:
+        progress[field] = (progress.get(field) or 0) + amount
+        progress['updated_at'] = time.time()
+    parent_progress = progress.get('parent_progress')
+    if parent_progress is not None:
+        add_progress_bytes(parent_progress, field, amount)
+    else:
+        save_job_state(progress)
+
+def save_job_state(progress, force=False):
+    """ حفظ لقطة المهمة في قاعدة SQLite (بحد أقصى مرة كل JOB_STATE_SAVE_INTERVAL ما لم يُطلب force). """
+    job_id = progress.get('job_id')
+    if not job_id:
+        return
+    now = time.time()
+    with jobs_lock:
+        if not force and now - job_saved_at.get(job_id, 0) < JOB_STATE_SAVE_INTERVAL:
+            return
+        job_saved_at[job_id] = now
+        snapshot = dict(progress)
+    snapshot.pop('url_hash', None)
+    try:
+        with get_cache_db() as connection: # لا تكتب لقطة أقدم فوق أحدث منها (حفظ متزامن من خيطين)
+            connection.execute("""
+                INSERT INTO jobs (job_id, status, snapshot, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(job_id) DO UPDATE SET status = excluded.status, snapshot = excluded.snapshot, updated_at = excluded.updated_at
+                WHERE excluded.updated_at >= jobs.updated_at""",
+                (job_id, snapshot['status'], json.dumps(snapshot, ensure_ascii=False), snapshot['updated_at']))
+    except sqlite3.Error as e:
+        logger.warning(f"تعذر حفظ حالة المهمة {job_id}: {e}")
+
+def load_job_state(job_id):
+    """ لقطة المهمة المحفوظة (قد تكون من عملية أخرى)، أو None. """
+    row = get_cache_db().execute('SELECT snapshot FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+    return json.loads(row['snapshot']) if row else None
+
+def prune_finished_jobs():
+    now = time.time()
+    cutoff = now - JOB_RETENTION_SECONDS
+    with jobs_lock:
+        expired = [job_id for job_id, job in jobs.items() if job['status'] in ('done', 'error') and job['updated_at'] < cutoff]
+        for job_id in expired:
+            del jobs[job_id]
+            job_saved_at.pop(job_id, None)
+    try:
+        with get_cache_db() as connection:
+            connection.execute("DELETE FROM jobs WHERE (status IN ('done', 'error') AND updated_at < ?) OR updated_at < ?",
+                               (cutoff, now - JOB_STALE_SECONDS))
+    except sqlite3.Error as e:
+        logger.warning(f"تعذر حذف المهام المنتهية من قاعدة البيانات: {e}")
+    if expired:
+        logger.info(f"تم حذف {len(expired)} مهمة منتهية من الذاكرة.")
+
+# --- تنفيذ واحد لكل رابط (single-flight) ---
+# الطلبات المتزامنة للرابط نفسه (نفس url_hash) تنضم إلى المهمة الجارية وتتشارك نتيجتها بدلًا من
+# تحميل الأرشيف واستخراجه لكل طلب. داخل العملية الواحدة عبر inflight_jobs، وبين عمليات gunicorn
+# عبر قفل ملف لكل url_hash مع إعادة فحص الكاش بعد الحصول عليه.
+URL_LOCKS_DIR = os.path.join(TEMP_ARCHIVE_DIR_FLASK_APP, '.locks')
+inflight_jobs = {}     # url_hash -> المهمة الجارية
+job_done_events = {}   # job_id -> threading.Event يُضبط عند انتهاء المهمة
+
+def new_session_id():
+    """ معرّف جلسة فريد حتى للطلبات في الملي ثانية نفسها (الطابع الزمني يبقي الترتيب الزمني). """
+    return f"{int(time.time() * 1000)}_{uuid.uuid4().hex[:12]}"
+
+@contextlib.contextmanager
+def url_process_lock(url_hash):
+    """ قفل حصري بين العمليات لمعالجة رابط واحد (لا يعمل إلا حيث يتوفر fcntl). """
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(URL_LOCKS_DIR, exist_ok=True)
+    lock_path = os.path.join(URL_LOCKS_DIR, f"{url_hash}.lock")
+    while True:
+        lock_file = open(lock_path, 'w')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try: # حذفه المنفذ السابق أثناء انتظارنا: القفل على ملف لم يعد له اسم، فنعيد المحاولة
+            if os.path.samestat(os.fstat(lock_file.fileno()), os.stat(lock_path)):
+                break
+        except FileNotFoundError:
+            pass
+        lock_file.close()
+    try:
+        yield
+    finally:
+        # حذف ملف القفل قبل تحريره (تحت القفل) حتى لا تتراكم ملفات .lock لكل رابط
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(lock_path)
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+def get_or_create_job(original_archive_url, url_hash):
+    """ إرجاع (المهمة، هل هذا الطلب هو المنفذ). ينضم الطلب إلى مهمة جارية للرابط نفسه إن وُجدت. """
+    prune_finished_jobs()
+    with jobs_lock:
+        job = inflight_jobs.get(url_hash)
+        if job is not None:
+            logger.info(f"الانضمام إلى المهمة الجارية {job['job_id']} للرابط {original_archive_url}")
+            return job, False
+        job_id = uuid.uuid4().hex
+        job = new_progress(job_id=job_id, url_hash=url_hash)
+        jobs[job_id] = job
+        inflight_jobs[url_hash] = job
+        job_done_events[job_id] = threading.Event()
+    save_job_state(job, force=True) # قبل إعادة المعرّف: قد يصل أول استعلام إلى عملية أخرى
+    logger.info(f"تم إنشاء المهمة {job_id} للرابط {original_archive_url}")
+    return job, True
+
+def submit_archive_job(original_archive_url, url_hash, mode='auto', volume_urls=None):
+    """ إنشاء مهمة جديدة وإرسالها إلى مجمع العمال، أو الانضمام إلى المهمة الجارية للرابط نفسه. """
+    job, is_leader = get_or_create_job(original_archive_url, url_hash)
+    if is_leader:
+        job_executor.submit(run_archive_job, job, original_archive_url, url_hash, mode, volume_urls)
+    return job
+
+def wait_for_job(job):
+    """ انتظار انتهاء المهمة وإرجاع (payload, status_code) كما في الوضع المتزامن. """
+    with jobs_lock:
+        done_event = job_done_events.get(job['job_id'])
+    if done_event:
+        done_event.wait()
+    if job['status'] == 'done':
+        return job['result'], job['status_code']
+    return {'error': job['error']}, job['status_code'] or 500
+
+def run_archive_job(job, original_archive_url, url_hash, mode='auto', volume_urls=None):
+    update_progress(job, status='running')
+    try:
+        with url_process_lock(url_hash):
+            # ربما أكملت عملية أخرى الرابط نفسه بينما كنا ننتظر القفل
+            payload = load_cached_result(url_hash)
+            status_code = 200
+            if payload is None:
+                session_id = new_session_id()
+                update_progress(job, session_id=session_id)
+                payload, status_code = process_archive(original_archive_url, url_hash, session_id, progress=job, mode=mode, volume_urls=volume_urls)
     except Exception as e:
-        logger.debug(f"Not a TAR file or error checking TAR for {filepath}: {e}")
-        pass
+        logger.exception(f"خطأ غير متوقع في المهمة {job['job_id']}: {e}")
+        payload, status_code = {'error': f'حدث خطأ غير متوقع أثناء المعالجة: {str(e)}'}, 500
+    finally:
+        with jobs_lock:
+            if inflight_jobs.get(url_hash) is job:
+                del inflight_jobs[url_hash]
 
-    # For 7z, py7zr does not have a simple is_7zfile().
-    # We rely on the extension and then try to open it.
-    if filename.endswith('.7z'):
+    if status_code == 200:
+        update_progress(job, status='done', stage='done', session_id=payload.get('session_id'), result=payload, status_code=status_code)
+    else:
+        update_progress(job, status='error', error=payload.get('error'), status_code=status_code)
+    with jobs_lock:
+        done_event = job_done_events.pop(job['job_id'], None)
+    if done_event:
+        done_event.set()
+
+def job_snapshot(job):
+    with jobs_lock:
+        snapshot = dict(job)
+    snapshot.pop('url_hash', None)
+    return snapshot
+
+# --- التحميل المقسّم المتوازي مع الاستئناف ---
+# عند دعم الخادم لـ Range يُقسم الملف إلى أجزاء تُجلب بالتوازي عبر جلسة requests مشتركة،
+# ويكتب كل جزء في موضعه داخل ملف محجوز مسبقًا. تُحفظ حالة الأجزاء على القرص حتى يستأنف
+# التحميل المنقطع من حيث توقف بدلًا من البدء من جديد. نسخة الملف (ETag أو Last-Modified) تُحفظ مع الحالة
+# وتُرسل في If-Range مع كل جزء، فلا تُخلط بايتات نسخة قديمة بنسخة جديدة بالحجم نفسه.
+DOWNLOAD_SEGMENTS = int(os.environ.get("ARCHIVE_DOWNLOAD_SEGMENTS", 4)) # عدد الاتصالات المتزامنة لكل ملف
+SEGMENTED_DOWNLOAD_MIN_SIZE = 8 * 1024 * 1024   # الملفات الأصغر تُحمل باتصال واحد
+DOWNLOAD_SEGMENT_RETRIES = 5                     # محاولات إعادة كل جزء عند انقطاع الاتصال أو رد فارغ
+DOWNLOAD_CHANGED_RESTARTS = 1                    # إعادة التحميل من البداية إذا تغيّر الملف البعيد أثناءه
+DOWNLOAD_STATE_SAVE_INTERVAL = 2                 # ثوانٍ بين كل حفظ لحالة الأجزاء
+PARTIAL_DOWNLOADS_DIR = os.path.join(TEMP_ARCHIVE_DIR_FLASK_APP, '.partial')
+PARTIAL_DOWNLOAD_MAX_AGE_SECONDS = 2 * 24 * 3600 # حذف التحميلات الجزئية المهملة الأقدم من يومين
+
+# جلسة HTTP مشتركة بمجمع اتصالات يتسع للأجزاء المتوازية لكل المهام (تستخدمها أيضًا قراءة ZIP البعيد)
+http_session = requests.Session()
+_http_adapter = HTTPAdapter(pool_connections=JOB_WORKERS, pool_maxsize=max(10, DOWNLOAD_SEGMENTS * JOB_WORKERS))
+http_session.mount('http://', _http_adapter)
+http_session.mount('https://', _http_adapter)
+
+def probe_download(url, headers=None):
+    """ فحص الرابط بطلب Range لبايت واحد: الرابط النهائي، الحجم، دعم Range، واسم الملف. """
+    probe_headers = dict(headers or {'User-Agent': 'Mozilla/5.0'})
+    probe_headers['Range'] = 'bytes=0-0'
+    with http_session.get(url, headers=probe_headers, stream=True, timeout=(REQUESTS_CONNECT_TIMEOUT, REQUESTS_READ_TIMEOUT), allow_redirects=True) as r:
+        r.raise_for_status()
+        size = None
+        size_match = re.match(r'bytes\s+0-0/(\d+)', r.headers.get('content-range', ''))
+        if r.status_code == 206 and size_match:
+            size = int(size_match.group(1))
+        elif r.headers.get('content-length', '').isdigit():
+            size = int(r.headers['content-length'])
+        return {
+            'url': r.url,
+            'size': size,
+            'accepts_ranges': r.status_code == 206 and size_match is not None,
+            'filename': _filename_from_response(r),
+            'etag': r.headers.get('etag'),
+            'last_modified': r.headers.get('last-modified'),
+        }
+
+def range_validator(etag, last_modified):
+    """ قيمة If-Range لنسخة الملف: ETag قوي، وإلا Last-Modified (لا يُقبل ETag ضعيف في If-Range). """
+    return etag if etag and not etag.startswith('W/') else last_modified
+
+class RemoteFileChangedError(Exception):
+    """ تغيّر الملف البعيد بين طلبات تحميل واحد (أعاد الخادم 200 لطلب If-Range). """
+
+def _partial_download_folder(url):
+    return os.path.join(PARTIAL_DOWNLOADS_DIR, hashlib.md5(url.encode('utf-8')).hexdigest())
+
+def _save_segment_state(state_path, state):
+    temp_state_path = f"{state_path}.{threading.get_ident()}.tmp"
+    with open(temp_state_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(temp_state_path, state_path)
+
+def prune_partial_downloads():
+    if not os.path.isdir(PARTIAL_DOWNLOADS_DIR):
+        return
+    cutoff = time.time() - PARTIAL_DOWNLOAD_MAX_AGE_SECONDS
+    for entry in os.scandir(PARTIAL_DOWNLOADS_DIR):
+        if entry.is_dir() and entry.stat().st_mtime < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            logger.info(f"تم حذف تحميل جزئي مهمل: {entry.path}")
+
+def _load_or_create_segment_state(state_path, data_path, url, size, segments, validator=None):
+    if os.path.exists(state_path) and os.path.exists(data_path):
         try:
-            with py7zr.SevenZipFile(filepath, 'r') as _:
-                logger.debug(f"Identified as 7Z by py7zr opening: {filepath}")
-                return '7z' # Return immediately if confirmed
-        except py7zr.exceptions.Bad7zFile:
-            logger.debug(f"File {filepath} has .7z extension but is not a valid 7z archive.")
-            # Do not return yet, allow fallback to extension check if it was misidentified by lib
-        except Exception as e: # Other exceptions like permission errors
-            logger.warning(f"Error checking 7z file {filepath} with py7zr: {e}")
-            pass # Allow fallback
-
-    # Fallback to extension-based check if library checks failed or were inconclusive
-    logger.debug(f"Falling back to extension-based type check for {filepath}")
-    if filename.endswith('.rar'):
-        logger.debug(f"Identified as RAR by extension: {filepath}")
-        return 'rar'
-    if filename.endswith('.zip'):
-        logger.debug(f"Identified as ZIP by extension: {filepath}")
-        return 'zip'
-    if filename.endswith(('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2')):
-        logger.debug(f"Identified as TAR by extension: {filepath}")
-        return 'tar'
-    if filename.endswith('.7z') and not archive_type_found: # If py7zr failed but extension is .7z
-        logger.debug(f"Identified as 7Z by extension (after py7zr check if applicable): {filepath}")
-        return '7z'
-
-    logger.info(f"Could not determine archive type for {filepath} using libraries or common extensions.")
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get('url') == url and state.get('size') == size and state.get('validator') == validator:
+                done_bytes = sum(segment[2] for segment in state['segments'])
+                logger.info(f"استئناف تحميل سابق: {done_bytes}/{size} بايت مكتملة ({url}).")
+                return state
+            logger.info(f"التحميل الجزئي السابق لنسخة أخرى من الملف (الحجم أو ETag/Last-Modified). البدء من جديد: {url}")
+        except Exception as e:
+            logger.warning(f"تعذر قراءة حالة التحميل الجزئي {state_path}: {e}. البدء من جديد.")
+
+    segment_size = -(-size // segments) # قسمة مع التقريب للأعلى
+    state = {'url': url, 'size': size, 'validator': validator,
+             'segments': [[start, min(start + segment_size, size), 0] for start in range(0, size, segment_size)]}
+    with open(data_path, 'wb') as f: # حجز الملف مسبقًا بحجمه النهائي
+        f.truncate(size)
+    _save_segment_state(state_path, state)
+    return state
+
+def _download_segment(url, headers, data_path, segment, state, state_lock, state_path, progress, stop_event):
+    """ جلب جزء واحد وكتابته في موضعه، مع إعادة المحاولة والاستئناف من آخر بايت مكتوب. """
+    start, end, _ = segment
+    validator = state.get('validator')
+    attempt = 0
+    while segment[2] < end - start and not stop_event.is_set():
+        segment_headers = dict(headers)
+        segment_headers['Range'] = f'bytes={start + segment[2]}-{end - 1}'
+        if validator:
+            segment_headers['If-Range'] = validator
+        received_before = segment[2]
+        try:
+            with http_session.get(url, headers=segment_headers, stream=True, timeout=(REQUESTS_CONNECT_TIMEOUT, REQUESTS_READ_TIMEOUT)) as r:
+                if r.status_code != 206:
+                    r.raise_for_status()
+                    if validator:
+                        raise RemoteFileChangedError(f"تغيّر الملف البعيد أثناء التحميل (الخادم أعاد {r.status_code} لطلب If-Range): {url}")
+                    raise RangeNotSupportedError(f"الخادم أعاد {r.status_code} لطلب جزء: {url}")
+                range_match = re.match(r'bytes\s+(\d+)-', r.headers.get('content-range', ''))
+                if not range_match or int(range_match.group(1)) != start + segment[2]:
+                    raise RangeNotSupportedError(f"Content-Range غير متوقع ({r.headers.get('content-range')}) لطلب جزء: {url}")
+                last_save_time = time.time()
+                with open(data_path, 'r+b') as f:
+                    f.seek(start + segment[2])
+                    for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        chunk = chunk[:end - start - segment[2]]
+                        f.write(chunk)
+                        with state_lock:
+                            segment[2] += len(chunk)
+                        add_progress_bytes(progress, 'bytes_downloaded', len(chunk))
+                        if time.time() - last_save_time >= DOWNLOAD_STATE_SAVE_INTERVAL:
+                            f.flush()
+                            with state_lock:
+                                _save_segment_state(state_path, state)
+                            last_save_time = time.time()
+                        if segment[2] >= end - start or stop_event.is_set():
+                            break
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            attempt += 1
+            if attempt > DOWNLOAD_SEGMENT_RETRIES:
+                raise
+            logger.warning(f"انقطع جزء التحميل {start}-{end} ({e}). إعادة المحاولة {attempt}/{DOWNLOAD_SEGMENT_RETRIES}.")
+            time.sleep(min(2 ** attempt, 30))
+            continue
+        if segment[2] == received_before and not stop_event.is_set(): # رد 206 بلا بيانات: محاولة فاشلة لا حلقة بلا نهاية
+            attempt += 1
+            if attempt > DOWNLOAD_SEGMENT_RETRIES:
+                raise ArchiveProcessingError(f"الخادم أعاد ردودًا فارغة لجزء التحميل {start}-{end}: {url}", 502)
+            logger.warning(f"رد فارغ لجزء التحميل {start}-{end}. إعادة المحاولة {attempt}/{DOWNLOAD_SEGMENT_RETRIES}.")
+            time.sleep(min(2 ** attempt, 30))
+
+def download_segmented(url, dest_path, size, headers=None, progress=None, segments=None, validator=None):
+    """ تحميل الملف بأجزاء متوازية إلى dest_path مع استئناف أي تحميل جزئي سابق لنفس الرابط ونسخة الملف. """
+    headers = headers or {'User-Agent': 'Mozilla/5.0'}
+    segments = segments or DOWNLOAD_SEGMENTS
+    prune_partial_downloads()
+    partial_folder = _partial_download_folder(url)
+    os.makedirs(partial_folder, exist_ok=True)
+    data_path = os.path.join(partial_folder, 'data.part')
+    state_path = os.path.join(partial_folder, 'state.json')
+
+    state = _load_or_create_segment_state(state_path, data_path, url, size, segments, validator)
+    state_lock = threading.Lock()
+    update_progress(progress, bytes_total=size, bytes_downloaded=sum(segment[2] for segment in state['segments']))
+
+    download_start_time = time.time()
+    pending_segments = [segment for segment in state['segments'] if segment[2] < segment[1] - segment[0]]
+    stop_event = threading.Event()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(segments, len(pending_segments))), thread_name_prefix='download-segment') as segment_executor:
+            futures = [segment_executor.submit(_download_segment, url, headers, data_path, segment, state, state_lock, state_path, progress, stop_event)
+                       for segment in pending_segments]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                stop_event.set() # الأجزاء الأخرى تتوقف بدل إكمال تحميل لن يُستخدم
+                raise
+    except RemoteFileChangedError:
+        shutil.rmtree(partial_folder, ignore_errors=True) # بايتات النسخة القديمة لا تصلح للاستئناف
+        raise
+    finally:
+        if os.path.isdir(partial_folder):
+            with state_lock:
+                _save_segment_state(state_path, state)
+
+    os.replace(data_path, dest_path)
+    shutil.rmtree(partial_folder, ignore_errors=True)
+    elapsed = time.time() - download_start_time
+    logger.info(f"اكتمل التحميل المقسّم ({len(state['segments'])} أجزاء) لـ {size} بايت في {elapsed:.2f} ثانية: {dest_path}")
+    return dest_path
+
+def download_http_file(download_url, temp_session_folder, default_path, progress=None, use_url_filename=False):
+    """ تحميل رابط HTTP: مقسّم ومتوازٍ إن دعم الخادم Range، وإلا باتصال واحد. """
+    headers = {'User-Agent': 'Mozilla/5.0'}
+    local_archive_path = default_path
+    for restart in range(DOWNLOAD_CHANGED_RESTARTS + 1):
+        probe = probe_download(download_url, headers)
+        if not (probe['accepts_ranges'] and probe['size'] and probe['size'] >= SEGMENTED_DOWNLOAD_MIN_SIZE and DOWNLOAD_SEGMENTS > 1):
+            break
+        filename = probe['filename'] or (_sanitize_download_filename(urlparse(download_url).path) if use_url_filename else None)
+        if filename:
+            local_archive_path = os.path.join(temp_session_folder, filename)
+        try:
+            return download_segmented(probe['url'], local_archive_path, probe['size'], headers, progress,
+                                      validator=range_validator(probe['etag'], probe['last_modified']))
+        except RemoteFileChangedError as e:
+            if restart == DOWNLOAD_CHANGED_RESTARTS:
+                raise
+            logger.warning(f"{e}. إعادة التحميل من البداية.")
+            update_progress(progress, bytes_downloaded=0)
+
+    with http_session.get(download_url, headers=headers, stream=True, timeout=(REQUESTS_CONNECT_TIMEOUT, REQUESTS_READ_TIMEOUT), allow_redirects=True) as r:
+        r.raise_for_status()
+        filename = _filename_from_response(r, fallback_url=download_url if use_url_filename else None)
+        if filename:
+            local_archive_path = os.path.join(temp_session_folder, filename)
+        _stream_response_to_file(r, local_archive_path, progress)
+    return local_archive_path
+
+# --- مراحل معالجة الأرشيف ---
+DOWNLOAD_FILENAME_MAX_LENGTH = 200
+
+def _sanitize_download_filename(filename):
+    """ اسم آمن للحفظ داخل مجلد الجلسة المؤقت: آخر مكوّن فقط وبلا محارف تحكم (الأسماء العربية تبقى كما هي). """
+    filename = re.sub(r'[\x00-\x1f\x7f]', '', os.path.basename(filename.replace('\\', '/'))).strip()
+    if filename in ('', '.', '..'):
+        return None
+    if len(filename) > DOWNLOAD_FILENAME_MAX_LENGTH: # مع الإبقاء على الامتداد لكشف النوع
+        stem, extension = os.path.splitext(filename)
+        filename = stem[:DOWNLOAD_FILENAME_MAX_LENGTH - len(extension)] + extension
+    return filename
+
+def _filename_from_response(r, fallback_url=None):
+    """ محاولة استخراج اسم الملف من content-disposition أو من مسار الرابط (بعد تنقيته من أي مسار). """
+    content_disposition = r.headers.get('content-disposition')
+    if content_disposition:
+        fname_match = re.findall('filename="?([^"]+)"?', content_disposition)
+        if fname_match:
+            return _sanitize_download_filename(fname_match[0])
+        return None
+    if fallback_url: # إذا لم يكن هناك content-disposition، استخدم اسم الملف من الرابط
+        return _sanitize_download_filename(urlparse(fallback_url).path)
     return None
 
-# --- مسارات Flask ---
-@app.route('/')
-def index():
-    return render_template('index.html')
-
-
-@app.route('/process-archive', methods=['POST'])
-def process_archive_route():
-    # For true scalability with many concurrent users and very large files,
-    # consider moving the download and extraction logic to a background task queue (e.g., Celery).
-    # This would prevent HTTP requests from timing out and allow the server to handle more requests.
-    # Also, for managing disk space with cached extracted files, implement a cleanup strategy
-    # (e.g., LRU cache for sessions, or periodic deletion of older extracted data).
-
-    data = request.get_json()
-    if not data: return jsonify({'error': 'لم يتم إرسال بيانات JSON.'}), 400
-    original_archive_url = data.get('archive_url')
-    if not original_archive_url: return jsonify({'error': 'لم يتم توفير رابط ملف الأرشيف.'}), 400
+def _stream_response_to_file(r, local_archive_path, progress=None):
+    content_length = r.headers.get('content-length')
+    if content_length and content_length.isdigit():
+        update_progress(progress, bytes_total=int(content_length))
+    with open(local_archive_path, 'wb') as f:
+        for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            f.write(chunk)
+            add_progress_bytes(progress, 'bytes_downloaded', len(chunk))
+
+def download_archive(original_archive_url, temp_session_folder, progress=None):
+    """ تحميل الأرشيف (MEGA أو Google Drive أو رابط مباشر) وإرجاع مساره المحلي. """
+    local_archive_path = os.path.join(temp_session_folder, "archive_download") # اسم عام، قد يتغير بعد التحميل
+    update_progress(progress, stage='downloading')
+
+    if "mega.nz" in original_archive_url or "mega.co.nz" in original_archive_url:
+        logger.info(f"رابط MEGA. استخدام MEGADL_EXEC_PATH: {MEGADL_EXEC_PATH}")
+        if not MEGADL_EXEC_PATH or (MEGADL_EXEC_PATH == "megadl" and not shutil.which("megadl")) and not os.path.exists(MEGADL_EXEC_PATH):
+             raise FileNotFoundError(f"أداة megadl غير موجودة أو غير قابلة للتنفيذ: {MEGADL_EXEC_PATH}")
+
+        existing_entries = set(os.listdir(temp_session_folder))
+        megadl_command = [MEGADL_EXEC_PATH, original_archive_url, "--path", temp_session_folder]
+        logger.info(f"Executing megadl command: {' '.join(megadl_command)} with timeout {MEGADL_TIMEOUT}s")
+        process = subprocess.run(megadl_command, capture_output=True, text=True, check=False, timeout=MEGADL_TIMEOUT)
+        logger.info(f"megadl stdout: {process.stdout}")
+        logger.error(f"megadl stderr: {process.stderr}")
+        if process.returncode != 0:
+            raise Exception(f"فشل megadl. الرمز: {process.returncode}. الخطأ: {process.stderr or process.stdout}")
+        downloaded_files_mega = [os.path.join(temp_session_folder, name) for name in sorted(set(os.listdir(temp_session_folder)) - existing_entries)
+                                 if os.path.isfile(os.path.join(temp_session_folder, name))]
+        if not downloaded_files_mega:
+            raise Exception("megadl انتهى ولكن لم يتم العثور على ملف في المجلد المؤقت.")
+        # رابط مجلد MEGA قد يحمل مجموعة أجزاء، أو أرشيفًا واحدًا مع ملفات مرافقة (README، .nfo)
+        local_archive_path = select_downloaded_archive(downloaded_files_mega)
+        update_progress(progress, bytes_downloaded=os.path.getsize(local_archive_path))
+        logger.info(f"تم تحميل MEGA بنجاح: {local_archive_path}")
+
+    elif "drive.google.com" in original_archive_url:
+        download_url = get_google_drive_direct_link(original_archive_url)
+        logger.info(f"رابط Google Drive. الرابط المباشر: {download_url}. Timeout: C={REQUESTS_CONNECT_TIMEOUT}s, R={REQUESTS_READ_TIMEOUT}s")
+        local_archive_path = download_http_file(download_url, temp_session_folder, local_archive_path, progress)
+        logger.info(f"تم تحميل Google Drive بنجاح: {local_archive_path}")
+
+    else: # رابط مباشر
+        download_url = original_archive_url
+        logger.info(f"تحميل رابط مباشر: {download_url}. Timeout: C={REQUESTS_CONNECT_TIMEOUT}s, R={REQUESTS_READ_TIMEOUT}s")
+        local_archive_path = download_http_file(download_url, temp_session_folder, local_archive_path, progress, use_url_filename=True)
+        logger.info(f"تم التحميل المباشر بنجاح: {local_archive_path}")
+
+    if not os.path.exists(local_archive_path):
+        raise FileNotFoundError(f"فشل تحميل الأرشيف أو الملف غير موجود: {local_archive_path}")
+    return local_archive_path
+
+def detect_archive_type(local_archive_path, original_archive_url, temp_session_folder, progress=None):
+    """ تحديد نوع الأرشيف، مع محاولة إعادة التسمية حسب اسم الملف في الرابط عند الفشل. """
+    update_progress(progress, stage='detecting')
+    sniffed = sniff_archive(local_archive_path)
+    archive_type = sniffed['type'] or get_archive_type_by_extension(os.path.basename(local_archive_path))
+    logger.info(f"تم تحديد نوع الأرشيف: {archive_type} (الضغط: {sniffed['codec']}) للملف {local_archive_path}")
+
+    if not archive_type:
+        original_filename_from_url = os.path.basename(original_archive_url.split('?')[0])
+        if '.' in original_filename_from_url:
+            potential_new_path = os.path.join(temp_session_folder, original_filename_from_url)
+            if not os.path.exists(potential_new_path) and local_archive_path != potential_new_path :
+                try:
+                    shutil.move(local_archive_path, potential_new_path) # استخدام shutil.move
+                    local_archive_path = potential_new_path
+                    archive_type = get_archive_type_by_extension(original_filename_from_url) # المحتوى نفسه، تغير الامتداد فقط
+                    logger.info(f"تمت إعادة التسمية إلى {original_filename_from_url}، النوع الجديد المحدد: {archive_type}")
+                except Exception as e_rename:
+                    logger.warning(f"لم يمكن إعادة تسمية الملف المحمل إلى {original_filename_from_url}: {e_rename}")
+        if not archive_type:
+             raise ArchiveProcessingError(f"لا يمكن تحديد نوع الأرشيف أو أن الصيغة غير مدعومة. اسم الملف: {os.path.basename(local_archive_path)}", 400)
+
+    update_progress(progress, archive_type=archive_type, archive_codec=sniffed['codec'])
+    return archive_type, local_archive_path
+
+class _SevenZipProgressCallback(py7zr.callbacks.ExtractCallback):
+    """ تمرير تقدم فك ضغط 7z إلى سجل المهمة. """
+    def __init__(self, progress):
+        self.progress = progress
+    def report_start_preparation(self): pass
+    def report_start(self, processing_file_path, processing_bytes): pass
+    def report_update(self, decompressed_bytes): pass
+    def report_end(self, processing_file_path, wrote_bytes):
+        add_progress_bytes(self.progress, 'bytes_extracted', int(wrote_bytes or 0))
+    def report_warning(self, message): pass
+    def report_postprocess(self): pass
+
+# --- الأرشيفات متعددة الأجزاء ---
+# مجموعة أجزاء (volume_urls، أو نمط مثل https://host/book.part{1..12}.rar) تُعالج كأرشيف واحد بمفتاح كاش
+# واحد. تُحمّل الأجزاء بالتوازي (بحد VOLUME_DOWNLOAD_WORKERS، والأولى أولًا) إلى مجلد واحد، ثم:
+# RAR (‏.partN.rar أو .rar/.r00) يُفتح من الجزء الأول ويجد rarfile الباقي بجانبه؛ التقسيم الخام (.001، .002...)
+# يُدمج بالترتيب؛ ZIP المقسّم (.z01... ثم .zip) يُدمج ثم يُعاد كتابة دليله المركزي بمواضع مطلقة.
+# TAR المقسّم خامًا لا يحتاج الدمج: يُفك ضغطه تدفقيًا من الأجزاء بمجرد وصول الجزء الأول.
+VOLUME_DOWNLOAD_WORKERS = int(os.environ.get("ARCHIVE_VOLUME_DOWNLOAD_WORKERS", 3))
+MAX_ARCHIVE_VOLUMES = 500
+VOLUMES_DIRNAME = 'volumes'
+VOLUME_RANGE_PATTERN = re.compile(r'\{(\d+)\.\.(\d+)\}')
+VOLUME_COPY_CHUNK_SIZE = 1024 * 1024
+
+def expand_volume_pattern(pattern):
+    """ توسيع نمط مثل https://host/f.7z.{001..012} إلى روابط الأجزاء (مع الحفاظ على الأصفار البادئة). """
+    match = VOLUME_RANGE_PATTERN.search(pattern)
+    if not match:
+        raise ValueError("نمط الأجزاء يجب أن يحتوي على مدى مثل {1..5} أو {001..012}.")
+    first, last = match.groups()
+    if int(last) < int(first) or int(last) - int(first) >= MAX_ARCHIVE_VOLUMES:
+        raise ValueError(f"مدى الأجزاء غير صالح (الحد الأقصى {MAX_ARCHIVE_VOLUMES} جزءًا).")
+    width = len(first) if first.startswith('0') else 0
+    return [pattern[:match.start()] + str(number).zfill(width) + pattern[match.end():] for number in range(int(first), int(last) + 1)]
+
+def volume_set_hash(volume_urls):
+    """ مفتاح كاش واحد للمجموعة كلها (لا يطابق مفتاح أي رابط منفرد لوجود فاصل السطر). """
+    return hashlib.md5('\n'.join(volume_urls).encode('utf-8')).hexdigest()
+
+def classify_volume(filename):
+    """ (نوع المجموعة rar|zip_split|raw_split، ترتيب الجزء) من اسم الملف، أو (None, 0). """
+    name = filename.lower()
+    match = re.search(r'\.part(\d+)\.rar$', name)
+    if match:
+        return 'rar', int(match.group(1))
+    if name.endswith('.rar'): # التسمية القديمة: .rar ثم .r00، .r01...
+        return 'rar', 0
+    match = re.search(r'\.r(\d{2,3})$', name)
+    if match:
+        return 'rar', int(match.group(1)) + 1
+    match = re.search(r'\.z(\d{2,3})$', name)
+    if match:
+        return 'zip_split', int(match.group(1))
+    if name.endswith('.zip'): # الجزء الأخير في ZIP المقسّم، ويحمل الدليل المركزي
+        return 'zip_split', sys.maxsize
+    match = re.search(r'\.(\d{3})$', name)
+    if match:
+        return 'raw_split', int(match.group(1))
+    return None, 0
+
+def order_volume_paths(volume_paths):
+    """ ترتيب أجزاء مجموعة واحدة؛ يعيد (النوع، المسارات مرتبة). """
+    classified = [(classify_volume(os.path.basename(path)), path) for path in volume_paths]
+    kinds = {kind for (kind, _), _ in classified}
+    if len(kinds) != 1 or None in kinds:
+        names = ', '.join(os.path.basename(path) for path in volume_paths[:5])
+        raise ArchiveProcessingError(f"الملفات لا تكوّن مجموعة أجزاء معروفة (.partN.rar أو .001 أو .z01): {names}", 400)
+    return kinds.pop(), [path for (_, order), path in sorted(classified, key=lambda item: item[0][1])]
+
+def concatenate_volumes(volume_paths, target_path):
+    """ دمج الأجزاء بالترتيب مع حذف كل جزء بعد نسخه (مساحة القرص تبقى قرابة حجم الأرشيف). """
+    with open(target_path, 'wb') as target:
+        for volume_path in volume_paths:
+            with open(volume_path, 'rb') as source:
+                shutil.copyfileobj(source, target, VOLUME_COPY_CHUNK_SIZE)
+            os.remove(volume_path)
+
+ZIP_CENTRAL_HEADER_SIGNATURE = b'PK\x01\x02'
+ZIP_CENTRAL_HEADER = struct.Struct('<4s6H3L5H2L') # الحقول 10-12 أطوال الاسم والإضافي والتعليق، 13 قرص البداية، 16 موضع الترويسة المحلية
+ZIP_EOCD = struct.Struct('<4s4H2LH')               # التوقيع، القرص، قرص الدليل، العناصر (في القرص، الكلي)، الحجم، الموضع، طول التعليق
+
+def rewrite_split_zip_offsets(zip_path, volume_sizes):
+    """ تحويل مواضع العناصر في ZIP مقسّم بعد دمجه من (رقم القرص، موضع نسبي) إلى مواضع مطلقة، بإعادة
+    كتابة سجلات الدليل المركزي ونهايته في مكانها (الحجم لا يتغير). """
+    disk_starts = list(itertools.accumulate(volume_sizes, initial=0))
+    file_size = os.path.getsize(zip_path)
+    with open(zip_path, 'r+b') as f:
+        tail_start = max(0, file_size - ARCHIVE_SNIFF_TAIL_BYTES)
+        f.seek(tail_start)
+        tail = f.read()
+        eocd_pos = tail.rfind(ZIP_EOCD_SIGNATURE)
+        if eocd_pos < 0 or len(tail) - eocd_pos < ZIP_EOCD.size:
+            raise zipfile.BadZipFile("لم يتم العثور على نهاية الدليل المركزي في ZIP المقسّم.")
+        (_, _, directory_disk, _, entry_count, directory_size, directory_offset,
+         comment_length) = ZIP_EOCD.unpack_from(tail, eocd_pos)
+        if 0xFFFF in (directory_disk, entry_count) or 0xFFFFFFFF in (directory_size, directory_offset):
+            raise zipfile.BadZipFile("ZIP64 المقسّم غير مدعوم.")
+        if directory_disk >= len(volume_sizes):
+            raise zipfile.BadZipFile(f"رقم قرص الدليل المركزي ({directory_disk}) أكبر من عدد الأجزاء ({len(volume_sizes)}).")
+
+        directory_start = disk_starts[directory_disk] + directory_offset
+        f.seek(directory_start)
+        directory = bytearray(f.read(directory_size))
+        pos = 0
+        for _ in range(entry_count):
+            fields = list(ZIP_CENTRAL_HEADER.unpack_from(directory, pos))
+            if fields[0] != ZIP_CENTRAL_HEADER_SIGNATURE:
+                raise zipfile.BadZipFile(f"سجل دليل مركزي تالف عند الموضع {directory_start + pos}.")
+            start_disk, local_offset = fields[13], fields[16]
+            if start_disk == 0xFFFF or local_offset == 0xFFFFFFFF or start_disk >= len(volume_sizes):
+                raise zipfile.BadZipFile("ZIP64 المقسّم غير مدعوم.")
+            fields[13], fields[16] = 0, disk_starts[start_disk] + local_offset
+            if fields[16] > 0xFFFFFFFF:
+                raise zipfile.BadZipFile("ZIP المقسّم أكبر من 4GB بعد الدمج (يتطلب ZIP64).")
+            ZIP_CENTRAL_HEADER.pack_into(directory, pos, *fields)
+            pos += ZIP_CENTRAL_HEADER.size + fields[10] + fields[11] + fields[12] # الاسم والحقول الإضافية والتعليق
+
+        f.seek(directory_start)
+        f.write(directory)
+        f.write(ZIP_EOCD.pack(ZIP_EOCD_SIGNATURE, 0, 0, entry_count, entry_count, directory_size, directory_start, comment_length))
+        f.write(tail[eocd_pos + ZIP_EOCD.size:eocd_pos + ZIP_EOCD.size + comment_length])
+        f.truncate()
+    logger.info(f"تمت إعادة كتابة الدليل المركزي لـ ZIP المقسّم ({len(volume_sizes)} أجزاء): {zip_path}")
+
+def assemble_volume_set(volume_paths):
+    """ تحويل أجزاء مجموعة (في مجلد واحد) إلى مسار أرشيف واحد قابل للكشف وفك الضغط. """
+    if len(volume_paths) == 1:
+        return volume_paths[0]
+    kind, ordered_paths = order_volume_paths(volume_paths)
+    if kind == 'rar':
+        return ordered_paths[0]
+    volume_sizes = [os.path.getsize(path) for path in ordered_paths]
+    if kind == 'raw_split':
+        target_path = ordered_paths[0][:-len('.001')]
+    else:
+        target_path = os.path.splitext(ordered_paths[-1])[0] + '.joined.zip'
+    concatenation_start_time = time.perf_counter()
+    concatenate_volumes(ordered_paths, target_path)
+    if kind == 'zip_split':
+        rewrite_split_zip_offsets(target_path, volume_sizes)
+    logger.info(f"تم دمج {len(ordered_paths)} أجزاء ({kind}) في {target_path} in {time.perf_counter() - concatenation_start_time:.2f} seconds.")
+    return target_path
+
+VOLUME_SUFFIX_PATTERN = re.compile(r'(\.part\d+\.rar|\.rar|\.r\d{2,3}|\.z\d{2,3}|\.zip|\.\d{3})$', re.IGNORECASE)
+
+def select_downloaded_archive(file_paths):
+    """ اختيار الأرشيف من ملفات مجلد محمّل: مجموعة الأجزاء (بالاسم المشترك) إن وُجدت، وإلا الأرشيف الوحيد
+    بين الملفات المرافقة، وإلا أكبر ملف (ليكشف نوعه من محتواه). """
+    if len(file_paths) == 1:
+        return file_paths[0]
+    volume_groups = collections.defaultdict(list)
+    for path in file_paths:
+        name = os.path.basename(path)
+        kind, _ = classify_volume(name)
+        if kind:
+            volume_groups[(kind, VOLUME_SUFFIX_PATTERN.sub('', name.lower()))].append(path)
+    volume_sets = [paths for paths in volume_groups.values() if len(paths) > 1]
+    archives = [path for path in file_paths if get_archive_type_by_extension(os.path.basename(path))]
+    if len(volume_sets) == 1:
+        candidates = [volume_sets[0]]
+    elif not volume_sets:
+        candidates = [[path] for path in archives]
+    else:
+        candidates = volume_sets
+    if len(candidates) > 1:
+        names = ', '.join(os.path.basename(paths[0]) for paths in candidates[:5])
+        raise ArchiveProcessingError(f"المجلد يحتوي على أكثر من أرشيف؛ حمّل كل أرشيف برابطه: {names}", 400)
+    if candidates:
+        return assemble_volume_set(candidates[0])
+    return max(file_paths, key=os.path.getsize)
+
+def can_stream_volume_set(volume_urls):
+    """ TAR مقسّم خامًا (مثل backup.tar.gz.001) يُفك أثناء التحميل؛ يُحكم من أسماء الروابط فقط. """
+    names = [os.path.basename(urlparse(volume_url).path) for volume_url in volume_urls]
+    if any(classify_volume(name)[0] != 'raw_split' for name in names):
+        return False
+    return get_archive_type_by_extension(names[0][:-len('.001')]) == 'tar'
+
+class VolumeChainReader(io.RawIOBase):
+    """ قراءة تسلسلية لأجزاء مقسّمة خامًا كملف واحد: تنتظر تحميل كل جزء قبل قراءته وتحذفه بعدها. """
+
+    def __init__(self, volume_futures):
+        super().__init__()
+        self._pending = collections.deque(volume_futures)
+        self._current = None
+        self._current_path = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while True:
+            if self._current is None:
+                if not self._pending:
+                    return 0
+                self._current_path = self._pending.popleft().result() # ينتظر التحميل ويعيد رفع خطئه
+                self._current = open(self._current_path, 'rb')
+            count = self._current.readinto(buffer)
+            if count:
+                return count
+            self._current.close()
+            self._current = None
+            os.remove(self._current_path)
+
+    def close(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+        super().close()
+
+def start_volume_downloads(volume_urls, temp_session_folder, progress=None):
+    """ بدء تحميل الأجزاء بالتوازي (بترتيبها)؛ يعيد (المنفذ، Futures بمسارات الأجزاء بترتيب الروابط). """
+    volumes_folder = os.path.join(temp_session_folder, VOLUMES_DIRNAME)
+    os.makedirs(volumes_folder, exist_ok=True)
+    # bytes_total هنا مجموع أحجام الأجزاء التي بدأ تحميلها (حجم كل جزء يُعرف عند بدء تحميله)
+    update_progress(progress, stage='downloading', volumes_total=len(volume_urls), volumes_downloaded=0, bytes_total=None)
+
+    def download_volume(index, volume_url):
+        # مجلد خاص بكل جزء: الأسماء الافتراضية قد تتطابق، وMEGA يحدد ملفه بمقارنة محتوى المجلد
+        volume_folder = os.path.join(volumes_folder, f".volume-{index}")
+        os.makedirs(volume_folder, exist_ok=True)
+        downloaded_path = download_archive(volume_url, volume_folder, new_volume_progress(progress)) # بايتات الجزء أولًا بأول
+        volume_path = os.path.join(volumes_folder, os.path.basename(downloaded_path))
+        if os.path.exists(volume_path):
+            raise ArchiveProcessingError(f"اسم جزء مكرر في المجموعة: {os.path.basename(downloaded_path)}", 400)
+        os.replace(downloaded_path, volume_path)
+        shutil.rmtree(volume_folder, ignore_errors=True)
+        add_progress_bytes(progress, 'volumes_downloaded', 1)
+        logger.info(f"تم تحميل الجزء {index + 1}/{len(volume_urls)}: {volume_path}")
+        return volume_path
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(VOLUME_DOWNLOAD_WORKERS, len(volume_urls))), thread_name_prefix='volume-download')
+    return executor, [executor.submit(download_volume, index, volume_url) for index, volume_url in enumerate(volume_urls)]
+
+def fetch_volume_set(volume_urls, temp_session_folder, extracted_session_folder, progress, mode):
+    """ تحميل مجموعة الأجزاء وإرجاع مسار الأرشيف المجمّع، أو None إن فُك ضغطها تدفقيًا أثناء التحميل. """
+    logger.info(f"تحميل مجموعة من {len(volume_urls)} أجزاء ({VOLUME_DOWNLOAD_WORKERS} بالتوازي)، أولها {volume_urls[0]}")
+    download_start_time = time.perf_counter()
+    executor, volume_futures = start_volume_downloads(volume_urls, temp_session_folder, progress)
+    try:
+        if mode in ('auto', 'extract') and can_stream_volume_set(volume_urls):
+            update_progress(progress, stage='extracting', archive_type='tar')
+            with VolumeChainReader(volume_futures) as reader:
+                tar_bytes, decompress_seconds, write_seconds = extract_tar_pipelined(None, extracted_session_folder, progress, fileobj=reader)
+            pipeline_seconds = time.perf_counter() - download_start_time
+            logger.info(f"تم تحميل وفك ضغط TAR المقسّم تدفقيًا إلى {extracted_session_folder} in {pipeline_seconds:.2f} seconds.")
+            if progress is not None:
+                record_stage_throughput(progress, 'downloading', progress['bytes_downloaded'], pipeline_seconds)
+            record_stage_throughput(progress, 'tar_decompress', tar_bytes, decompress_seconds)
+            record_stage_throughput(progress, 'disk_write', tar_bytes, write_seconds)
+            return None
+        volume_paths = [future.result() for future in volume_futures]
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True) # عند الخطأ: لا تبدأ أجزاء جديدة
+    return assemble_volume_set(volume_paths)
+
+# --- فك الضغط المتوازي ---
+# ZIP: عناصره مستقلة (كل عنصر مضغوط وحده)، فتُوزع على مجمع عمليات في دفعات متوازنة حسب الحجم،
+# وتفتح كل عملية مقبض ZipFile خاصًا بها. فك ضغط zlib في عمليات منفصلة يتجاوز حد GIL.
+# TAR: تدفق مضغوط واحد لا يمكن تقسيمه (خاصة tar.gz)، فيبقى فك الضغط تسلسليًا لكنه يتداخل مع
+# الكتابة على القرص: هذا الخيط يفك الضغط وخيط آخر يكتب، وبينهما طابور محدود الحجم.
+EXTRACT_WORKERS = int(os.environ.get("ARCHIVE_EXTRACT_WORKERS", min(8, os.cpu_count() or 1))) # 1 = فك ضغط تسلسلي كما سبق
+PARALLEL_EXTRACT_MIN_BYTES = 64 * 1024 * 1024 # الأرشيفات الأصغر لا تستحق كلفة تشغيل العمليات
+ZIP_BATCHES_PER_WORKER = 4                    # دفعات أصغر تعني توازنًا أفضل وتقدمًا أدق
+TAR_PIPELINE_CHUNK_SIZE = 1024 * 1024
+TAR_PIPELINE_QUEUE_CHUNKS = 32                # حد الذاكرة بين فك الضغط والكتابة (32 × 1MB)
+
+extract_executor = None
+extract_executor_lock = threading.Lock()
+
+def get_extract_executor():
+    global extract_executor
+    with extract_executor_lock:
+        if extract_executor is None:
+            # spawn: العمليات العاملة لا ترث أقفال خيوط Flask. تستورد extract_workers فقط، إلا عند التشغيل بـ
+            # python app.py فيُعاد تنفيذ هذا الملف كـ __mp_main__ (دون تهيئة التخزين، انظر IS_POOL_WORKER_PROCESS)
+            extract_executor = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return extract_executor
+
+def reset_extract_executor():
+    global extract_executor
+    with extract_executor_lock:
+        broken_executor, extract_executor = extract_executor, None
+    if broken_executor:
+        broken_executor.shutdown(wait=False, cancel_futures=True)
+
+def record_stage_throughput(progress, stage, byte_count, seconds):
+    """ تسجيل إنتاجية مرحلة (البايتات والثواني وMB/s) في سجل المهمة وفي السجلات. """
+    mb_per_s = byte_count / seconds / (1024 * 1024) if seconds > 0 else 0.0
+    stats = {'bytes': byte_count, 'seconds': round(seconds, 3), 'mb_per_s': round(mb_per_s, 2)}
+    if progress is not None:
+        with jobs_lock:
+            progress.setdefault('stage_stats', {})[stage] = stats
+            progress['updated_at'] = time.time()
+    logger.info(f"إنتاجية المرحلة {stage}: {byte_count / (1024 * 1024):.2f} MB في {seconds:.2f} ثانية ({mb_per_s:.2f} MB/s)")
+    observe_stage(progress, stage, seconds, byte_count)
+    return stats
+
+def should_extract_in_parallel(total_bytes, member_count, workers=None):
+    workers = EXTRACT_WORKERS if workers is None else workers
+    return workers > 1 and member_count > 1 and total_bytes >= PARALLEL_EXTRACT_MIN_BYTES
+
+def balance_zip_batches(members, batch_count):
+    """ توزيع العناصر على دفعات متقاربة الكلفة (الأكبر أولًا إلى الدفعة الأخف حاليًا). """
+    batches = [(0, i, []) for i in range(max(1, batch_count))]
+    heapq.heapify(batches)
+    # الكلفة: الحجم المضغوط (فك الضغط) + الحجم الأصلي (الكتابة)
+    for member in sorted(members, key=lambda m: m.compress_size + m.file_size, reverse=True):
+        cost, i, names = heapq.heappop(batches)
+        names.append(member.filename)
+        heapq.heappush(batches, (cost + member.compress_size + member.file_size, i, names))
+    return [names for _, _, names in sorted(batches, key=lambda b: b[1]) if names]
+
+def extract_zip_parallel(local_archive_path, members, extracted_session_folder, progress=None, workers=None):
+    """ فك ضغط عناصر ZIP في مجمع العمليات؛ يعيد مجموع الثواني التي قضتها العمليات في العمل. """
+    # المجلدات تُنشأ هنا أولًا حتى لا تتسابق العمليات على إنشائها
+    file_members = []
+    for member in members:
+        if member.is_dir():
+            target_path = safe_extract_path(extracted_session_folder, member.filename)
+            if target_path:
+                os.makedirs(target_path, exist_ok=True)
+        else:
+            file_members.append(member)
+    workers = EXTRACT_WORKERS if workers is None else workers
+    batches = balance_zip_batches(file_members, workers * ZIP_BATCHES_PER_WORKER)
+
+    # workers مخصص (مثل قياسات الأداء) يعني مجمعًا مؤقتًا بهذا العدد بدل المجمع المشترك
+    own_executor = None
+    if workers != EXTRACT_WORKERS:
+        own_executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    executor = own_executor or get_extract_executor()
+    futures = []
+    try:
+        futures = [executor.submit(extract_workers.extract_zip_members, local_archive_path, batch, extracted_session_folder) for batch in batches]
+        worker_seconds = 0.0
+        for future in as_completed(futures):
+            extracted_bytes, seconds = future.result()
+            add_progress_bytes(progress, 'bytes_extracted', extracted_bytes)
+            worker_seconds += seconds
+        return worker_seconds
+    except BrokenProcessPool:
+        if own_executor is None:
+            logger.warning("مجمع عمليات فك الضغط معطل. سيُعاد إنشاؤه في المهمة التالية.")
+            reset_extract_executor()
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
+        if own_executor:
+            own_executor.shutdown(wait=True)
+
+def safe_extract_path(extracted_session_folder, member_name):
+    """ المسار المطلق لعنصر داخل مجلد الاستخراج، أو None إن كان يخرج منه (مثل ../). """
+    relative_path = normalize_member_path(member_name)
+    if not relative_path:
+        return None
+    base_path = os.path.abspath(extracted_session_folder)
+    target_path = os.path.abspath(os.path.join(base_path, *relative_path.split('/')))
+    if os.path.commonpath([base_path, target_path]) != base_path:
+        return None
+    return target_path
+
+def extract_tar_member_safely(tf, member, extracted_session_folder):
+    """ tf.extract بمرشح 'data': يرفض الروابط المشيرة خارج مجلد الاستخراج (link -> /etc ثم link/x)
+    والمسارات المطلقة وملفات الأجهزة، فيُتخطى العنصر بدل الكتابة خارج الجلسة. يعيد True إن استُخرج. """
+    if not hasattr(tarfile, 'data_filter'): # Python أقدم من 3.11.4 بلا مرشحات: تُستخرج الملفات والمجلدات فقط
+        if not (member.isfile() or member.isdir()) or safe_extract_path(extracted_session_folder, member.name) is None:
+            logger.warning(f"تم تخطي عنصر TAR غير آمن أو غير مدعوم: {member.name}")
+            return False
+        tf.extract(member, path=extracted_session_folder)
+        return True
+    try:
+        tf.extract(member, path=extracted_session_folder, filter='data')
+        return True
+    except tarfile.FilterError as e:
+        logger.warning(f"تم تخطي عنصر TAR غير آمن {member.name}: {e}")
+        return False
+
+def extract_tar_pipelined(local_archive_path, extracted_session_folder, progress=None, fileobj=None):
+    """ فك ضغط TAR (من ملف أو كائن ملف تسلسلي) في هذا الخيط مع الكتابة على القرص في خيط آخر؛
+    يعيد (البايتات، ثواني فك الضغط، ثواني الكتابة). """
+    chunks = queue.Queue(maxsize=TAR_PIPELINE_QUEUE_CHUNKS)
+    writer_state = {'error': None, 'seconds': 0.0}
+
+    def write_chunks():
+        current_file = None
+        try:
+            while True:
+                item = chunks.get()
+                try:
+                    if item is None:
+                        return
+                    if writer_state['error'] is not None:
+                        continue # بعد الخطأ يُفرغ الطابور فقط حتى لا يتوقف القارئ عند put
+                    action, payload = item
+                    started_at = time.perf_counter()
+                    if action == 'open':
+                        current_file = open(payload, 'wb')
+                    elif action == 'write':
+                        current_file.write(payload)
+                    else: # close
+                        current_file.close()
+                        current_file = None
+                        target_path, mtime = payload
+                        os.utime(target_path, (mtime, mtime))
+                    writer_state['seconds'] += time.perf_counter() - started_at
+                except Exception as e:
+                    writer_state['error'] = e
+                    if current_file:
+                        current_file.close()
+                        current_file = None
+                finally:
+                    chunks.task_done()
+        finally: # فشل القارئ في منتصف عنصر: لا يصل 'close' فيُغلق الملف المفتوح هنا
+            if current_file:
+                current_file.close()
+
+    writer = threading.Thread(target=write_chunks, name='tar-writer', daemon=True)
+    writer.start()
+    decompress_seconds = 0.0
+    extracted_bytes = 0
+    try:
+        with tarfile.open(local_archive_path, 'r|*', fileobj=fileobj) as tf: # وضع التدفق: قراءة تسلسلية دون رجوع للخلف
+            for member in tf:
+                if writer_state['error'] is not None:
+                    break
+                target_path = safe_extract_path(extracted_session_folder, member.name)
+                if target_path is None:
+                    logger.warning(f"تم تخطي عنصر TAR خارج مجلد الاستخراج: {member.name}")
+                    continue
+                if member.isdir():
+                    os.makedirs(target_path, exist_ok=True)
+                elif member.isfile():
+                    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                    chunks.put(('open', target_path))
+                    source = tf.extractfile(member)
+                    while True:
+                        started_at = time.perf_counter()
+                        chunk = source.read(TAR_PIPELINE_CHUNK_SIZE)
+                        decompress_seconds += time.perf_counter() - started_at
+                        if not chunk:
+                            break
+                        chunks.put(('write', chunk))
+                    chunks.put(('close', (target_path, member.mtime)))
+                    extracted_bytes += member.size
+                    add_progress_bytes(progress, 'bytes_extracted', member.size)
+                else:
+                    # الروابط قد تشير إلى ملف ما زال في الطابور: انتظار الكاتب ثم الاستخراج بالمرشح
+                    chunks.join()
+                    extract_tar_member_safely(tf, member, extracted_session_folder)
+    finally:
+        chunks.put(None)
+        writer.join()
+    if writer_state['error'] is not None:
+        raise writer_state['error']
+    return extracted_bytes, decompress_seconds, writer_state['seconds']
+
+def extract_archive(local_archive_path, archive_type, extracted_session_folder, progress=None):
+    """ فك ضغط الأرشيف (بالتوازي لـ ZIP و TAR عند تفعيله) مع الإبلاغ عن عدد البايتات المستخرجة. """
+    update_progress(progress, stage='extracting')
+    if archive_type == 'rar':
+        with rarfile.RarFile(local_archive_path) as rf:
+            members = rf.infolist()
+            update_progress(progress, extract_total=sum(m.file_size for m in members))
+            for member in members:
+                rf.extract(member, path=extracted_session_folder)
+                add_progress_bytes(progress, 'bytes_extracted', member.file_size)
+    elif archive_type == 'zip':
+        with zipfile.ZipFile(local_archive_path, 'r') as zf:
+            members = zf.infolist()
+            extract_total = sum(m.file_size for m in members)
+            update_progress(progress, extract_total=extract_total)
+            if should_extract_in_parallel(extract_total, len(members)):
+                worker_seconds = extract_zip_parallel(local_archive_path, members, extracted_session_folder, progress)
+                record_stage_throughput(progress, 'zip_per_worker', extract_total, worker_seconds)
+            else:
+                for member in members:
+                    zf.extract(member, path=extracted_session_folder)
+                    add_progress_bytes(progress, 'bytes_extracted', member.file_size)
+    elif archive_type == 'tar':
+        # حجم TAR غير المضغوط غير معروف قبل قراءته كاملًا، وحجم الملف حد أدنى له
+        if should_extract_in_parallel(os.path.getsize(local_archive_path), 2):
+            tar_bytes, decompress_seconds, write_seconds = extract_tar_pipelined(local_archive_path, extracted_session_folder, progress)
+            record_stage_throughput(progress, 'tar_decompress', tar_bytes, decompress_seconds)
+            record_stage_throughput(progress, 'disk_write', tar_bytes, write_seconds)
+        else:
+            with tarfile.open(local_archive_path, 'r:*') as tf:
+                for member in tf:
+                    if extract_tar_member_safely(tf, member, extracted_session_folder):
+                        add_progress_bytes(progress, 'bytes_extracted', member.size if member.isfile() else 0)
+    elif archive_type == '7z':
+        os.makedirs(extracted_session_folder, exist_ok=True)
+        with py7zr.SevenZipFile(local_archive_path, mode='r') as szf:
+            update_progress(progress, extract_total=szf.archiveinfo().uncompressed)
+            szf.extractall(path=extracted_session_folder, callback=_SevenZipProgressCallback(progress))
+    else:
+        raise ArchiveProcessingError("فشل فك ضغط الأرشيف.", 500)
+
+# --- الوضع الكسول: فهرسة الأرشيف واستخراج العناصر عند الطلب ---
+# بدلًا من extractall() يُبنى الهيكل مباشرة من قائمة عناصر الأرشيف، ويُحفظ الأرشيف
+# داخل مجلد الجلسة ليستخرج /view-file العنصر المطلوب فقط عند أول طلب له.
+lazy_extract_locks = {} # قفل لكل جلسة حتى لا يُستخرج العنصر نفسه مرتين بالتوازي
+lazy_extract_locks_guard = threading.Lock()
+# ترتيب LRU للعناصر المستخرجة عند الطلب مع مجموع أحجامها لكل جلسة، في الذاكرة: لا مرور على شجرة
+# الجلسة بعد كل استخراج ولا اعتماد على st_atime (لا يُحدّث مع noatime/relatime).
+member_cache_lru = {} # session_id -> {'members': OrderedDict(المسار -> الحجم)، 'bytes': المجموع}
+member_cache_lru_lock = threading.Lock()
+
+def normalize_member_path(member_name):
+    """ توحيد مسار العنصر داخل الأرشيف إلى صيغة مسارات الشجرة (a/b/c). """
+    normalized = member_name.replace('\\', '/')
+    while normalized.startswith('./'):
+        normalized = normalized[2:]
+    normalized = normalized.strip('/')
+    return '' if normalized == '.' else normalized
+
+def list_archive_members(archive_path, archive_type):
+    """ قراءة قائمة العناصر كـ (اسم العنصر الأصلي، هل هو مجلد، الحجم) دون فك الضغط. """
+    if archive_type == 'zip':
+        with zipfile.ZipFile(archive_path, 'r') as zf:
+            return [(info.filename, info.is_dir(), info.file_size) for info in zf.infolist()]
+    if archive_type == 'rar':
+        with rarfile.RarFile(archive_path) as rf:
+            return [(info.filename, info.is_dir(), info.file_size) for info in rf.infolist()]
+    if archive_type == 'tar':
+        # ملاحظة: tar المضغوط (gz/bz2/xz) يتطلب المرور على كامل البيانات لقراءة القائمة
+        with tarfile.open(archive_path, 'r:*') as tf:
+            return [(member.name, member.isdir(), member.size) for member in tf.getmembers() if member.isfile() or member.isdir()]
+    if archive_type == '7z':
+        with py7zr.SevenZipFile(archive_path, mode='r') as szf:
+            return [(info.filename, info.is_directory, info.uncompressed) for info in szf.list()]
+    if archive_type == 'remote_zip':
+        zf, _, zip_lock, _ = open_remote_zip(archive_path)
+        with zip_lock:
+            return [(info.filename, info.is_dir(), info.file_size) for info in zf.infolist()]
+    raise ArchiveProcessingError(f"نوع الأرشيف غير مدعوم في الوضع الكسول: {archive_type}", 400)
+
+def build_structure_from_members(members, session_id):
+    """ بناء الهيكل الهرمي من قائمة عناصر الأرشيف وحفظه في ملف الهيكل للجلسة. """
+    def iter_entries():
+        for member_name, is_dir, size in members:
+            member_path = normalize_member_path(member_name)
+            if member_path and member_path.split('/')[0] not in SESSION_INTERNAL_NAMES:
+                yield member_path, is_dir, size
+
+    structure, file_sizes = _build_tree_from_entries(iter_entries())
+    save_structure_files(structure, file_sizes, session_id)
+    return structure
 
-    url_hash = hashlib.md5(original_archive_url.encode('utf-8')).hexdigest()
-    logger.info(f"معالجة الرابط: {original_archive_url}, Hash: {url_hash}")
+def prepare_lazy_session(local_archive_path, archive_type, extracted_session_folder, session_id, progress=None):
+    """ نقل الأرشيف إلى مجلد الجلسة وبناء الهيكل من قائمة عناصره دون فك الضغط. """
+    update_progress(progress, stage='indexing')
+    lazy_source_folder = os.path.join(extracted_session_folder, LAZY_SOURCE_DIRNAME)
+    os.makedirs(lazy_source_folder, exist_ok=True)
+    archive_filename = os.path.basename(local_archive_path)
+    volume_paths = [local_archive_path]
+    if archive_type == 'rar': # أجزاء مجموعة RAR الأخرى يجب أن تبقى بجانب الجزء الأول
+        with rarfile.RarFile(local_archive_path) as rf:
+            volume_paths = rf.volumelist()
+    for volume_path in volume_paths:
+        shutil.move(volume_path, os.path.join(lazy_source_folder, os.path.basename(volume_path)))
+    return index_lazy_source(archive_filename, archive_type, extracted_session_folder, session_id)
+
+def index_lazy_source(archive_filename, archive_type, session_folder, session_id):
+    """ بناء هيكل جلسة كسولة من قائمة عناصر أرشيفها الموجود في LAZY_SOURCE_DIRNAME. """
+    members = list_archive_members(os.path.join(session_folder, LAZY_SOURCE_DIRNAME, archive_filename), archive_type)
+    with open(os.path.join(session_folder, LAZY_SOURCE_META_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump({'archive_type': archive_type, 'archive_filename': archive_filename}, f, ensure_ascii=False)
+    logger.info(f"تمت فهرسة {len(members)} عنصرًا من الأرشيف للجلسة {session_id} (الوضع الكسول).")
+    return build_structure_from_members(members, session_id)
+
+def load_lazy_source(session_folder):
+    """ إرجاع بيانات مصدر الجلسة الكسولة أو None إذا كانت الجلسة مستخرجة بالكامل. """
+    meta_path = os.path.join(session_folder, LAZY_SOURCE_META_FILENAME)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        lazy_source = json.load(f)
+    if lazy_source['archive_type'] == 'remote_zip': # الأرشيف على الخادم البعيد ويُقرأ بطلبات Range
+        lazy_source['archive_path'] = lazy_source['archive_url']
+    else:
+        lazy_source['archive_path'] = os.path.join(session_folder, LAZY_SOURCE_DIRNAME, lazy_source['archive_filename'])
+    return lazy_source
+
+@functools.lru_cache(maxsize=16)
+def _member_name_map(archive_path, archive_type):
+    """ خريطة (مسار الشجرة -> اسم العنصر الأصلي) لتجنب قراءة القائمة عند كل طلب. """
+    return {normalize_member_path(member_name): member_name
+            for member_name, is_dir, _ in list_archive_members(archive_path, archive_type) if not is_dir}
+
+def _extract_single_member(archive_path, archive_type, member_name, target_folder):
+    if archive_type == 'zip':
+        with zipfile.ZipFile(archive_path, 'r') as zf:
+            zf.extract(member_name, path=target_folder)
+    elif archive_type == 'rar':
+        with rarfile.RarFile(archive_path) as rf:
+            rf.extract(member_name, path=target_folder)
+    elif archive_type == 'tar':
+        # getmember يقرأ الترويسات من بداية الأرشيف: رخيص لـ tar غير المضغوط (تخطٍّ بـ seek)، أما المضغوط
+        # (في الأرشيفات المتداخلة فقط، إذ لا يُفتح الوضع الكسول له عند التحميل) فيُفك ضغطه حتى العنصر عند كل طلب
+        with tarfile.open(archive_path, 'r:*') as tf:
+            extract_tar_member_safely(tf, tf.getmember(member_name), target_folder)
+    elif archive_type == '7z':
+        with py7zr.SevenZipFile(archive_path, mode='r') as szf:
+            szf.extract(path=target_folder, targets=[member_name])
+    elif archive_type == 'remote_zip':
+        _extract_remote_zip_member(archive_path, member_name, target_folder)
+
+def _get_lazy_extract_lock(session_id):
+    with lazy_extract_locks_guard:
+        return lazy_extract_locks.setdefault(session_id, threading.Lock())
+
+def _scan_cached_members(session_folder):
+    """ العناصر المستخرجة الموجودة على القرص (الأقدم استخراجًا أولًا)؛ مرة واحدة لكل جلسة في العملية. """
+    cached_members = []
+    for root, dirs, files in os.walk(session_folder):
+        if root == session_folder:
+            dirs[:] = [d for d in dirs if d not in SESSION_INTERNAL_NAMES]
+            files = [f for f in files if f not in SESSION_INTERNAL_NAMES]
+        for f_name in files:
+            file_path = os.path.join(root, f_name)
+            stat_result = os.stat(file_path)
+            cached_members.append((stat_result.st_mtime, file_path, stat_result.st_size))
+    return collections.OrderedDict((file_path, size) for _, file_path, size in sorted(cached_members))
+
+def touch_cached_member(session_id, file_path):
+    """ نقل العنصر إلى آخر ترتيب LRU عند خدمته (لا شيء إن لم يُحمّل سجل الجلسة بعد). """
+    with member_cache_lru_lock:
+        lru = member_cache_lru.get(session_id)
+        if lru is not None and file_path in lru['members']:
+            lru['members'].move_to_end(file_path)
+
+def forget_member_cache(session_id):
+    """ إسقاط سجلات LRU للجلسة وجلساتها الفرعية عند حذفها. """
+    with member_cache_lru_lock:
+        for cached_session_id in [key for key in member_cache_lru if get_root_session_id(key) == session_id]:
+            del member_cache_lru[cached_session_id]
+
+def record_extracted_member(session_id, session_folder, file_path):
+    """ تسجيل عنصر مستخرج للتو ثم حذف الأقدم استخدامًا إذا تجاوزت الجلسة LAZY_MEMBER_CACHE_MAX_BYTES. """
+    with member_cache_lru_lock:
+        lru = member_cache_lru.get(session_id)
+    if lru is None: # أول استخراج في هذه العملية: تحميل ما استُخرج سابقًا (قبل إعادة التشغيل مثلًا)
+        members = _scan_cached_members(session_folder)
+        with member_cache_lru_lock:
+            lru = member_cache_lru.setdefault(session_id, {'members': members, 'bytes': sum(members.values())})
+
+    evicted = []
+    file_size = os.path.getsize(file_path)
+    with member_cache_lru_lock:
+        members = lru['members']
+        lru['bytes'] += file_size - members.pop(file_path, 0)
+        members[file_path] = file_size
+        while lru['bytes'] > LAZY_MEMBER_CACHE_MAX_BYTES and len(members) > 1:
+            evicted_path, size = members.popitem(last=False)
+            lru['bytes'] -= size
+            evicted.append((evicted_path, size))
+    size_delta = file_size
+    for evicted_path, size in evicted:
+        try:
+            os.remove(evicted_path)
+            size_delta -= size
+            logger.info(f"تم حذف العنصر {evicted_path} من ذاكرة العناصر المستخرجة (تجاوز الحد).")
+        except OSError as e:
+            logger.warning(f"تعذر حذف العنصر المستخرج {evicted_path}: {e}")
+    add_session_bytes(session_folder, size_delta)
+
+def extract_member_on_demand(session_id, session_folder, filepath):
+    """ استخراج عنصر واحد من أرشيف جلسة كسولة إلى مكانه في مجلد الجلسة. يعيد True عند النجاح. """
+    lazy_source = load_lazy_source(session_folder)
+    if not lazy_source:
+        return False
+    target_path = os.path.join(session_folder, filepath)
+
+    with _get_lazy_extract_lock(session_id):
+        if os.path.isfile(target_path): # استخرجه طلب متزامن آخر
+            return True
+        archive_path, archive_type = lazy_source['archive_path'], lazy_source['archive_type']
+        member_name = _member_name_map(archive_path, archive_type).get(filepath)
+        if member_name is None:
+            return False
+
+        # الاستخراج إلى مجلد مؤقت ثم النقل الذري حتى لا يُخدم ملف ناقص
+        staging_folder = os.path.join(session_folder, LAZY_SOURCE_DIRNAME, f"staging-{uuid.uuid4().hex}")
+        try:
+            extraction_start_time = time.time()
+            _extract_single_member(archive_path, archive_type, member_name, staging_folder)
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            os.replace(os.path.join(staging_folder, *normalize_member_path(member_name).split('/')), target_path)
+            logger.info(f"تم استخراج العنصر {filepath} عند الطلب للجلسة {session_id} in {time.time() - extraction_start_time:.2f} seconds.")
+        finally:
+            shutil.rmtree(staging_folder, ignore_errors=True)
+
+    record_extracted_member(session_id, session_folder, target_path)
+    return True
+
+# --- تصفح ZIP البعيد عبر طلبات HTTP Range ---
+# للروابط المباشرة لملفات ZIP: يُقرأ الدليل المركزي (central directory) من نهاية الملف
+# بطلبات Range دون تحميل الأرشيف، ويُجلب نطاق بايتات كل عنصر فقط عند طلبه في /view-file.
+# اختياري (mode='remote'): الجلسة لا تحتفظ بنسخة محلية، فكل عرض لاحق يحتاج بقاء الخادم الأصلي والرابط صالحين.
+REMOTE_ZIP_AUTO = os.environ.get("ARCHIVE_REMOTE_ZIP_AUTO", "0") == "1" # تجربته تلقائيًا لروابط .zip في auto/lazy
+REMOTE_ZIP_MIN_FETCH = 64 * 1024            # أصغر طلب Range (يغطي نهاية الملف وسجل EOCD في طلب واحد)
+REMOTE_ZIP_MAX_READAHEAD = 8 * 1024 * 1024  # أكبر قراءة مسبقة عند القراءة المتتالية لعنصر كبير
+
+class RangeNotSupportedError(Exception):
+    """ الخادم لا يدعم طلبات HTTP Range لهذا الرابط. """
+
+class HttpRangeFile(io.RawIOBase):
+    """ ملف للقراءة فقط فوق رابط HTTP، يجلب البايتات المطلوبة بطلبات Range مع قراءة مسبقة متكيفة. """
+    def __init__(self, url, size, validator=None, http_session_override=None):
+        super().__init__()
+        self.url = url
+        self.size = size
+        self.validator = validator # ETag قوي أو Last-Modified لـ If-Range: تغيّر الملف يعيد 200 بدل بايتات نسخة أخرى
+        self.readahead_limit = None # نهاية نطاق العنصر الجاري قراءته (لا تتجاوزه القراءة المسبقة)
+        self.requests_made = 0
+        self._http = http_session_override or http_session
+        self._pos = 0
+        self._buffer = b''
+        self._buffer_start = 0
+        self._readahead = REMOTE_ZIP_MIN_FETCH
+
+    def readable(self): return True
+    def seekable(self): return True
+    def tell(self): return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET: new_pos = offset
+        elif whence == io.SEEK_CUR: new_pos = self._pos + offset
+        elif whence == io.SEEK_END: new_pos = self.size + offset
+        else: raise ValueError(f"whence غير صالح: {whence}")
+        if new_pos < 0:
+            raise ValueError("لا يمكن الانتقال إلى موضع سالب.")
+        self._pos = new_pos
+        return self._pos
+
+    def _fetch(self, start, end):
+        headers = {'User-Agent': 'Mozilla/5.0', 'Range': f'bytes={start}-{end - 1}'}
+        if self.validator:
+            headers['If-Range'] = self.validator
+        # stream=True: لا يُقرأ الجسم قبل التأكد من أنه النطاق المطلوب (لا الأرشيف كاملًا في الذاكرة)
+        with self._http.get(self.url, headers=headers, stream=True, timeout=(REQUESTS_CONNECT_TIMEOUT, REQUESTS_READ_TIMEOUT)) as r:
+            self.requests_made += 1
+            if r.status_code != 206:
+                r.raise_for_status()
+                raise RangeNotSupportedError(f"الخادم أعاد {r.status_code} بدلًا من 206 لطلب Range (أو تغيّر الملف البعيد): {self.url}")
+            range_match = re.match(r'bytes\s+(\d+)-(\d+)/(\d+|\*)', r.headers.get('content-range', ''))
+            if (not range_match or int(range_match.group(1)) != start or int(range_match.group(2)) >= end
+                    or range_match.group(3) not in ('*', str(self.size))):
+                raise RangeNotSupportedError(f"Content-Range غير متوقع ({r.headers.get('content-range')}) لطلب {start}-{end - 1}: {self.url}")
+            return r.content
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            n = self.size - self._pos
+        n = max(0, min(n, self.size - self._pos))
+        chunks = []
+        while n > 0:
+            buffer_end = self._buffer_start + len(self._buffer)
+            if self._buffer_start <= self._pos < buffer_end:
+                offset = self._pos - self._buffer_start
+                chunk = self._buffer[offset:offset + n]
+                chunks.append(chunk)
+                self._pos += len(chunk)
+                n -= len(chunk)
+                continue
 
-    archive_type = None # Initialize archive_type
+            fetch_start = self._pos
+            if self._buffer and self._pos == buffer_end: # قراءة متتالية: مضاعفة القراءة المسبقة
+                self._readahead = min(self._readahead * 2, REMOTE_ZIP_MAX_READAHEAD)
+            else:
+                self._readahead = REMOTE_ZIP_MIN_FETCH
+                if self._pos >= self.size - REMOTE_ZIP_MIN_FETCH: # قراءة من نهاية الملف: جلب الذيل كاملًا
+                    fetch_start = max(0, self.size - REMOTE_ZIP_MIN_FETCH)
+            fetch_size = self._readahead
+            if self.readahead_limit and self._pos < self.readahead_limit:
+                fetch_size = min(self.readahead_limit - fetch_start, REMOTE_ZIP_MAX_READAHEAD)
+            fetch_end = min(self.size, max(self._pos + n, fetch_start + fetch_size))
+            self._buffer = self._fetch(fetch_start, fetch_end)
+            self._buffer_start = fetch_start
+            if not self._buffer:
+                break
+        return b''.join(chunks)
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+def open_remote_zip(url):
+    """ فتح ZIP بعيد وإرجاع (ZipFile، الملف البعيد، قفل، نهايات العناصر). يُفحص الرابط في كل فتح والمقبض
+    المخزن مرتبط بنسخة الملف (الحجم وETag وLast-Modified)، فتغيّره يقرأ الدليل المركزي من جديد. """
+    probe = probe_download(url)
+    if not probe['accepts_ranges']:
+        raise RangeNotSupportedError(f"الخادم لا يدعم طلبات Range: {url}")
+    return _open_remote_zip_version(probe['url'], probe['size'], probe['etag'], probe['last_modified'])
+
+@functools.lru_cache(maxsize=8)
+def _open_remote_zip_version(final_url, size, etag, last_modified):
+    remote_file = HttpRangeFile(final_url, size, validator=range_validator(etag, last_modified))
+    zf = zipfile.ZipFile(remote_file, 'r')
+    # نهاية بيانات كل عنصر = بداية العنصر التالي (أو بداية الدليل المركزي)، لتحديد نطاق الجلب
+    offsets = sorted(info.header_offset for info in zf.infolist()) + [zf.start_dir]
+    next_offset = {offset: offsets[i + 1] for i, offset in enumerate(offsets[:-1])}
+    member_ends = {info.filename: next_offset.get(info.header_offset, size) for info in zf.infolist()}
+    logger.info(f"تم فتح ZIP بعيد ({size} بايت، {len(member_ends)} عنصرًا) بـ {remote_file.requests_made} طلبات Range: {final_url}")
+    return zf, remote_file, threading.Lock(), member_ends
+
+def should_try_remote_zip(original_archive_url, mode):
+    if "mega.nz" in original_archive_url or "mega.co.nz" in original_archive_url or "drive.google.com" in original_archive_url:
+        return False
+    if mode == 'remote':
+        return True
+    return REMOTE_ZIP_AUTO and mode in ('auto', 'lazy') and urlparse(original_archive_url).path.lower().endswith('.zip')
+
+def prepare_remote_zip_session(original_archive_url, extracted_session_folder, session_id, progress=None):
+    """ بناء الهيكل من الدليل المركزي لـ ZIP بعيد. يعيد None للرجوع إلى التحميل الكامل. """
+    update_progress(progress, stage='indexing')
+    indexing_start_time = time.time()
+    try:
+        zf, remote_file, zip_lock, _ = open_remote_zip(original_archive_url)
+        with zip_lock:
+            members = [(info.filename, info.is_dir(), info.file_size) for info in zf.infolist()]
+    except (RangeNotSupportedError, zipfile.BadZipFile, requests.exceptions.RequestException) as e:
+        logger.info(f"تعذر تصفح الرابط كـ ZIP بعيد ({type(e).__name__}: {e}). الرجوع إلى التحميل الكامل.")
+        return None
 
-    if url_hash in url_cache:
-        cached_data = url_cache[url_hash]
-        cached_session_id = cached_data.get('session_id')
-        # تأكد أن المسار إلى ملف الهيكل صحيح
-        cached_structure_file = os.path.join(EXTRACTED_FILES_DIR_FLASK_APP, cached_session_id, '.archive_structure.json')
-        logger.info(f"العثور على Hash في الكاش {url_hash}. Session ID: {cached_session_id}. مسار ملف الهيكل: {cached_structure_file}")
+    with open(os.path.join(extracted_session_folder, LAZY_SOURCE_META_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump({'archive_type': 'remote_zip', 'archive_url': original_archive_url, 'archive_size': remote_file.size}, f, ensure_ascii=False)
+    update_progress(progress, archive_type='zip', bytes_total=remote_file.size)
+    structure = build_structure_from_members(members, session_id)
+    logger.info(f"File structure built from remote ZIP central directory in {time.time() - indexing_start_time:.2f} seconds for session {session_id}.")
+    return structure
 
-        if os.path.exists(cached_structure_file):
-            try:
-                with open(cached_structure_file, 'r', encoding='utf-8') as f:
-                    structure = json.load(f)
-                logger.info(f"تم تحميل الهيكل الم缓存 بنجاح للجلسة {cached_session_id}.")
-                return jsonify({
-                    'message': 'تمت معالجة الملف بنجاح (من ذاكرة التخزين المؤقت).',
-                    'session_id': cached_session_id,
-                    'structure': structure
-                }), 200
-            except Exception as e:
-                logger.error(f"تم العثور على Hash، ولكن فشل تحميل ملف الهيكل {cached_structure_file}: {e}. إعادة المعالجة.")
-        else:
-            logger.warning(f"تم العثور على Hash، ولكن ملف الهيكل {cached_structure_file} غير موجود. إعادة المعالجة.")
+def _extract_remote_zip_member(archive_url, member_name, target_folder):
+    zf, remote_file, zip_lock, member_ends = open_remote_zip(archive_url)
+    with zip_lock:
+        remote_file.readahead_limit = member_ends.get(member_name)
+        try:
+            zf.extract(member_name, path=target_folder)
+        finally:
+            remote_file.readahead_limit = None
+
+# --- الأرشيفات المتداخلة (تُركّب عند فتحها) ---
+# الأرشيف داخل الأرشيف يظهر في الشجرة كملف قابل للفتح (is_archive). عند فتحه أول مرة يُفهرس في الوضع
+# الكسول كجلسة فرعية داخل مجلد الجلسة الأم (.nested/<بصمة المسار>) بمعرّف <الأم>--n<البصمة>، فتعمل
+# عليه كل المسارات (/list و/view-file و/search و/download-zip) كما هي، ويُحذف مع الجلسة العليا.
+nested_mount_locks = {}
+nested_mount_locks_guard = threading.Lock()
+
+def get_nested_session_id(parent_session_id, relative_path):
+    return f"{parent_session_id}{NESTED_SESSION_SEPARATOR}{hashlib.sha1(relative_path.encode('utf-8')).hexdigest()[:16]}"
+
+def mount_nested_archive(parent_session_id, parent_folder, relative_path):
+    """ تركيب أرشيف من الجلسة كجلسة فرعية كسولة (مرة واحدة، ثم من القرص)؛ يعيد (معرّف الجلسة الفرعية، النوع). """
+    if get_nested_depth(parent_session_id) >= NESTED_ARCHIVE_MAX_DEPTH:
+        raise ArchiveProcessingError(f"تم بلوغ الحد الأقصى لعمق الأرشيفات المتداخلة ({NESTED_ARCHIVE_MAX_DEPTH}).", 400)
+    session_id = get_nested_session_id(parent_session_id, relative_path)
+    session_folder = get_session_folder(session_id)
+    with nested_mount_locks_guard:
+        mount_lock = nested_mount_locks.setdefault(session_id, threading.Lock())
+
+    with mount_lock:
+        if load_archive_index(session_folder) is not None: # مركّب من قبل (الفهرس آخر ما يُكتب)
+            return session_id, load_lazy_source(session_folder)['archive_type']
+
+        source_path = os.path.join(parent_folder, *relative_path.split('/'))
+        error = ensure_session_file(parent_session_id, parent_folder, source_path, relative_path)
+        if error:
+            raise ArchiveProcessingError(*error)
+        archive_type = get_archive_type(source_path)
+        if not archive_type:
+            raise ArchiveProcessingError("الملف ليس أرشيفًا بصيغة مدعومة.", 400)
+
+        mount_start_time = time.perf_counter()
+        shutil.rmtree(session_folder, ignore_errors=True) # بقايا تركيب سابق لم يكتمل
+        os.makedirs(os.path.join(session_folder, LAZY_SOURCE_DIRNAME))
+        archive_filename = os.path.basename(source_path)
+        lazy_archive_path = os.path.join(session_folder, LAZY_SOURCE_DIRNAME, archive_filename)
+        try: # رابط صلب: لا نسخ، ويبقى الأرشيف حتى لو حذفه حد ذاكرة العناصر في جلسة أم كسولة
+            os.link(source_path, lazy_archive_path)
+        except OSError:
+            shutil.copyfile(source_path, lazy_archive_path)
+        try:
+            index_lazy_source(archive_filename, archive_type, session_folder, session_id)
+        except Exception:
+            shutil.rmtree(session_folder, ignore_errors=True)
+            raise
+        if load_archive_index(session_folder) is None:
+            shutil.rmtree(session_folder, ignore_errors=True)
+            raise ArchiveProcessingError("فشل بناء فهرس الأرشيف المتداخل.", 500)
+
+    mount_seconds = time.perf_counter() - mount_start_time
+    add_session_bytes(session_folder, get_folder_size(session_folder)) # حجم الجلسة العليا زاد بحجم الجلسة الفرعية
+    STAGE_DURATION.observe(mount_seconds, stage='nested_mount', source='nested', archive_type=archive_type)
+    logger.info(f"تم تركيب الأرشيف المتداخل {relative_path} من الجلسة {parent_session_id} كجلسة {session_id} "
+                f"({archive_type}) in {mount_seconds:.2f} seconds.")
+    return session_id, archive_type
+
+# --- الصور المصغرة ---
+# تُولد في مجمع عمليات (فك ترميز الصور وتصغيرها يستهلك المعالج ويحتجز GIL) بأحجام ثابتة،
+# وتُحفظ في <الجلسة>/.thumbs/<الحجم>/<مسار الصورة>.jpg فتُحذف مع الجلسة عند إخلاء المساحة.
+# الطلبات المتزامنة للصورة المصغرة نفسها تنتظر المهمة الجارية نفسها بدل توليدها مرة أخرى.
+THUMBNAIL_SIZES = {'small': 160, 'medium': 320, 'large': 640} # أقصى طول لضلع الصورة المصغرة بالبكسل
+THUMBNAIL_DEFAULT_SIZE = 'medium'
+THUMBNAIL_SOURCE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp') # SVG يُخدم كما هو
+THUMBNAIL_WORKERS = int(os.environ.get("ARCHIVE_THUMBNAIL_WORKERS", min(4, os.cpu_count() or 1)))
+THUMBNAIL_TIMEOUT_SECONDS = 60
+THUMBNAIL_CACHE_MAX_AGE = 7 * 24 * 3600     # الصورة المصغرة لا تتغير ضمن الجلسة
+THUMBNAIL_PREGENERATE = os.environ.get("ARCHIVE_THUMBNAIL_PREGENERATE", "0") == "1" # توليد مسبق بعد فك الضغط
+THUMBNAIL_PREGENERATE_MAX = 5000            # حد الصور المولدة مسبقًا لكل جلسة
+
+thumbnail_executor = None
+thumbnail_executor_lock = threading.Lock()
+thumbnail_futures = {} # مسار الصورة المصغرة -> Future قيد التوليد
+thumbnail_futures_lock = threading.Lock()
+
+def get_thumbnail_executor():
+    global thumbnail_executor
+    with thumbnail_executor_lock:
+        if thumbnail_executor is None:
+            # spawn: العمليات العاملة لا ترث أقفال خيوط Flask. تستورد thumbnails فقط، إلا عند التشغيل بـ
+            # python app.py فيُعاد تنفيذ هذا الملف كـ __mp_main__ (دون تهيئة التخزين، انظر IS_POOL_WORKER_PROCESS)
+            thumbnail_executor = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return thumbnail_executor
+
+def reset_thumbnail_executor():
+    global thumbnail_executor
+    with thumbnail_executor_lock:
+        broken_executor, thumbnail_executor = thumbnail_executor, None
+    if broken_executor:
+        broken_executor.shutdown(wait=False, cancel_futures=True)
+
+def get_thumbnail_path(session_folder, relative_path, size_name):
+    return os.path.join(session_folder, THUMBNAILS_DIRNAME, size_name, *relative_path.split('/')) + '.jpg'
+
+def generate_thumbnail(session_folder, relative_path, size_name):
+    """ إرجاع Future لتوليد الصورة المصغرة، مع دمج الطلبات المتزامنة للصورة نفسها في مهمة واحدة. """
+    thumbnail_path = get_thumbnail_path(session_folder, relative_path, size_name)
+    with thumbnail_futures_lock:
+        future = thumbnail_futures.get(thumbnail_path)
+        if future is not None:
+            return future
+        source_path = os.path.join(session_folder, *relative_path.split('/'))
+        try:
+            future = get_thumbnail_executor().submit(thumbnails.render_thumbnail, source_path, thumbnail_path, THUMBNAIL_SIZES[size_name])
+        except BrokenProcessPool: # توقفت عملية عاملة بشكل مفاجئ (مثل نفاد الذاكرة): مجمع جديد
+            logger.warning("مجمع عمليات الصور المصغرة معطل. إعادة إنشائه.")
+            reset_thumbnail_executor()
+            future = get_thumbnail_executor().submit(thumbnails.render_thumbnail, source_path, thumbnail_path, THUMBNAIL_SIZES[size_name])
+        thumbnail_futures[thumbnail_path] = future
+
+    def forget_future(done_future):
+        with thumbnail_futures_lock:
+            thumbnail_futures.pop(thumbnail_path, None)
+        if not done_future.cancelled() and done_future.exception() is None:
+            add_session_bytes(session_folder, get_file_size_or_zero(thumbnail_path))
+    future.add_done_callback(forget_future)
+    return future
+
+def pregenerate_thumbnails(session_id, session_folder):
+    """ جدولة توليد الصور المصغرة بالحجم الافتراضي لصور الجلسة دون انتظار انتهائها. """
+    archive_index = load_archive_index(session_folder)
+    if archive_index is None or not thumbnails.is_available():
+        return 0
+    scheduled = 0
+    for image_id in archive_index.images_under(0):
+        if scheduled >= THUMBNAIL_PREGENERATE_MAX:
+            break
+        relative_path = archive_index.path(image_id)
+        if not relative_path.lower().endswith(THUMBNAIL_SOURCE_EXTENSIONS):
+            continue
+        if not os.path.exists(get_thumbnail_path(session_folder, relative_path, THUMBNAIL_DEFAULT_SIZE)):
+            generate_thumbnail(session_folder, relative_path, THUMBNAIL_DEFAULT_SIZE)
+            scheduled += 1
+    logger.info(f"تمت جدولة {scheduled} صورة مصغرة للتوليد المسبق في الجلسة {session_id}.")
+    return scheduled
+
+def build_session_from_download(original_archive_url, session_id, temp_session_folder, extracted_session_folder, progress, mode,
+                                volume_urls=None):
+    """ تحميل الأرشيف (أو مجموعة أجزائه) كاملًا ثم فك ضغطه (أو فهرسته في الوضع الكسول) وبناء الهيكل. """
+    logger.info(f"بدء التحميل للجلسة {session_id} من {original_archive_url}")
+    download_start_time = time.perf_counter()
+    if volume_urls:
+        local_archive_path = fetch_volume_set(volume_urls, temp_session_folder, extracted_session_folder, progress, mode)
+        if local_archive_path is None: # TAR مقسّم فُك ضغطه أثناء التحميل
+            return finish_extracted_session(session_id, extracted_session_folder, progress)
     else:
-        logger.info(f"لم يتم العثور على Hash في الكاش {url_hash}. معالجة طلب جديد.")
+        local_archive_path = download_archive(original_archive_url, temp_session_folder, progress)
+    download_seconds = time.perf_counter() - download_start_time
+
+    logger.info(f"Download complete for session {session_id}. File: {local_archive_path}")
+    archive_size = os.path.getsize(local_archive_path)
+    logger.info(f"تم تحميل الأرشيف: {local_archive_path} (الحجم: {archive_size / (1024 * 1024):.2f} MB)")
+
+    detection_start_time = time.perf_counter()
+    archive_type, local_archive_path = detect_archive_type(local_archive_path, original_archive_url, temp_session_folder, progress)
+    observe_stage(progress, 'detecting', time.perf_counter() - detection_start_time)
+    # يُسجل التحميل بعد الكشف حتى يحمل وسم نوع الأرشيف
+    record_stage_throughput(progress, 'downloading', archive_size, download_seconds)
+
+    if mode in ('lazy', 'remote') and archive_type == 'tar' and (progress or {}).get('archive_codec'):
+        # tar المضغوط بلا وصول عشوائي: كل عنصر يُعرض يعني فك الضغط من بداية الأرشيف حتى موضعه،
+        # فاستخراجه كاملًا مرة واحدة أرخص من عشرات عمليات فك الضغط الجزئية
+        logger.info(f"tar مضغوط ({progress['archive_codec']}) للجلسة {session_id}: فك ضغط كامل بدل الوضع الكسول.")
+        mode = 'extract'
+
+    if mode in ('lazy', 'remote'):
+        indexing_start_time = time.time()
+        structure = prepare_lazy_session(local_archive_path, archive_type, extracted_session_folder, session_id, progress)
+        indexing_time = time.time() - indexing_start_time
+        logger.info(f"File structure built from archive listing in {indexing_time:.2f} seconds for session {session_id}.")
+        observe_stage(progress, 'indexing', indexing_time)
+        return structure
+
+    logger.info(f"جاري فك الضغط كأرشيف {archive_type}...")
+    extraction_start_time = time.time()
+    extract_archive(local_archive_path, archive_type, extracted_session_folder, progress)
+    extraction_time = time.time() - extraction_start_time
+    logger.info(f"تم فك ضغط الأرشيف بنجاح إلى: {extracted_session_folder} in {extraction_time:.2f} seconds.")
+    if progress is not None:
+        record_stage_throughput(progress, 'extracting', progress['bytes_extracted'], extraction_time)
+    return finish_extracted_session(session_id, extracted_session_folder, progress)
+
+def finish_extracted_session(session_id, extracted_session_folder, progress):
+    """ بناء الهيكل (والصور المصغرة مسبقًا إن فُعّلت) لجلسة فُك ضغطها بالكامل. """
+    update_progress(progress, stage='building_structure')
+    structure_build_start_time = time.time()
+    structure = build_file_structure(extracted_session_folder, session_id)
+    structure_build_time = time.time() - structure_build_start_time
+    logger.info(f"File structure built in {structure_build_time:.2f} seconds for session {session_id}.")
+    observe_stage(progress, 'building_structure', structure_build_time)
+    if THUMBNAIL_PREGENERATE: # الجلسات الكسولة والبعيدة تُولد صورها المصغرة عند الطلب فقط
+        pregenerate_thumbnails(session_id, extracted_session_folder)
+    return structure
 
-    session_id = str(int(time.time() * 1000))
+def run_archive_pipeline(original_archive_url, url_hash, session_id, progress, mode='auto', volume_urls=None):
+    """ تنفيذ مراحل التحميل والكشف وفك الضغط وبناء الهيكل، وإرجاع الرد النهائي. """
     temp_session_folder = os.path.join(TEMP_ARCHIVE_DIR_FLASK_APP, session_id)
     extracted_session_folder = os.path.join(EXTRACTED_FILES_DIR_FLASK_APP, session_id)
     os.makedirs(temp_session_folder, exist_ok=True)
     os.makedirs(extracted_session_folder, exist_ok=True)
 
-    local_archive_filename = "archive_download" # اسم عام، قد يتغير بعد التحميل
-    local_archive_path = os.path.join(temp_session_folder, local_archive_filename)
-    download_successful = False
-    actual_downloaded_filename_for_type_check = local_archive_filename
-
-    try:
-        logger.info(f"بدء التحميل للجلسة {session_id} من {original_archive_url}")
-        if "mega.nz" in original_archive_url or "mega.co.nz" in original_archive_url:
-            logger.info(f"رابط MEGA. استخدام MEGADL_EXEC_PATH: {MEGADL_EXEC_PATH}")
-            if not MEGADL_EXEC_PATH or (MEGADL_EXEC_PATH == "megadl" and not shutil.which("megadl")) and not os.path.exists(MEGADL_EXEC_PATH):
-                 raise FileNotFoundError(f"أداة megadl غير موجودة أو غير قابلة للتنفيذ: {MEGADL_EXEC_PATH}")
-
-            megadl_command = [MEGADL_EXEC_PATH, original_archive_url, "--path", temp_session_folder]
-            logger.info(f"Executing megadl command: {' '.join(megadl_command)} with timeout {MEGADL_TIMEOUT}s")
-            process = subprocess.run(megadl_command, capture_output=True, text=True, check=False, timeout=MEGADL_TIMEOUT)
-            logger.info(f"megadl stdout: {process.stdout}")
-            logger.error(f"megadl stderr: {process.stderr}")
-            if process.returncode == 0:
-                downloaded_files_mega = os.listdir(temp_session_folder)
-                if downloaded_files_mega:
-                    actual_downloaded_filename_for_type_check = downloaded_files_mega[0]
-                    local_archive_path = os.path.join(temp_session_folder, actual_downloaded_filename_for_type_check)
-                    download_successful = True
-                    logger.info(f"تم تحميل MEGA بنجاح: {local_archive_path}")
-                else: raise Exception("megadl انتهى ولكن لم يتم العثور على ملف في المجلد المؤقت.")
-            else: raise Exception(f"فشل megadl. الرمز: {process.returncode}. الخطأ: {process.stderr or process.stdout}")
-
-        elif "drive.google.com" in original_archive_url:
-            download_url = get_google_drive_direct_link(original_archive_url)
-            logger.info(f"رابط Google Drive. الرابط المباشر: {download_url}. Timeout: C={REQUESTS_CONNECT_TIMEOUT}s, R={REQUESTS_READ_TIMEOUT}s")
-            headers = {'User-Agent': 'Mozilla/5.0'}
-            with requests.get(download_url, headers=headers, stream=True, timeout=(REQUESTS_CONNECT_TIMEOUT, REQUESTS_READ_TIMEOUT), allow_redirects=True) as r:
-                r.raise_for_status()
-                # محاولة الحصول على اسم الملف من Google Drive (قد لا يكون دقيقًا دائمًا)
-                content_disposition = r.headers.get('content-disposition')
-                if content_disposition:
-                    fname_match = re.findall('filename="?([^"]+)"?', content_disposition)
-                    if fname_match:
-                        actual_downloaded_filename_for_type_check = fname_match[0]
-                        local_archive_path = os.path.join(temp_session_folder, actual_downloaded_filename_for_type_check)
-
-                with open(local_archive_path, 'wb') as f:
-                    for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
-                        f.write(chunk)
-            download_successful = True
-            logger.info(f"تم تحميل Google Drive بنجاح: {local_archive_path}")
-        else: # رابط مباشر
-            download_url = original_archive_url
-            logger.info(f"تحميل رابط مباشر: {download_url}. Timeout: C={REQUESTS_CONNECT_TIMEOUT}s, R={REQUESTS_READ_TIMEOUT}s")
-            headers = {'User-Agent': 'Mozilla/5.0'}
-            with requests.get(download_url, headers=headers, stream=True, timeout=(REQUESTS_CONNECT_TIMEOUT, REQUESTS_READ_TIMEOUT), allow_redirects=True) as r:
-                r.raise_for_status()
-                content_disposition = r.headers.get('content-disposition')
-                if content_disposition:
-                    fname_match = re.findall('filename="?([^"]+)"?', content_disposition)
-                    if fname_match:
-                        actual_downloaded_filename_for_type_check = fname_match[0]
-                        local_archive_path = os.path.join(temp_session_folder, actual_downloaded_filename_for_type_check)
-                else: # إذا لم يكن هناك content-disposition، استخدم اسم الملف من الرابط
-                    url_filename = os.path.basename(urlparse(download_url).path) # Corrected to use urlparse from urllib.parse
-                    if url_filename:
-                         actual_downloaded_filename_for_type_check = url_filename
-                         local_archive_path = os.path.join(temp_session_folder, actual_downloaded_filename_for_type_check)
-
-
-                with open(local_archive_path, 'wb') as f:
-                    for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
-                        f.write(chunk)
-            download_successful = True
-            logger.info(f"تم التحميل المباشر بنجاح: {local_archive_path}")
-
-        if not download_successful or not os.path.exists(local_archive_path):
-            raise FileNotFoundError(f"فشل تحميل الأرشيف أو الملف غير موجود: {local_archive_path}")
-
-        logger.info(f"Download complete for session {session_id}. File: {local_archive_path}")
-        file_size_mb = os.path.getsize(local_archive_path) / (1024 * 1024)
-        logger.info(f"تم تحميل الأرشيف: {local_archive_path} (الحجم: {file_size_mb:.2f} MB)")
-
-        archive_type = get_archive_type(local_archive_path)
-        logger.info(f"تم تحديد نوع الأرشيف: {archive_type} للملف {local_archive_path}")
+    update_progress(progress, source=archive_source(original_archive_url))
+    acquire_session(session_id) # لا يحذفها عامل LRU هذه العملية أثناء الاستخراج
+    try:
+        with session_building(extracted_session_folder): # ولا عامل LRU العمليات الأخرى
+            structure = None
+            if not volume_urls and should_try_remote_zip(original_archive_url, mode):
+                indexing_start_time = time.perf_counter()
+                structure = prepare_remote_zip_session(original_archive_url, extracted_session_folder, session_id, progress)
+                if structure is not None:
+                    observe_stage(progress, 'indexing', time.perf_counter() - indexing_start_time)
+            if structure is None:
+                structure = build_session_from_download(original_archive_url, session_id, temp_session_folder, extracted_session_folder,
+                                                        progress, mode, volume_urls)
+            touch_session(extracted_session_folder)
+    finally:
+        release_session(session_id)
+        forget_session_size(session_id) # ربما حُسب أثناء البناء (عامل LRU أو /metrics) فهو أصغر من الحقيقي
 
-        if not archive_type:
-            original_filename_from_url = os.path.basename(original_archive_url.split('?')[0])
-            if '.' in original_filename_from_url:
-                potential_new_path = os.path.join(temp_session_folder, original_filename_from_url)
-                if not os.path.exists(potential_new_path) and local_archive_path != potential_new_path :
-                    try:
-                        shutil.move(local_archive_path, potential_new_path) # استخدام shutil.move
-                        local_archive_path = potential_new_path
-                        archive_type = get_archive_type(local_archive_path)
-                        logger.info(f"تمت إعادة التسمية إلى {original_filename_from_url}، النوع الجديد المحدد: {archive_type}")
-                    except Exception as e_rename:
-                        logger.warning(f"لم يمكن إعادة تسمية الملف المحمل إلى {original_filename_from_url}: {e_rename}")
-            if not archive_type:
-                 return jsonify({'error': f"لا يمكن تحديد نوع الأرشيف أو أن الصيغة غير مدعومة. اسم الملف: {os.path.basename(local_archive_path)}"}), 400
-
-        logger.info(f"جاري فك الضغط كأرشيف {archive_type}...")
-        extraction_start_time = time.time()
-        extraction_done = False
-        if archive_type == 'rar':
-            with rarfile.RarFile(local_archive_path) as rf:
-                rf.extractall(path=extracted_session_folder)
-            extraction_done = True
-        elif archive_type == 'zip':
-            with zipfile.ZipFile(local_archive_path, 'r') as zf:
-                zf.extractall(path=extracted_session_folder)
-            extraction_done = True
-        elif archive_type == 'tar':
-            with tarfile.open(local_archive_path, 'r:*') as tf:
-                tf.extractall(path=extracted_session_folder)
-            extraction_done = True
-        elif archive_type == '7z':
-            os.makedirs(extracted_session_folder, exist_ok=True)
-            with py7zr.SevenZipFile(local_archive_path, mode='r') as szf:
-                szf.extractall(path=extracted_session_folder)
-            extraction_done = True
-
-        if not extraction_done:
-             return jsonify({'error': "فشل فك ضغط الأرشيف."}), 500
-        extraction_time = time.time() - extraction_start_time
-        logger.info(f"تم فك ضغط الأرشيف بنجاح إلى: {extracted_session_folder} in {extraction_time:.2f} seconds.")
-
-        structure_build_start_time = time.time()
-        structure = build_file_structure(extracted_session_folder, session_id)
-        structure_build_time = time.time() - structure_build_start_time
-        logger.info(f"File structure built in {structure_build_time:.2f} seconds for session {session_id}.")
-
-        if not structure or not structure.get('children'):
-            logger.info(f"تم فك الضغط بنجاح ولكن الأرشيف يبدو فارغًا أو الهيكل غير صالح للجلسة {session_id}.")
-            url_cache[url_hash] = {'session_id': session_id, 'structure_file': os.path.join(extracted_session_folder, '.archive_structure.json')}
-            save_cache()
-            return jsonify({
-                'message': 'تمت معالجة الأرشيف، ولكنه فارغ أو لا يحتوي على ملفات يمكن عرضها.',
-                'session_id': session_id,
-                'structure': {'name': 'root', 'type': 'directory', 'path': '', 'children': []}
-            }), 200
-
-        url_cache[url_hash] = {'session_id': session_id, 'structure_file': os.path.join(extracted_session_folder, '.archive_structure.json')}
-        save_cache()
+    cache_put(url_hash, session_id, os.path.join(extracted_session_folder, STRUCTURE_FILENAME),
+              archive_type=progress.get('archive_type'), mode=mode,
+              size_bytes=progress.get('bytes_total') or progress.get('bytes_downloaded'))
 
-        return jsonify({
-            'message': 'تمت معالجة الملف بنجاح.',
+    if not structure or not structure.get('children'):
+        logger.info(f"تم فك الضغط بنجاح ولكن الأرشيف يبدو فارغًا أو الهيكل غير صالح للجلسة {session_id}.")
+        return {
+            'message': 'تمت معالجة الأرشيف، ولكنه فارغ أو لا يحتوي على ملفات يمكن عرضها.',
             'session_id': session_id,
-            'structure': structure
-        }), 200
+            'structure': {'name': 'root', 'type': 'directory', 'path': '', 'child_count': 0, 'children': []},
+            'structure_truncated': False
+        }
+
+    return {
+        'message': 'تمت معالجة الملف بنجاح.',
+        'session_id': session_id,
+        'structure': top_level_structure(extracted_session_folder) or structure,
+        'structure_truncated': True
+    }
+
+def top_level_structure(session_folder):
+    """ المستوى الأول من الهيكل فقط (يُجلب الباقي عند الطلب عبر /list و/images). """
+    archive_index = ensure_archive_index(session_folder)
+    if archive_index is None:
+        return None
+    structure = archive_index.node_dict(0, path='', max_depth=0)
+    for child_id in archive_index.children(0)[:LISTING_MAX_PER_PAGE]: # child_count يبين إن كان الجذر مقتطعًا
+        structure['children'].append(archive_index.node_dict(child_id, path=archive_index.name(child_id), max_depth=0))
+    return structure
 
+def with_full_structure(payload):
+    """ نسخة من الرد تحمل الهيكل كاملًا من ملف الهيكل JSON (عند طلب full_structure). """
+    if not payload.get('structure_truncated') or not payload.get('session_id'):
+        return payload
+    structure_file_path = os.path.join(EXTRACTED_FILES_DIR_FLASK_APP, payload['session_id'], STRUCTURE_FILENAME)
+    try:
+        with open(structure_file_path, 'r', encoding='utf-8') as f:
+            return dict(payload, structure=json.load(f), structure_truncated=False)
+    except (OSError, ValueError) as e:
+        logger.error(f"تعذر تحميل الهيكل الكامل من {structure_file_path}: {e}")
+        return payload
+
+def process_archive(original_archive_url, url_hash, session_id, progress=None, mode='auto', volume_urls=None):
+    """ تشغيل خط المعالجة وتحويل الاستثناءات إلى رد (payload, status_code). """
+    if progress is None:
+        progress = new_progress(url_hash=url_hash)
+    started_at = time.perf_counter()
+    outcome = 'error'
+    try:
+        payload = run_archive_pipeline(original_archive_url, url_hash, session_id, progress, mode, volume_urls)
+        outcome = 'success'
+        return payload, 200
+    except ArchiveProcessingError as e_processing:
+        logger.error(f"فشل معالجة الأرشيف للجلسة {session_id}: {e_processing.message}")
+        return {'error': e_processing.message}, e_processing.status_code
     except subprocess.TimeoutExpired as e_sub_timeout:
         logger.error(f"انتهت مهلة العملية الفرعية (مثل megadl) للجلسة {session_id}: {e_sub_timeout}")
-        return jsonify({'error': 'فشل تحميل الملف: انتهت مهلة العملية الخارجية.'}), 500
+        return {'error': 'فشل تحميل الملف: انتهت مهلة العملية الخارجية.'}, 500
     except requests.exceptions.Timeout as e_req_timeout:
         logger.error(f"انتهت مهلة الطلب للجلسة {session_id}: {e_req_timeout}")
-        return jsonify({'error': 'فشل تحميل الملف: انتهت مهلة الاتصال بالرابط.'}), 500
+        return {'error': 'فشل تحميل الملف: انتهت مهلة الاتصال بالرابط.'}, 500
     except requests.exceptions.HTTPError as e_http:
         logger.error(f"خطأ HTTP للجلسة {session_id}: {e_http}")
-        return jsonify({'error': f'فشل تحميل الملف: خطأ HTTP {e_http.response.status_code}. URL: {e_http.request.url}'}), 500
+        return {'error': f'فشل تحميل الملف: خطأ HTTP {e_http.response.status_code}. URL: {e_http.request.url}'}, 500
     except requests.exceptions.RequestException as e_req:
         logger.error(f"استثناء طلب للجلسة {session_id}: {e_req}")
-        return jsonify({'error': f'فشل تحميل الملف: {str(e_req)}.'}), 500
+        return {'error': f'فشل تحميل الملف: {str(e_req)}.'}, 500
     except (rarfile.BadRarFile, rarfile.NeedFirstVolume, zipfile.BadZipFile, tarfile.TarError, py7zr.exceptions.Bad7zFile) as e_bad_archive:
         logger.error(f"ملف أرشيف تالف للجلسة {session_id}: {e_bad_archive}")
-        return jsonify({'error': f'فشل فك ضغط الملف: الملف تالف أو ليس بصيغة مدعومة بشكل كامل. ({archive_type if "archive_type" in locals() else "غير معروف"}) النوع الخطأ: {type(e_bad_archive).__name__}'}), 500
+        return {'error': f'فشل فك ضغط الملف: الملف تالف أو ليس بصيغة مدعومة بشكل كامل. ({progress.get("archive_type") or "غير معروف"}) النوع الخطأ: {type(e_bad_archive).__name__}'}, 500
     except FileNotFoundError as e_fnf:
         logger.error(f"لم يتم العثور على الملف أثناء المعالجة للجلسة {session_id}: {e_fnf}")
-        return jsonify({'error': f'خطأ في الملفات: {str(e_fnf)}'}), 500
+        return {'error': f'خطأ في الملفات: {str(e_fnf)}'}, 500
     except Exception as e:
         logger.exception(f"خطأ غير متوقع أثناء معالجة الأرشيف للجلسة {session_id}: {e}")
-        return jsonify({'error': f'حدث خطأ غير متوقع أثناء المعالجة: {str(e)}'}), 500
+        return {'error': f'حدث خطأ غير متوقع أثناء المعالجة: {str(e)}'}, 500
     finally:
-        if 'session_id' in locals() and session_id:
-            cleanup_old_session_data(session_id)
+        cleanup_old_session_data(session_id)
+        observe_stage(progress, 'total', time.perf_counter() - started_at)
+        ARCHIVE_JOBS.inc(source=progress.get('source'), archive_type=progress.get('archive_type'), outcome=outcome)
+
+def load_cached_result(url_hash):
+    """ إرجاع رد جاهز من ذاكرة التخزين المؤقت إن وُجد هيكل صالح لهذا الرابط. """
+    cached_data = cache_get(url_hash)
+    if not cached_data:
+        logger.info(f"لم يتم العثور على Hash في الكاش {url_hash}. معالجة طلب جديد.")
+        return None
 
+    cached_session_id = cached_data.get('session_id')
+    cached_session_folder = os.path.join(EXTRACTED_FILES_DIR_FLASK_APP, cached_session_id)
+    logger.info(f"العثور على Hash في الكاش {url_hash}. Session ID: {cached_session_id}. مجلد الجلسة: {cached_session_folder}")
 
-@app.route('/view-file/<session_id>/<path:filepath>')
-def view_file(session_id, filepath):
-    secure_base_path = os.path.abspath(os.path.join(EXTRACTED_FILES_DIR_FLASK_APP, session_id))
+    # يكفي الفهرس الثنائي (أو إعادة بنائه من ملف الهيكل) للتحقق من الجلسة وإرسال المستوى الأول
+    try:
+        structure = top_level_structure(cached_session_folder)
+    except Exception as e:
+        logger.error(f"تم العثور على Hash، ولكن فشل تحميل فهرس الجلسة {cached_session_folder}: {e}. إعادة المعالجة.")
+        return None
+    if structure is None:
+        logger.warning(f"تم العثور على Hash، ولكن ملف الهيكل للجلسة {cached_session_id} غير موجود. إعادة المعالجة.")
+        return None
+    logger.info(f"تم تحميل الهيكل الم缓存 بنجاح للجلسة {cached_session_id}.")
+    touch_session(cached_session_folder)
+    cache_touch(url_hash)
+    return {
+        'message': 'تمت معالجة الملف بنجاح (من ذاكرة التخزين المؤقت).',
+        'session_id': cached_session_id,
+        'structure': structure,
+        'structure_truncated': True
+    }
+
+# --- تنزيل مجلد أو مجموعة عناصر كملف ZIP متدفق ---
+# يُكتب الـ ZIP أثناء الإرسال إلى مخزن غير قابل للتنقل (zipfile يستخدم عندها واصفات البيانات بعد كل
+# عنصر بدل الرجوع لتعديل الترويسة)، ويُفرَّغ المخزن بعد كل قطعة: لا ملف مؤقت ولا ZIP كامل في الذاكرة،
+# فالذاكرة ثابتة مهما كبر التحديد. الوسائط والأرشيفات المضغوطة أصلًا تُخزَّن دون إعادة ضغط.
+ZIP_STREAM_CHUNK_SIZE = 256 * 1024
+ZIP_STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.avif',
+                         '.mp4', '.mkv', '.avi', '.mov', '.webm', '.m4v', '.mp3', '.aac', '.m4a', '.ogg', '.opus', '.flac',
+                         '.zip', '.rar', '.7z', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.lz4',
+                         '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.epub', '.jar', '.apk', '.woff', '.woff2')
+ZIP_STREAM_MAX_PATHS = 1000 # حد عدد المسارات المحددة في طلب واحد
+
+class ZipStreamBuffer(io.RawIOBase):
+    """ وجهة كتابة zipfile: تجمع البايتات حتى يسحبها المولد، ولا تدعم tell/seek عمدًا. """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self.pending_bytes = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.pending_bytes += len(data)
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        self.pending_bytes = 0
+        return data
+
+def zip_selection_entries(archive_index, node_ids):
+    """ (رقم العقدة، المسار في الجلسة، الاسم داخل الـ ZIP) للملفات والمجلدات الفارغة تحت العناصر المحددة.
+    الأسماء نسبية إلى أقرب مجلد أب مشترك، فتحديد مجلد واحد ينتج ZIP بمجلد علوي باسمه. """
+    paths = {node_id: archive_index.path(node_id) for node_id in node_ids}
+    common_parts = os.path.commonprefix([path.split('/')[:-1] for path in paths.values()]) # بادئة مشتركة على مستوى الأجزاء
+    prefix_length = len('/'.join(common_parts)) + 1 if common_parts else 0
+
+    seen = set()
+    stack = sorted(paths.items(), reverse=True)
+    while stack:
+        node_id, path = stack.pop()
+        if node_id in seen: # عنصر محدد داخل مجلد محدد آخر
+            continue
+        seen.add(node_id)
+        if not archive_index.is_dir(node_id):
+            yield node_id, path, path[prefix_length:]
+        elif node_id and not archive_index.child_count[node_id]:
+            yield node_id, path, path[prefix_length:] + '/'
+        else:
+            stack.extend((child_id, f"{path}/{archive_index.name(child_id)}" if path else archive_index.name(child_id))
+                         for child_id in reversed(archive_index.children(node_id)))
+
+def stream_zip(session_id, session_folder, entries):
+    """ مولد بايتات ZIP للعناصر المعطاة؛ العناصر غير المتاحة (فشل الاستخراج عند الطلب) تُتخطى مع تسجيلها. """
+    acquire_session(session_id) # لا يحذف عامل LRU الجلسة أثناء إرسال طويل
+    started_at = time.perf_counter()
+    file_count = sent_bytes = 0
+    buffer = ZipStreamBuffer()
+    try:
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for _, relative_path, arcname in entries:
+                if arcname.endswith('/'):
+                    zf.writestr(zipfile.ZipInfo(arcname, time.localtime(time.time())[:6]), b'')
+                    continue
+                file_path = os.path.join(session_folder, *relative_path.split('/'))
+                error = ensure_session_file(session_id, session_folder, file_path, relative_path)
+                if error:
+                    logger.warning(f"تخطي {relative_path} في ZIP الجلسة {session_id}: {error[0]}")
+                    continue
+                zinfo = zipfile.ZipInfo.from_file(file_path, arcname, strict_timestamps=False) # تواريخ tar قبل 1980 تُقرّب
+                zinfo.compress_type = zipfile.ZIP_STORED if arcname.lower().endswith(ZIP_STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+                with open(file_path, 'rb') as source, zf.open(zinfo, 'w') as target: # file_size من stat يفعّل ZIP64 عند الحاجة
+                    while True:
+                        chunk = source.read(ZIP_STREAM_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        target.write(chunk)
+                        if buffer.pending_bytes >= ZIP_STREAM_CHUNK_SIZE:
+                            data = buffer.drain()
+                            sent_bytes += len(data)
+                            yield data
+                file_count += 1
+        data = buffer.drain() # واصف البيانات الأخير والدليل المركزي
+        sent_bytes += len(data)
+        yield data
+        touch_session(session_folder)
+        logger.info(f"تم إرسال ZIP من الجلسة {session_id}: {file_count} ملف، {sent_bytes / 2 ** 20:.1f} MB "
+                    f"in {time.perf_counter() - started_at:.2f} seconds.")
+    finally: # يُستدعى أيضًا عند قطع العميل للاتصال (إغلاق المولد)
+        release_session(session_id)
+
+# --- مسارات Flask ---
+# ملفات الجلسة لا تتغير بعد استخراجها (ومعرّف الجلسة جديد عند كل معالجة)، فتُخدم بتخزين مؤقت طويل
+# في المتصفح مع ETag قوي. الملفات النصية تُرسل مضغوطة gzip من نسخة تُحفظ مع الجلسة عند أول طلب.
+SESSION_FILE_MAX_AGE = 365 * 24 * 3600
+PRECOMPRESSIBLE_EXTENSIONS = ('.txt', '.log', '.csv', '.tsv', '.json', '.xml', '.html', '.htm', '.css', '.js',
+                              '.md', '.svg', '.py', '.sh', '.ini', '.cfg', '.yaml', '.yml', '.srt', '.vtt')
+PRECOMPRESS_MIN_BYTES = 1024              # الملفات الأصغر لا تستفيد من الضغط
+PRECOMPRESS_MAX_BYTES = 64 * 1024 * 1024  # الملفات الأكبر تُرسل كما هي (مع دعم Range)
+PRECOMPRESS_LEVEL = 6
+
+# تحليل الطلبات البطيئة (اختياري): عند ضبط ARCHIVE_PROFILE_SLOW_MS يُحلَّل كل طلب بـ cProfile، ويُحفظ
+# تحليل الطلبات التي تتجاوز العتبة في PROFILES_DIR (ملف .prof لأدوات مثل snakeviz وملخص نصي لأثقل الدوال).
+# يغطي خيط الطلب فقط: مهام الخلفية (async) لا تظهر فيه، بينما يظهر الوضع المتزامن كاملًا.
+PROFILE_SLOW_SECONDS = float(os.environ.get("ARCHIVE_PROFILE_SLOW_MS", 0)) / 1000 # 0 = معطل
+PROFILES_DIR = os.environ.get("ARCHIVE_PROFILE_DIR", os.path.join(UPLOAD_DIR_FLASK_APP, 'profiles'))
+PROFILE_MAX_FILES = 200   # يُحذف الأقدم بعدها
+PROFILE_SUMMARY_LINES = 40
+
+@app.before_request
+def ensure_background_workers():
+    start_session_evictor()
+
+@app.before_request
+def start_request_timing():
+    g.request_started_at = time.perf_counter()
+    if PROFILE_SLOW_SECONDS > 0:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError: # محلل آخر يعمل في هذا الخيط
+            return
+        g.request_profiler = profiler
+
+@app.after_request
+def record_request_metrics(response):
+    started_at = g.get('request_started_at')
+    if started_at is not None:
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - started_at, endpoint=request.endpoint or 'unmatched',
+                                      method=request.method, status=str(response.status_code))
+    return response
+
+@app.teardown_request
+def finish_request_profile(exc):
+    profiler = g.pop('request_profiler', None)
+    if profiler is None:
+        return
+    profiler.disable()
+    elapsed = time.perf_counter() - g.get('request_started_at', time.perf_counter())
+    if elapsed >= PROFILE_SLOW_SECONDS:
+        try:
+            save_request_profile(profiler, elapsed)
+        except OSError as e:
+            logger.error(f"تعذر حفظ تحليل الطلب البطيء {request.path}: {e}")
+
+def save_request_profile(profiler, elapsed):
+    """ حفظ تحليل طلب بطيء (.prof وملخص نصي مرتب بالزمن التراكمي) مع الإبقاء على أحدث PROFILE_MAX_FILES. """
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    base_name = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint or 'unmatched'}-{int(elapsed * 1000)}ms-{uuid.uuid4().hex[:6]}"
+    profile_path = os.path.join(PROFILES_DIR, base_name + '.prof')
+    profiler.dump_stats(profile_path)
+    with open(os.path.join(PROFILES_DIR, base_name + '.txt'), 'w', encoding='utf-8') as f:
+        f.write(f"{request.method} {request.full_path} {elapsed:.3f}s\n\n")
+        pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(PROFILE_SUMMARY_LINES)
+    logger.warning(f"طلب بطيء ({elapsed:.2f} ثانية): {request.method} {request.path}. التحليل: {profile_path}")
+
+    profile_files = sorted(entry.path for entry in os.scandir(PROFILES_DIR) if entry.name.endswith('.prof'))
+    for old_profile_path in profile_files[:-PROFILE_MAX_FILES]:
+        for path in (old_profile_path, old_profile_path[:-len('.prof')] + '.txt'):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+
+@app.route('/process-archive', methods=['POST'])
+def process_archive_route():
+    # عند إرسال "async": true يعمل المسار في وضع المهام: يعيد معرّف مهمة فورًا (202)
+    # وتجري المعالجة في مجمع العمال، ويمكن متابعة التقدم عبر /job-status/<job_id>.
+
+    # الأرشيفات متعددة الأجزاء: "volume_urls": [روابط الأجزاء] أو "volume_pattern": "https://host/f.part{1..9}.rar"
+
+    data = request.get_json()
+    if not data: return jsonify({'error': 'لم يتم إرسال بيانات JSON.'}), 400
+    volume_urls = data.get('volume_urls')
+    if data.get('volume_pattern'):
+        try:
+            volume_urls = expand_volume_pattern(str(data['volume_pattern']))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    if volume_urls is not None:
+        if not isinstance(volume_urls, list) or not volume_urls or not all(isinstance(volume_url, str) and volume_url for volume_url in volume_urls):
+            return jsonify({'error': 'volume_urls يجب أن تكون قائمة روابط غير فارغة.'}), 400
+        if len(volume_urls) > MAX_ARCHIVE_VOLUMES:
+            return jsonify({'error': f'عدد الأجزاء يتجاوز الحد الأقصى ({MAX_ARCHIVE_VOLUMES}).'}), 400
+        original_archive_url = volume_urls[0]
+        if len(volume_urls) == 1: # جزء واحد = رابط عادي (بالمفتاح نفسه في الكاش)
+            volume_urls = None
+    else:
+        original_archive_url = data.get('archive_url')
+    if not original_archive_url: return jsonify({'error': 'لم يتم توفير رابط ملف الأرشيف.'}), 400
+
+    url_hash = volume_set_hash(volume_urls) if volume_urls else hashlib.md5(original_archive_url.encode('utf-8')).hexdigest()
+    logger.info(f"معالجة الرابط: {original_archive_url}{f' (+{len(volume_urls) - 1} أجزاء)' if volume_urls else ''}, Hash: {url_hash}")
+
+    # mode: 'auto' (الافتراضي: فك ضغط كامل؛ وZIP بعيد عبر Range لروابط .zip فقط إن فُعّل ARCHIVE_REMOTE_ZIP_AUTO=1)،
+    # 'extract' (فك ضغط كامل دائمًا)، 'lazy' (فهرسة فقط واستخراج كل عنصر عند طلبه)،
+    # 'remote' (تجربة ZIP البعيد لأي رابط مباشر، وإلا الوضع الكسول)
+    mode = data.get('mode', 'auto')
+    if mode not in ARCHIVE_MODES: return jsonify({'error': f'وضع المعالجة غير مدعوم: {mode}'}), 400
+
+    # full_structure: إرسال الهيكل كاملًا بدل المستوى الأول فقط (للعملاء الذين لا يستخدمون /list و/images)
+    full_structure = bool(data.get('full_structure'))
+
+    cached_result = load_cached_result(url_hash)
+    URL_CACHE_LOOKUPS.inc(result='hit' if cached_result else 'miss')
+    if cached_result:
+        return jsonify(with_full_structure(cached_result) if full_structure else cached_result), 200
+
+    if data.get('async'):
+        job = submit_archive_job(original_archive_url, url_hash, mode, volume_urls)
+        return jsonify({
+            'message': 'تم استلام الطلب وجاري المعالجة في الخلفية.',
+            'job_id': job['job_id'],
+            'status_url': url_for('job_status', job_id=job['job_id'])
+        }), 202
+
+    job, is_leader = get_or_create_job(original_archive_url, url_hash)
+    if is_leader: # الوضع المتزامن: ينفذ الطلب الأول المهمة بنفسه وينتظر الباقون نتيجتها
+        run_archive_job(job, original_archive_url, url_hash, mode, volume_urls)
+    payload, status_code = wait_for_job(job)
+    if full_structure and status_code == 200:
+        payload = with_full_structure(payload)
+    return jsonify(payload), status_code
+
+
+@app.route('/job-status/<job_id>')
+def job_status(job_id):
+    with jobs_lock:
+        job = jobs.get(job_id)
+    # المهمة في ذاكرة هذه العملية إن كانت هي المنفذة، وإلا فآخر لقطة حفظتها العملية المنفذة
+    snapshot = job_snapshot(job) if job else load_job_state(job_id)
+    if not snapshot:
+        return jsonify({'error': 'المهمة غير موجودة أو انتهت صلاحيتها.'}), 404
+    if snapshot.get('result') and request.args.get('full_structure') in ('1', 'true'):
+        snapshot['result'] = with_full_structure(snapshot['result'])
+    return jsonify(snapshot), 200
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def parse_page_args(default_per_page):
+    """ قراءة page وper_page من الاستعلام مع حدود معقولة؛ يعيد (page, per_page) أو None إن كانت غير صالحة. """
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', default_per_page))
+    except ValueError:
+        return None
+    if page < 1 or per_page < 1:
+        return None
+    return page, min(per_page, LISTING_MAX_PER_PAGE)
+
+def load_session_index_for_request(session_id):
+    """ فهرس الجلسة لمسارات القوائم، أو (رسالة، رمز الحالة) عند الخطأ. """
+    session_folder = get_session_folder(session_id)
+    if not session_folder:
+        return None, ({'error': 'معرّف الجلسة غير صالح.'}, 400)
+    archive_index = ensure_archive_index(session_folder)
+    if archive_index is None:
+        return None, ({'error': 'الجلسة غير موجودة أو انتهت صلاحيتها.'}, 404)
+    touch_session(session_folder)
+    return archive_index, None
+
+def paginate(node_ids, page, per_page):
+    total = len(node_ids)
+    start = (page - 1) * per_page
+    return node_ids[start:start + per_page], {
+        'page': page, 'per_page': per_page, 'total': total,
+        'total_pages': (total + per_page - 1) // per_page
+    }
+
+@app.route('/list/<session_id>')
+def list_directory(session_id):
+    # أبناء مجلد واحد (المجلدات أولًا ثم الملفات، أبجديًا) مقسمة إلى صفحات من الفهرس الثنائي للجلسة.
+    # kind (اختياري): directory أو file أو image لتصفية الأبناء حسب النوع.
+    archive_index, error = load_session_index_for_request(session_id)
+    if error: return jsonify(error[0]), error[1]
+    page_args = parse_page_args(LISTING_DEFAULT_PER_PAGE)
+    if not page_args: return jsonify({'error': 'قيم page وper_page يجب أن تكون أعدادًا موجبة.'}), 400
+    kind = request.args.get('kind') or None
+    if kind not in (None, 'directory', 'file', 'image'): return jsonify({'error': f'نوع غير مدعوم: {kind}'}), 400
+
+    dir_path = normalize_member_path(request.args.get('path', ''))
+    node_id = archive_index.find(dir_path)
+    if node_id is None or not archive_index.is_dir(node_id):
+        return jsonify({'error': 'المجلد غير موجود في الأرشيف.'}), 404
+
+    page_ids, pagination = paginate(archive_index.children_of_kind(node_id, kind), *page_args)
+    folder_count = archive_index.directory_child_count[node_id]
+    return jsonify({
+        'path': dir_path,
+        **pagination,
+        'folder_count': folder_count,
+        'file_count': archive_index.child_count[node_id] - folder_count,
+        'image_count': archive_index.image_child_count[node_id],
+        'items': [archive_index.item_dict(child_id, f"{dir_path}/{archive_index.name(child_id)}" if dir_path else archive_index.name(child_id))
+                  for child_id in page_ids]
+    }), 200
+
+@app.route('/images/<session_id>')
+def list_images(session_id):
+    # كل صور مجلد ومجلداته الفرعية بترتيب الشجرة، مقسمة إلى صفحات. عند تمرير of=<مسار صورة>
+    # تُعاد الصفحة التي تحتويها مع موضعها (position) في القائمة الكاملة، للتنقل في عارض الصور.
+    archive_index, error = load_session_index_for_request(session_id)
+    if error: return jsonify(error[0]), error[1]
+    page_args = parse_page_args(LISTING_DEFAULT_PER_PAGE)
+    if not page_args: return jsonify({'error': 'قيم page وper_page يجب أن تكون أعدادًا موجبة.'}), 400
+    page, per_page = page_args
+
+    dir_path = normalize_member_path(request.args.get('path', ''))
+    node_id = archive_index.find(dir_path)
+    if node_id is None or not archive_index.is_dir(node_id):
+        return jsonify({'error': 'المجلد غير موجود في الأرشيف.'}), 404
+
+    position = None
+    if request.args.get('of'):
+        image_id = archive_index.find(normalize_member_path(request.args['of']))
+        if image_id is None or not archive_index.is_image(image_id):
+            return jsonify({'error': 'الصورة غير موجودة في الأرشيف.'}), 404
+        position = archive_index.image_start[image_id] - archive_index.image_start[node_id]
+        if not 0 <= position < archive_index.image_count[node_id]:
+            return jsonify({'error': 'الصورة ليست داخل المجلد المطلوب.'}), 400
+        page = position // per_page + 1
+
+    page_ids, pagination = paginate(archive_index.images_under(node_id), page, per_page)
+    return jsonify({
+        'path': dir_path,
+        **pagination,
+        'position': position,
+        'items': [archive_index.item_dict(image_id, archive_index.path(image_id)) for image_id in page_ids]
+    }), 200
+
+@app.route('/search/<session_id>')
+def search_files(session_id):
+    # بحث في أسماء الملفات والمجلدات بلا حساسية لحالة الأحرف، مرتب ومقسم إلى صفحات.
+    # q الذي يحتوي / يُطابق نهاية المسار (مثل photos/2020). ext: امتدادات مفصولة بفواصل (jpg,png)، is_image: 1 أو 0.
+    archive_index, error = load_session_index_for_request(session_id)
+    if error: return jsonify(error[0]), error[1]
+    page_args = parse_page_args(LISTING_DEFAULT_PER_PAGE)
+    if not page_args: return jsonify({'error': 'قيم page وper_page يجب أن تكون أعدادًا موجبة.'}), 400
+    query = request.args.get('q', '').strip()
+    if not query: return jsonify({'error': 'لم يتم توفير نص البحث (q).'}), 400
+    if len(query) > SEARCH_MAX_QUERY_LENGTH: return jsonify({'error': 'نص البحث طويل جدًا.'}), 400
+    extensions = tuple(sorted({'.' + ext.strip().lower().lstrip('.') for ext in request.args.get('ext', '').split(',') if ext.strip()}))
+    is_image = {None: None, '': None, '1': True, 'true': True, '0': False, 'false': False}.get(request.args.get('is_image'), 'invalid')
+    if is_image == 'invalid': return jsonify({'error': 'قيمة is_image يجب أن تكون 1 أو 0.'}), 400
+
+    started_at = time.perf_counter()
+    node_ids, complete = search_session(get_session_folder(session_id), query, tuple(ext.encode('utf-8') for ext in extensions), is_image)
+    page_ids, pagination = paginate(node_ids, *page_args)
+    return jsonify({
+        'query': query,
+        **pagination,
+        'complete': complete, # false: النتائج مقتطعة عند SEARCH_MAX_RESULTS (total حد أدنى)
+        'took_ms': round((time.perf_counter() - started_at) * 1000, 2),
+        'items': [archive_index.item_dict(node_id, archive_index.path(node_id)) for node_id in page_ids]
+    }), 200
+
+def resolve_session_path(session_id, filepath):
+    """ التحقق من الجلسة والمسار المطلوب؛ يعيد (مجلد الجلسة، المسار المطلق، المسار النسبي، خطأ أو None). """
+    secure_base_path = get_session_folder(session_id)
+    if not secure_base_path:
+        return None, None, None, ("معرّف الجلسة غير صالح.", 400)
     requested_file_path_abs = os.path.normpath(os.path.join(secure_base_path, filepath))
 
-    logger.info(f"طلب عرض ملف: session={session_id}, filepath={filepath}, secure_base={secure_base_path}, requested_abs={requested_file_path_abs}")
+    logger.debug(f"طلب عرض ملف: session={session_id}, filepath={filepath}, secure_base={secure_base_path}, requested_abs={requested_file_path_abs}")
 
     if not requested_file_path_abs.startswith(secure_base_path + os.sep) and requested_file_path_abs != secure_base_path :
         logger.warning(f"تم رفض محاولة تجاوز المسار: {filepath} تم حلها إلى {requested_file_path_abs} وهو خارج {secure_base_path}")
-        return "الوصول مرفوض (Path Traversal).", 403
+        return None, None, None, ("الوصول مرفوض (Path Traversal).", 403)
+
+    relative_file_path = os.path.relpath(requested_file_path_abs, secure_base_path).replace(os.sep, '/')
+    if relative_file_path.split('/')[0] in SESSION_INTERNAL_NAMES:
+        return None, None, None, ("الملف غير موجود.", 404)
+    return secure_base_path, requested_file_path_abs, relative_file_path, None
 
-    if not os.path.exists(requested_file_path_abs) or not os.path.isfile(requested_file_path_abs):
+def ensure_session_file(session_id, secure_base_path, requested_file_path_abs, relative_file_path):
+    """ التأكد من وجود الملف على القرص (مع الاستخراج عند الطلب للجلسات الكسولة)؛ يعيد خطأ أو None. """
+    if os.path.exists(requested_file_path_abs) and os.path.isfile(requested_file_path_abs):
+        touch_cached_member(session_id, requested_file_path_abs)
+        return None
+    try: # الجلسات الكسولة: استخراج العنصر المطلوب فقط عند أول طلب
+        extracted_on_demand = extract_member_on_demand(session_id, secure_base_path, relative_file_path)
+    except Exception as e:
+        logger.exception(f"فشل استخراج العنصر {relative_file_path} عند الطلب للجلسة {session_id}: {e}")
+        return "فشل استخراج الملف من الأرشيف.", 500
+    if not extracted_on_demand:
         logger.error(f"لم يتم العثور على الملف للعرض: {requested_file_path_abs}")
         return "الملف غير موجود.", 404
+    return None
+
+@app.route('/view-file/<session_id>/<path:filepath>')
+def view_file(session_id, filepath):
+    secure_base_path, requested_file_path_abs, relative_file_path, error = resolve_session_path(session_id, filepath)
+    if error: return error
+
+    # لا يحذفها عامل LRU أثناء الاستخراج عند الطلب؛ أما الإرسال الجاري بعد عودة الدالة فتحميه
+    # مهلة EVICTION_MIN_IDLE_SECONDS، كما أن حذف ملف مفتوح لا يقطع إرساله على أنظمة POSIX.
+    acquire_session(session_id)
+    try:
+        return _serve_session_file(session_id, secure_base_path, filepath, requested_file_path_abs, relative_file_path)
+    finally:
+        release_session(session_id)
+
+def _serve_session_file(session_id, secure_base_path, filepath, requested_file_path_abs, relative_file_path):
+    # stat واحد في المسار المعتاد؛ الاستخراج عند الطلب فقط إن لم يوجد الملف
+    try:
+        stat_result = os.stat(requested_file_path_abs)
+    except FileNotFoundError:
+        error = ensure_session_file(session_id, secure_base_path, requested_file_path_abs, relative_file_path)
+        if error: return error
+        stat_result = os.stat(requested_file_path_abs)
+    if not stat.S_ISREG(stat_result.st_mode):
+        return "الملف غير موجود.", 404
 
-    logger.info(f"خدمة الملف: {filepath} من المجلد: {secure_base_path}")
-    return send_from_directory(secure_base_path, filepath)
+    touch_session(secure_base_path)
+    touch_cached_member(session_id, requested_file_path_abs)
+    etag = session_file_etag(session_id, relative_file_path, stat_result)
+    mimetype = mimetypes.guess_type(relative_file_path)[0] or 'application/octet-stream'
+    is_compressible_text = relative_file_path.lower().endswith(PRECOMPRESSIBLE_EXTENSIONS)
+    use_gzip = (is_compressible_text and 'gzip' in request.accept_encodings and not request.range
+                and PRECOMPRESS_MIN_BYTES <= stat_result.st_size <= PRECOMPRESS_MAX_BYTES)
+
+    # 304 قبل فتح أي ملف: الجلسة لا تتغير بعد إنشائها فالتحقق يكفيه stat
+    cached_etag = next((tag for tag in (etag, etag + '-gz') if request.if_none_match.contains(tag)), None)
+    if cached_etag:
+        response = app.response_class(status=304)
+        response.set_etag(cached_etag)
+    elif use_gzip:
+        gzip_path = get_precompressed_file(secure_base_path, requested_file_path_abs, relative_file_path, stat_result)
+        response = send_file(gzip_path, mimetype=mimetype, etag=etag + '-gz', conditional=True, max_age=SESSION_FILE_MAX_AGE)
+        response.headers['Content-Encoding'] = 'gzip'
+    else: # conditional=True: ‏If-None-Match وطلبات Range (‏206) للتقديم والتأخير في الفيديو والملفات الكبيرة
+        response = send_file(requested_file_path_abs, mimetype=mimetype, etag=etag, conditional=True, max_age=SESSION_FILE_MAX_AGE)
+        response.accept_ranges = 'bytes' # إعلان دعم Range حتى في ردود 200 (يستخدمه مشغل الفيديو للتقديم)
+
+    response.cache_control.public = True
+    response.cache_control.max_age = SESSION_FILE_MAX_AGE
+    response.cache_control.immutable = True
+    if is_compressible_text:
+        response.vary.add('Accept-Encoding')
+    logger.debug(f"خدمة الملف: {filepath} من المجلد: {secure_base_path} (الحالة {response.status_code})")
+    return response
+
+def session_file_etag(session_id, relative_file_path, stat_result):
+    """ ETag قوي من معرّف الجلسة ومسار العنصر وحجمه ووقت تعديله (لا يتغير المحتوى ضمن الجلسة). """
+    fingerprint = f"{session_id}\0{relative_file_path}\0{stat_result.st_size}\0{stat_result.st_mtime_ns}"
+    return hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()
+
+def get_precompressed_file(session_folder, source_path, relative_file_path, stat_result):
+    """ مسار نسخة gzip من الملف النصي، مع إنشائها عند أول طلب (كتابة ذرية). """
+    gzip_path = os.path.join(session_folder, PRECOMPRESSED_DIRNAME, *relative_file_path.split('/')) + '.gz'
+    try:
+        if os.stat(gzip_path).st_mtime_ns >= stat_result.st_mtime_ns:
+            return gzip_path
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(gzip_path), exist_ok=True)
+    temp_path = f"{gzip_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(source_path, 'rb') as source, gzip.open(temp_path, 'wb', compresslevel=PRECOMPRESS_LEVEL) as target:
+            shutil.copyfileobj(source, target, DOWNLOAD_CHUNK_SIZE)
+        size_delta = os.path.getsize(temp_path) - get_file_size_or_zero(gzip_path)
+        os.replace(temp_path, gzip_path)
+        add_session_bytes(session_folder, size_delta)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    logger.debug(f"تم إنشاء نسخة gzip من {relative_file_path}: {gzip_path}")
+    return gzip_path
+
+@app.route('/thumb/<session_id>/<path:filepath>')
+def view_thumbnail(session_id, filepath):
+    # صورة مصغرة JPEG بأحد الأحجام الثابتة (size=small|medium|large)، تُولد مرة واحدة وتُحفظ في مجلد الجلسة.
+    # الصيغ التي لا يدعمها Pillow (مثل SVG) أو غياب Pillow: تحويل إلى الصورة الأصلية.
+    size_name = request.args.get('size', THUMBNAIL_DEFAULT_SIZE)
+    if size_name not in THUMBNAIL_SIZES:
+        return f"حجم غير مدعوم: {size_name}", 400
+    secure_base_path, requested_file_path_abs, relative_file_path, error = resolve_session_path(session_id, filepath)
+    if error: return error
+    if not thumbnails.is_available() or not relative_file_path.lower().endswith(THUMBNAIL_SOURCE_EXTENSIONS):
+        return redirect(url_for('view_file', session_id=session_id, filepath=relative_file_path))
+
+    acquire_session(session_id)
+    try:
+        thumbnail_path = get_thumbnail_path(secure_base_path, relative_file_path, size_name)
+        if not os.path.isfile(thumbnail_path):
+            error = ensure_session_file(session_id, secure_base_path, requested_file_path_abs, relative_file_path)
+            if error: return error
+            try:
+                generate_thumbnail(secure_base_path, relative_file_path, size_name).result(timeout=THUMBNAIL_TIMEOUT_SECONDS)
+            except Exception as e:
+                logger.warning(f"تعذر إنشاء صورة مصغرة لـ {relative_file_path} في الجلسة {session_id}: {e}")
+                return redirect(url_for('view_file', session_id=session_id, filepath=relative_file_path))
+        touch_session(secure_base_path)
+        return send_file(thumbnail_path, mimetype='image/jpeg', max_age=THUMBNAIL_CACHE_MAX_AGE)
+    finally:
+        release_session(session_id)
+
+@app.route('/mount/<session_id>', methods=['POST'])
+def mount_archive(session_id):
+    # تركيب أرشيف داخل الجلسة ({"path": ...}) كجلسة فرعية؛ يعيد معرّفها والمستوى الأول من هيكلها.
+    archive_index, error = load_session_index_for_request(session_id)
+    if error: return jsonify(error[0]), error[1]
+    relative_path = normalize_member_path((request.get_json(silent=True) or {}).get('path') or '')
+    node_id = archive_index.find(relative_path) if relative_path else None
+    if node_id is None or not archive_index.is_archive(node_id):
+        return jsonify({'error': 'المسار ليس ملف أرشيف في هذه الجلسة.'}), 404
+
+    session_folder = get_session_folder(session_id)
+    acquire_session(session_id)
+    try:
+        nested_session_id, archive_type = mount_nested_archive(session_id, session_folder, relative_path)
+    except ArchiveProcessingError as e:
+        return jsonify({'error': e.message}), e.status_code
+    except (rarfile.Error, zipfile.BadZipFile, tarfile.TarError, py7zr.exceptions.Bad7zFile) as e:
+        logger.error(f"تعذر تركيب الأرشيف المتداخل {relative_path} من الجلسة {session_id}: {e}")
+        return jsonify({'error': f'تعذر فتح الأرشيف المتداخل: الملف تالف أو غير مدعوم. ({type(e).__name__})'}), 500
+    finally:
+        release_session(session_id)
+    return jsonify({
+        'session_id': nested_session_id,
+        'parent_session_id': session_id,
+        'path': relative_path,
+        'archive_type': archive_type,
+        'depth': get_nested_depth(nested_session_id),
+        'structure': top_level_structure(get_session_folder(nested_session_id))
+    }), 200
+
+@app.route('/download-zip/<session_id>', methods=['GET', 'POST'])
+def download_zip(session_id):
+    # ZIP متدفق (ترميز مقطّع دون Content-Length) لمجلد أو مجموعة عناصر من الجلسة.
+    # GET: ‏path=<مسار> ويمكن تكراره (path فارغ = الأرشيف كله). POST: ‏JSON {"paths": [...]} للتحديدات الطويلة.
+    archive_index, error = load_session_index_for_request(session_id)
+    if error: return jsonify(error[0]), error[1]
+    if request.method == 'POST':
+        paths = (request.get_json(silent=True) or {}).get('paths')
+        if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+            return jsonify({'error': 'يجب إرسال paths كقائمة من المسارات.'}), 400
+    else:
+        paths = request.args.getlist('path') or ['']
+    if not paths or len(paths) > ZIP_STREAM_MAX_PATHS:
+        return jsonify({'error': f'عدد المسارات يجب أن يكون بين 1 و{ZIP_STREAM_MAX_PATHS}.'}), 400
+
+    node_ids = []
+    for path in paths:
+        path = normalize_member_path(path)
+        node_id = archive_index.find(path)
+        if node_id is None:
+            return jsonify({'error': f'المسار غير موجود في الأرشيف: {path}'}), 404
+        node_ids.append(node_id)
+
+    if len(node_ids) == 1:
+        download_name = f"{archive_index.name(node_ids[0]) if node_ids[0] else session_id}.zip"
+    else:
+        download_name = f"{session_id}-selection.zip"
+    entries = zip_selection_entries(archive_index, node_ids)
+    response = Response(stream_zip(session_id, get_session_folder(session_id), entries), mimetype='application/zip')
+    # filename* (RFC 5987) لأسماء المجلدات غير اللاتينية، مع اسم ASCII احتياطي كما يفعل send_file
+    response.headers.set('Content-Disposition', 'attachment', **{
+        'filename': download_name.encode('ascii', 'replace').decode('ascii').replace('?', '_'),
+        'filename*': f"UTF-8''{quote(download_name, safe='')}"})
+    response.headers['X-Accel-Buffering'] = 'no' # لا يجمع nginx الرد كاملًا قبل إرساله
+    response.cache_control.no_store = True
+    return response
 
 #if __name__ == '__main__':
     # عند التشغيل محليًا، يمكنك تغيير المنفذ أو تفعيل وضع التصحيح
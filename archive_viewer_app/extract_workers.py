@@ -0,0 +1,24 @@
+# coding: utf-8
+"""
+دوال فك الضغط التي تعمل داخل عمليات مجمع الاستخراج المتوازي في app.py.
+وحدة مستقلة وخفيفة: العمليات العاملة تستوردها وحدها حين يُشغَّل التطبيق كوحدة مستوردة (flask run أو
+gunicorn). عند التشغيل بـ python app.py تعيد spawn تنفيذ app.py أيضًا كـ __mp_main__ في كل عملية، مع
+تخطي تهيئة التخزين فيها (IS_POOL_WORKER_PROCESS).
+"""
+import time
+import zipfile
+
+
+def extract_zip_members(archive_path, member_names, dest_folder):
+    """ استخراج مجموعة من عناصر ZIP بمقبض ZipFile خاص بهذه العملية؛ يعيد (البايتات المستخرجة، الثواني). """
+    started_at = time.perf_counter()
+    extracted_bytes = 0
+    with zipfile.ZipFile(archive_path, 'r') as zf:
+        for member_name in member_names:
+            member = zf.getinfo(member_name)
+            try:
+                zf.extract(member, path=dest_folder)
+            except FileExistsError: # أنشأت عملية أخرى المجلد الأب في اللحظة نفسها
+                zf.extract(member, path=dest_folder)
+            extracted_bytes += member.file_size
+    return extracted_bytes, time.perf_counter() - started_at
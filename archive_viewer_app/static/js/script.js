@@ -14,6 +14,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     const treeViewContainer = document.getElementById('tree-view-container');
     const breadcrumbContainer = document.getElementById('breadcrumb-container');
+    const archiveSearchInput = document.getElementById('archive-search-input');
     // const fileDetailsView = document.getElementById('file-details-view'); // Not directly used for now
 
     const fileListDiv = document.getElementById('file-list');
@@ -78,10 +79,20 @@ document.addEventListener('DOMContentLoaded', () => {
     let currentSessionId = null;
     let currentPageGlobal = 1;
     let filesPerPageGlobal = 20; // عدد العناصر في كل صفحة
-    let fullArchiveStructure = null;
     let currentPathInTree = '';
-    let currentDisplayedItems = []; // المجلدات والملفات في المسار الحالي المعروض
-    let allImagesForModalNavigation = []; // كل الصور في الأرشيف للتنقل في الـ modal
+    let currentListing = null; // آخر رد من /list للمسار الحالي (الصفحة المعروضة وإجمالياتها)
+    let currentDisplayedItems = []; // المجلدات والملفات في الصفحة المعروضة من المسار الحالي
+    let listingRequestCounter = 0; // لتجاهل ردود /list القديمة عند التنقل السريع
+    let currentSearchQuery = ''; // عند وجوده تعرض القائمة نتائج /search بدل محتوى المسار الحالي
+    // الأرشيفات المتداخلة المركّبة: معرّف الجلسة الفرعية -> { parentSessionId, archivePath, name }
+    let mountedArchives = new Map();
+    let searchDebounceTimer = null;
+    const SEARCH_DEBOUNCE_MS = 250;
+    const TREE_PAGE_SIZE = 200; // عدد أبناء المجلد المحملة في كل دفعة داخل الشجرة
+    const MODAL_IMAGES_PAGE_SIZE = 100;
+    const THUMBNAIL_SIZE = 'medium'; // small | medium | large (انظر THUMBNAIL_SIZES في app.py)
+    // صور الأرشيف كله للتنقل في الـ modal، تُجلب من /images صفحةً صفحة عند الحاجة
+    let modalImages = { total: 0, pages: new Map() };
     let currentModalImageIndex = -1;
 
     const lazyLoadPlaceholder = 'data:image/gif;base64,R0lGODlhAQABAIAAAP///wAAACH5BAEAAAAALAAAAAABAAEAAAICRAEAOw==';
@@ -147,60 +158,140 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // --- Tree View Functions ---
-    function buildTree(node, pathPrefix = '') {
-        const ul = document.createElement('ul');
-
-        (node.children || []).forEach(child => {
-            const li = document.createElement('li');
-            li.className = 'tree-item my-1';
-            if (child.type === 'directory' && child.children && child.children.length > 0) {
-                 li.classList.add('collapsed');
-            } else if (child.type === 'directory') {
-                 li.classList.add('collapsed'); // Empty folders also
-            }
+    // الشجرة تبدأ بالمستوى الأول فقط (من رد /process-archive)، ويُجلب محتوى كل مجلد من /list عند فتحه أول مرة.
+    // الأرشيف داخل الأرشيف (is_archive) يُفتح في الشجرة كمجلد: يُركّب في الخادم كجلسة فرعية عند أول فتح،
+    // ثم يُتصفح بمعرّف تلك الجلسة؛ لذا يحمل كل عنصر في الشجرة معرّف جلسته.
+    async function fetchListing(path, page, perPage, kind = null, sessionId = currentSessionId) {
+        const params = new URLSearchParams({ path: path, page: page, per_page: perPage });
+        if (kind) params.set('kind', kind);
+        const response = await fetch(`/list/${encodeURIComponent(sessionId)}?${params.toString()}`);
+        const data = await response.json();
+        if (!response.ok) throw new Error(data.error || `حدث خطأ في الخادم: ${response.status}`);
+        return data;
+    }
 
-            const label = document.createElement('span');
-            label.className = 'tree-label p-1 rounded hover:bg-gray-200 dark:hover:bg-gray-700 cursor-pointer flex items-center text-sm';
-            label.dataset.path = (pathPrefix ? pathPrefix + '/' : '') + child.name;
-            label.dataset.type = child.type;
+    async function mountNestedArchive(sessionId, archivePath) {
+        const response = await fetch(`/mount/${encodeURIComponent(sessionId)}`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ path: archivePath }),
+        });
+        const data = await response.json();
+        if (!response.ok) throw new Error(data.error || `حدث خطأ في الخادم: ${response.status}`);
+        mountedArchives.set(data.session_id, { parentSessionId: sessionId, archivePath: archivePath, name: archivePath.split('/').pop() });
+        return data.session_id;
+    }
 
-            if (child.type === 'directory') {
-                const toggler = document.createElement('span');
-                toggler.className = 'tree-toggler text-xs text-gray-500 dark:text-gray-400';
-                if (!child.children || child.children.length === 0) {
-                    toggler.style.visibility = 'hidden';
-                }
-                label.appendChild(toggler); // Toggler first
+    async function openNestedArchive(sessionId, archivePath) {
+        try {
+            navigateToPath('', await mountNestedArchive(sessionId, archivePath));
+        } catch (error) {
+            console.error('Error mounting nested archive:', error);
+            showError(error.message || 'تعذر فتح الأرشيف المتداخل.');
+        }
+    }
+
+    function createTreeItem(child, sessionId = currentSessionId) {
+        const li = document.createElement('li');
+        li.className = 'tree-item my-1';
+        const isDirectory = child.type === 'directory';
+        const isArchive = child.type === 'file' && child.is_archive;
+        const hasChildren = (isDirectory && child.child_count > 0) || isArchive;
+        if (isDirectory || isArchive) li.classList.add('collapsed'); // Empty folders also
+
+        const label = document.createElement('span');
+        label.className = 'tree-label p-1 rounded hover:bg-gray-200 dark:hover:bg-gray-700 cursor-pointer flex items-center text-sm';
+        label.dataset.path = child.path;
+        label.dataset.type = child.type;
+        label.dataset.sessionId = sessionId;
+
+        if (isDirectory || isArchive) {
+            const toggler = document.createElement('span');
+            toggler.className = 'tree-toggler text-xs text-gray-500 dark:text-gray-400';
+            if (!hasChildren) {
+                toggler.style.visibility = 'hidden';
             }
+            label.appendChild(toggler); // Toggler first
+        }
 
-            const icon = document.createElement('i');
-            icon.className = getFileIconClass(child.name, child.type === 'directory');
-            label.appendChild(icon); // Icon second
+        const icon = document.createElement('i');
+        icon.className = getFileIconClass(child.name, isDirectory);
+        label.appendChild(icon); // Icon second
 
-            label.appendChild(document.createTextNode(child.name)); // Text last
+        label.appendChild(document.createTextNode(child.name)); // Text last
 
-            li.appendChild(label);
+        li.appendChild(label);
 
-            label.addEventListener('click', (event) => {
-                event.stopPropagation(); // منع انتشار الحدث إلى العناصر الأصلية
-                if (child.type === 'directory') { // Toggle and navigate for directories
-                    if (child.children && child.children.length > 0) {
-                        li.classList.toggle('expanded');
-                        li.classList.toggle('collapsed');
+        label.addEventListener('click', async (event) => {
+            event.stopPropagation(); // منع انتشار الحدث إلى العناصر الأصلية
+            if (isArchive) { // تركيب الأرشيف المتداخل عند أول فتح ثم عرض جذره
+                if (!li.dataset.mountedSessionId) {
+                    try {
+                        li.dataset.mountedSessionId = await mountNestedArchive(sessionId, child.path);
+                    } catch (error) {
+                        console.error('Error mounting nested archive:', error);
+                        showError(error.message || 'تعذر فتح الأرشيف المتداخل.');
+                        return;
                     }
                 }
-                navigateToPath(label.dataset.path); // Navigate for both files and folders
+                li.classList.toggle('expanded');
+                li.classList.toggle('collapsed');
+                if (!li.dataset.loaded) {
+                    li.dataset.loaded = 'true';
+                    const childrenUl = document.createElement('ul');
+                    li.appendChild(childrenUl);
+                    loadTreeChildren(childrenUl, '', 1, li.dataset.mountedSessionId);
+                }
+                navigateToPath('', li.dataset.mountedSessionId);
+                return;
+            }
+            if (hasChildren) { // Toggle and navigate for directories
+                li.classList.toggle('expanded');
+                li.classList.toggle('collapsed');
+                if (!li.dataset.loaded) {
+                    li.dataset.loaded = 'true';
+                    const childrenUl = document.createElement('ul');
+                    li.appendChild(childrenUl);
+                    loadTreeChildren(childrenUl, child.path, 1, sessionId);
+                }
+            }
+            navigateToPath(label.dataset.path, sessionId); // Navigate for both files and folders
 
-                document.querySelectorAll('.tree-label.selected').forEach(el => el.classList.remove('selected', 'bg-sky-100', 'dark:bg-sky-700', 'font-semibold'));
-                label.classList.add('selected', 'bg-sky-100', 'dark:bg-sky-700', 'font-semibold');
-            });
+            document.querySelectorAll('.tree-label.selected').forEach(el => el.classList.remove('selected', 'bg-sky-100', 'dark:bg-sky-700', 'font-semibold'));
+            label.classList.add('selected', 'bg-sky-100', 'dark:bg-sky-700', 'font-semibold');
+        });
+        return li;
+    }
+
+    function appendTreeItems(ul, items, sessionId = currentSessionId) {
+        items.forEach(item => ul.appendChild(createTreeItem(item, sessionId)));
+    }
 
-            if (child.type === 'directory' && child.children && child.children.length > 0) {
-                li.appendChild(buildTree(child, label.dataset.path));
+    async function loadTreeChildren(ul, path, page = 1, sessionId = currentSessionId) {
+        try {
+            const data = await fetchListing(path, page, TREE_PAGE_SIZE, null, sessionId);
+            appendTreeItems(ul, data.items, sessionId);
+            if (data.page < data.total_pages) { // دفعة تالية عند الطلب بدل تحميل آلاف العناصر دفعة واحدة
+                const moreLi = document.createElement('li');
+                moreLi.className = 'tree-item my-1';
+                const moreLabel = document.createElement('span');
+                moreLabel.className = 'tree-label p-1 rounded hover:bg-gray-200 dark:hover:bg-gray-700 cursor-pointer flex items-center text-sm text-sky-600 dark:text-sky-400';
+                moreLabel.textContent = `عرض المزيد (${data.total - data.page * data.per_page} متبقية)...`;
+                moreLabel.addEventListener('click', (event) => {
+                    event.stopPropagation();
+                    moreLi.remove();
+                    loadTreeChildren(ul, path, page + 1, sessionId);
+                });
+                moreLi.appendChild(moreLabel);
+                ul.appendChild(moreLi);
             }
-            ul.appendChild(li);
-        });
-        return ul;
+        } catch (error) {
+            console.error('Error loading tree children:', error);
+            const errorLi = document.createElement('li');
+            errorLi.className = 'tree-item my-1 text-sm text-red-500';
+            errorLi.textContent = 'تعذر تحميل محتوى المجلد.';
+            ul.appendChild(errorLi);
+        }
     }
 
     function renderTree(structure) {
@@ -210,74 +301,75 @@ document.addEventListener('DOMContentLoaded', () => {
             treeViewContainer.innerHTML = '<p class="text-gray-500 dark:text-gray-400 p-2">الأرشيف فارغ أو لا يمكن قراءة هيكله.</p>';
             return;
         }
-        const treeRoot = buildTree(structure);
+        const treeRoot = document.createElement('ul');
+        if (structure.child_count > structure.children.length) { // المستوى الأول نفسه مقتطع في الرد: جلبه على دفعات
+            loadTreeChildren(treeRoot, '', 1);
+        } else {
+            appendTreeItems(treeRoot, structure.children);
+        }
         treeViewContainer.appendChild(treeRoot);
     }
 
 
     // --- Breadcrumb Functions ---
+    function breadcrumbTrail(sessionId, path) {
+        // داخل أرشيف متداخل: مسار الأرشيف في جلسته الأم أولًا، ثم اسم الأرشيف كجذر لجلسته
+        const mount = mountedArchives.get(sessionId);
+        let trail;
+        if (mount) {
+            trail = breadcrumbTrail(mount.parentSessionId, mount.archivePath.split('/').slice(0, -1).join('/'));
+            trail.push({ label: mount.name, sessionId: sessionId, path: '' });
+        } else {
+            trail = [{ label: 'الجذر', sessionId: sessionId, path: '' }];
+        }
+        let currentBuiltPath = '';
+        path.split('/').filter(p => p).forEach(part => {
+            currentBuiltPath += (currentBuiltPath ? '/' : '') + part;
+            trail.push({ label: part, sessionId: sessionId, path: currentBuiltPath });
+        });
+        return trail;
+    }
+
     function renderBreadcrumbs(path) {
         if (!breadcrumbContainer) return;
         breadcrumbContainer.innerHTML = '';
-        const parts = path.split('/').filter(p => p);
-
-        const rootLinkSpan = document.createElement('span');
-        rootLinkSpan.className = 'breadcrumb-item';
-        const rootAnchor = document.createElement('a');
-        rootAnchor.href = '#';
-        rootAnchor.textContent = 'الجذر';
-        rootAnchor.dataset.path = '';
-        rootAnchor.addEventListener('click', (e) => { e.preventDefault(); navigateToPath(''); });
-        rootLinkSpan.appendChild(rootAnchor);
-        breadcrumbContainer.appendChild(rootLinkSpan);
 
-        let currentBuiltPath = '';
-        parts.forEach(part => {
-            currentBuiltPath += (currentBuiltPath ? '/' : '') + part;
+        breadcrumbTrail(currentSessionId, path).forEach(crumb => {
             const partSpan = document.createElement('span');
             partSpan.className = 'breadcrumb-item'; // CSS will add '/' before this for RTL
             const partAnchor = document.createElement('a');
             partAnchor.href = '#';
-            partAnchor.textContent = part;
-            partAnchor.dataset.path = currentBuiltPath;
-            partAnchor.addEventListener('click', (e) => { e.preventDefault(); navigateToPath(currentBuiltPath); });
+            partAnchor.textContent = crumb.label;
+            partAnchor.dataset.path = crumb.path;
+            partAnchor.addEventListener('click', (e) => { e.preventDefault(); navigateToPath(crumb.path, crumb.sessionId); });
             partSpan.appendChild(partAnchor);
             breadcrumbContainer.appendChild(partSpan);
         });
-    }
 
-
-    // --- Navigation and Data Fetching for Current Path ---
-    function getItemsForPath(path, structure) {
-        if (!structure) return { files: [], folders: [], allChildren: [] };
-        let currentNode = structure;
-        if (path) {
-            const parts = path.split('/');
-            for (const part of parts) {
-                if (!part) continue;
-                const foundNode = (currentNode.children || []).find(c => c.name === part && c.type === 'directory');
-                if (foundNode) {
-                    currentNode = foundNode;
-                } else { // Path part not found, likely means it's an invalid path or structure issue
-                    return { files: [], folders: [], allChildren: [] };
-                }
-            }
+        if (currentSessionId) { // ZIP متدفق للمجلد الحالي يُولَّد في الخادم أثناء التنزيل
+            const zipLink = document.createElement('a');
+            zipLink.href = `/download-zip/${encodeURIComponent(currentSessionId)}?${new URLSearchParams({ path: path }).toString()}`;
+            zipLink.className = 'download-link float-left';
+            zipLink.setAttribute('title', 'تنزيل محتوى هذا المجلد كملف ZIP');
+            const zipIcon = document.createElement('i');
+            zipIcon.className = 'fas fa-file-archive';
+            zipLink.appendChild(zipIcon);
+            zipLink.appendChild(document.createTextNode(' تنزيل المجلد (ZIP)'));
+            breadcrumbContainer.appendChild(zipLink);
         }
-        // Ensure children is always an array
-        const childrenOfCurrentNode = currentNode.children || [];
-        const files = childrenOfCurrentNode.filter(c => c.type === 'file');
-        const folders = childrenOfCurrentNode.filter(c => c.type === 'directory');
-        return { files, folders, allChildren: childrenOfCurrentNode };
     }
 
 
-    function navigateToPath(path) {
+    // --- Navigation and Data Fetching for Current Path ---
+    function navigateToPath(path, sessionId = currentSessionId) {
+        if (sessionId !== currentSessionId) { // الدخول إلى أرشيف متداخل أو الخروج منه
+            currentSessionId = sessionId;
+            modalImages = { total: 0, pages: new Map() };
+        }
         currentPathInTree = path;
+        currentSearchQuery = ''; // التنقل إلى مجلد ينهي وضع البحث
+        if (archiveSearchInput) archiveSearchInput.value = '';
         renderBreadcrumbs(path);
-        const { files, folders, allChildren } = getItemsForPath(path, fullArchiveStructure);
-
-        // currentDisplayedItems should contain both folders and files for the current path
-        currentDisplayedItems = [...folders, ...files]; // Folders first, then files
 
         currentPageGlobal = 1; // Reset to first page for new path
         displayCurrentPathItemsPage();
@@ -286,7 +378,7 @@ document.addEventListener('DOMContentLoaded', () => {
         document.querySelectorAll('.tree-label.selected').forEach(el => el.classList.remove('selected', 'bg-sky-100', 'dark:bg-sky-700', 'font-semibold'));
         const treeLabels = treeViewContainer.querySelectorAll('.tree-label');
         treeLabels.forEach(label => {
-            if (label.dataset.path === path) {
+            if (label.dataset.path === path && label.dataset.sessionId === sessionId) {
                 label.classList.add('selected', 'bg-sky-100', 'dark:bg-sky-700', 'font-semibold');
                 // Expand parent nodes if this is a deep link or direct navigation
                 let currentElem = label.parentElement; // Start from LI
@@ -303,33 +395,129 @@ document.addEventListener('DOMContentLoaded', () => {
         switchTab('all-files');
     }
 
-    function displayCurrentPathItemsPage() {
-        const totalItems = currentDisplayedItems.length;
-        const totalPages = Math.ceil(totalItems / filesPerPageGlobal);
-        if (currentPageGlobal > totalPages && totalPages > 0) currentPageGlobal = totalPages;
-        if (currentPageGlobal < 1 && totalItems > 0) currentPageGlobal = 1;
-        else if (totalItems === 0) currentPageGlobal = 1;
+    async function displayCurrentPathItemsPage() {
+        if (!currentSessionId) {
+            currentListing = null;
+            currentDisplayedItems = [];
+            displayItemsInList([], null, currentPathInTree);
+            renderPaginationControlsForCurrentPath(1, 0, 0, filesPerPageGlobal);
+            updateImageListInfoForCurrentPath([], 0);
+            return;
+        }
+        const requestId = ++listingRequestCounter;
+        let listing;
+        try {
+            listing = currentSearchQuery
+                ? await fetchSearchResults(currentSearchQuery, currentPageGlobal, filesPerPageGlobal)
+                : await fetchListing(currentPathInTree, currentPageGlobal, filesPerPageGlobal);
+        } catch (error) {
+            if (requestId !== listingRequestCounter) return;
+            console.error('Error loading directory listing:', error);
+            listing = { items: [], page: 1, total: 0, total_pages: 0, image_count: 0 };
+        }
+        if (requestId !== listingRequestCounter) return; // وصل رد لمسار أو صفحة أحدث
+
+        currentListing = listing;
+        currentPageGlobal = listing.page;
+        currentDisplayedItems = listing.items; // Folders first, then files (مرتبة في الخادم)
+
+        displayItemsInList(currentDisplayedItems, currentSessionId, currentPathInTree); // Pass current path
+        renderPaginationControlsForCurrentPath(currentPageGlobal, listing.total_pages, listing.total, filesPerPageGlobal);
+        updateImageListInfoForCurrentPath(currentDisplayedItems, listing.total); // total is for the current path
+    }
+
+
+    // --- Filename Search ---
+    // البحث يجري في الخادم على فهرس أسماء الجلسة (/search)؛ النتائج تُعرض في القائمة نفسها مع ترقيم الصفحات.
+    async function fetchSearchResults(query, page, perPage) {
+        const params = new URLSearchParams({ q: query, page: page, per_page: perPage });
+        const response = await fetch(`/search/${encodeURIComponent(currentSessionId)}?${params.toString()}`);
+        const data = await response.json();
+        if (!response.ok) throw new Error(data.error || `حدث خطأ في الخادم: ${response.status}`);
+        data.image_count = data.items.filter(item => item.type === 'file' && item.is_image).length; // /search لا يعيد عدد الصور الكلي
+        return data;
+    }
+
+    function runSearch(query) {
+        if (!currentSessionId) return;
+        if (!query) { navigateToPath(currentPathInTree); return; }
+        currentSearchQuery = query;
+        currentPageGlobal = 1;
+        if (breadcrumbContainer) breadcrumbContainer.textContent = `نتائج البحث عن "${query}"`;
+        displayCurrentPathItemsPage();
+        switchTab('all-files');
+    }
+
+    if (archiveSearchInput) {
+        archiveSearchInput.addEventListener('input', () => {
+            clearTimeout(searchDebounceTimer);
+            searchDebounceTimer = setTimeout(() => runSearch(archiveSearchInput.value.trim()), SEARCH_DEBOUNCE_MS);
+        });
+    }
+
 
+    // --- Job Polling ---
+    const JOB_POLL_INTERVAL_MS = 1000;
+    const jobStageLabels = {
+        queued: 'في قائمة الانتظار...',
+        downloading: 'جاري تنزيل الأرشيف...',
+        detecting: 'جاري تحديد نوع الأرشيف...',
+        extracting: 'جاري فك الضغط...',
+        indexing: 'جاري فهرسة محتويات الأرشيف...',
+        building_structure: 'جاري بناء هيكل الملفات...',
+        done: 'اكتملت المعالجة.'
+    };
+
+    function formatBytes(bytes) {
+        if (!bytes) return '0 B';
+        const units = ['B', 'KB', 'MB', 'GB', 'TB'];
+        const exponent = Math.min(Math.floor(Math.log(bytes) / Math.log(1024)), units.length - 1);
+        return `${(bytes / Math.pow(1024, exponent)).toFixed(exponent ? 1 : 0)} ${units[exponent]}`;
+    }
 
-        const startIndex = (currentPageGlobal - 1) * filesPerPageGlobal;
-        const endIndex = startIndex + filesPerPageGlobal;
-        const pageItems = currentDisplayedItems.slice(startIndex, endIndex);
+    function showJobProgress(job) {
+        let status = jobStageLabels[job.stage] || 'جاري المعالجة...';
+        let progress = null;
+        if (job.stage === 'downloading') {
+            status += ` (${formatBytes(job.bytes_downloaded)}${job.bytes_total ? ' / ' + formatBytes(job.bytes_total) : ''})`;
+            if (job.volumes_total) {
+                status += ` - الجزء ${job.volumes_downloaded} من ${job.volumes_total}`;
+                progress = Math.round(job.volumes_downloaded * 100 / job.volumes_total);
+            } else if (job.bytes_total) progress = Math.min(100, Math.round(job.bytes_downloaded * 100 / job.bytes_total));
+        } else if (job.stage === 'extracting') {
+            status += ` (${formatBytes(job.bytes_extracted)}${job.extract_total ? ' / ' + formatBytes(job.extract_total) : ''})`;
+            if (job.extract_total) progress = Math.min(100, Math.round(job.bytes_extracted * 100 / job.extract_total));
+        }
+        showLoading(status, progress);
+    }
 
-        displayItemsInList(pageItems, currentSessionId, currentPathInTree); // Pass current path
-        renderPaginationControlsForCurrentPath(currentPageGlobal, totalPages, totalItems, filesPerPageGlobal);
-        updateImageListInfoForCurrentPath(pageItems, totalItems); // totalItems is for the current path
+    async function pollJobUntilDone(statusUrl) {
+        while (true) {
+            const response = await fetch(statusUrl);
+            const job = await response.json();
+            if (!response.ok) throw new Error(job.error || `حدث خطأ في الخادم: ${response.status}`);
+            if (job.status === 'done') return job.result;
+            if (job.status === 'error') return { error: job.error };
+            showJobProgress(job);
+            await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+        }
     }
 
 
     // --- Form Submission ---
+    const VOLUME_RANGE_PATTERN = /\{\d+\.\.\d+\}/;
+
     if (archiveUrlForm) {
         archiveUrlForm.addEventListener('submit', async function(event) {
             event.preventDefault();
             showLoading("بدء المعالجة...");
             currentSessionId = null;
-            fullArchiveStructure = null;
+            currentListing = null;
             currentPathInTree = '';
-            allImagesForModalNavigation = []; // Reset global image list for modal
+            currentSearchQuery = '';
+            if (archiveSearchInput) archiveSearchInput.value = '';
+            mountedArchives = new Map();
+            modalImages = { total: 0, pages: new Map() }; // Reset global image list for modal
 
             const archiveUrl = archiveUrlInput.value.trim();
             if (!archiveUrl) { showError('الرجاء إدخال رابط ملف الأرشيف.'); return; }
@@ -340,46 +528,32 @@ document.addEventListener('DOMContentLoaded', () => {
                 const response = await fetch('/process-archive', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ archive_url: archiveUrl }),
+                    // رابط بمدى مثل .part{1..9}.rar أو .7z.{001..012} = أرشيف متعدد الأجزاء
+                    body: JSON.stringify(VOLUME_RANGE_PATTERN.test(archiveUrl)
+                        ? { volume_pattern: archiveUrl, async: true }
+                        : { archive_url: archiveUrl, async: true }),
                 });
 
-                hideLoading();
                 if (!response.ok) {
+                    hideLoading();
                     let errorData;
                     try { errorData = await response.json(); } catch (e) { /* no json */ }
                     const errorMessage = errorData && errorData.error ? errorData.error : `حدث خطأ في الخادم: ${response.status} ${response.statusText}`;
                     throw new Error(errorMessage);
                 }
-                const data = await response.json();
+                let data = await response.json();
+                if (data.job_id) { // وضع المهام: متابعة التقدم حتى انتهاء المعالجة في الخادم
+                    data = await pollJobUntilDone(data.status_url);
+                }
+                hideLoading();
                 if (data.error) { showError(data.error); return; }
 
                 resultsSection.classList.remove('hidden');
                 currentSessionId = data.session_id;
-                fullArchiveStructure = data.structure;
 
-                renderTree(fullArchiveStructure);
+                renderTree(data.structure); // المستوى الأول فقط؛ الباقي يُجلب من /list عند فتح المجلدات
                 navigateToPath(''); // Navigate to root initially
 
-                // Collect all images from the entire archive for modal navigation
-                allImagesForModalNavigation = [];
-                function collectAllImagesRecursive(node, pathPrefix = '') {
-                    if (!node || !node.children) return;
-                    node.children.forEach(child => {
-                        const itemPath = (pathPrefix ? pathPrefix + '/' : '') + child.name;
-                        if (child.type === 'file' && child.is_image) {
-                            allImagesForModalNavigation.push({
-                                name: child.name,
-                                path: itemPath, // Full path from root
-                                downloadUrl: `/view-file/${currentSessionId}/${encodeURIComponent(itemPath)}`
-                            });
-                        } else if (child.type === 'directory') {
-                            collectAllImagesRecursive(child, itemPath);
-                        }
-                    });
-                }
-                collectAllImagesRecursive(fullArchiveStructure);
-
-
             } catch (error) {
                 console.error('Error processing archive URL:', error);
                 showError(error.message || 'فشل في معالجة الرابط.');
@@ -422,6 +596,12 @@ document.addEventListener('DOMContentLoaded', () => {
                 fileNameSpan.addEventListener('click', () => navigateToPath(itemFullPath));
                 iconElement.classList.add('cursor-pointer');
                 iconElement.addEventListener('click', () => navigateToPath(itemFullPath));
+            } else if (item.is_archive && sessionId) { // فتح الأرشيف المتداخل دون تنزيله
+                fileNameSpan.classList.add('cursor-pointer', 'hover:underline');
+                fileNameSpan.setAttribute('title', `فتح ${item.name}`);
+                fileNameSpan.addEventListener('click', () => openNestedArchive(sessionId, itemFullPath));
+                iconElement.classList.add('cursor-pointer');
+                iconElement.addEventListener('click', () => openNestedArchive(sessionId, itemFullPath));
             }
 
             fileInfoDiv.appendChild(iconElement); // Icon
@@ -450,7 +630,8 @@ document.addEventListener('DOMContentLoaded', () => {
 
                 const imgElement = document.createElement('img');
                 imgElement.className = 'image-thumbnail w-full h-full object-cover lazy-load';
-                const imageUrl = `/view-file/${sessionId}/${encodeURIComponent(itemFullPath)}`;
+                // المعرض يعرض الصور المصغرة؛ الصورة بدقتها الكاملة تُحمل فقط في نافذة العرض (modal)
+                const imageUrl = `/thumb/${sessionId}/${encodeURIComponent(itemFullPath)}?size=${THUMBNAIL_SIZE}`;
                 imgElement.src = lazyLoadPlaceholder;
                 imgElement.dataset.src = imageUrl;
                 imgElement.dataset.altOriginal = item.name;
@@ -532,7 +713,7 @@ document.addEventListener('DOMContentLoaded', () => {
     function updateImageListInfoForCurrentPath(currentPathPageItems, totalItemsInCurrentPath) {
         if (!imageListInfoDiv) return;
 
-        const totalImagesInCurrentPath = currentDisplayedItems.filter(item => item.type === 'file' && item.is_image).length;
+        const totalImagesInCurrentPath = currentListing ? currentListing.image_count : 0;
         const imagesInCurrentPage = currentPathPageItems.filter(item => item.type === 'file' && item.is_image);
 
         if (totalImagesInCurrentPath === 0) {
@@ -549,12 +730,43 @@ document.addEventListener('DOMContentLoaded', () => {
 
 
     // --- Modal Functions ---
-    function displayImageInModal(index) {
-        if (!allImagesForModalNavigation || allImagesForModalNavigation.length === 0 || index < 0 || index >= allImagesForModalNavigation.length) {
+    function imageFromListingItem(item) {
+        return {
+            name: item.name,
+            path: item.path, // Full path from root
+            downloadUrl: `/view-file/${currentSessionId}/${encodeURIComponent(item.path)}`
+        };
+    }
+
+    async function fetchModalImagesPage(params) {
+        const query = new URLSearchParams({ per_page: MODAL_IMAGES_PAGE_SIZE, ...params });
+        const response = await fetch(`/images/${encodeURIComponent(currentSessionId)}?${query.toString()}`);
+        const data = await response.json();
+        if (!response.ok) throw new Error(data.error || `حدث خطأ في الخادم: ${response.status}`);
+        modalImages.total = data.total;
+        modalImages.pages.set(data.page, data.items.map(imageFromListingItem));
+        return data;
+    }
+
+    async function getModalImage(index) {
+        const page = Math.floor(index / MODAL_IMAGES_PAGE_SIZE) + 1;
+        if (!modalImages.pages.has(page)) await fetchModalImagesPage({ page: page });
+        return modalImages.pages.get(page)[index % MODAL_IMAGES_PAGE_SIZE];
+    }
+
+    async function displayImageInModal(index) {
+        if (modalImages.total === 0 || index < 0 || index >= modalImages.total) {
             closeImageModal(); return;
         }
         currentModalImageIndex = index;
-        const imageData = allImagesForModalNavigation[index];
+        let imageData;
+        try {
+            imageData = await getModalImage(index);
+        } catch (error) {
+            console.error('Error loading modal images page:', error);
+            closeImageModal(); return;
+        }
+        if (index !== currentModalImageIndex || !imageData) return; // تنقل المستخدم أثناء جلب الصفحة
         if(!modalImage || !modalImageName || !modalImageCounter || !modalSpinner) return;
 
         modalImage.classList.remove('opacity-100', 'loaded');
@@ -564,7 +776,7 @@ document.addEventListener('DOMContentLoaded', () => {
         modalImage.src = lazyLoadPlaceholder; // Placeholder while loading
         modalImage.alt = "جاري تحميل " + imageData.name + "...";
         modalImageName.textContent = imageData.name;
-        modalImageCounter.textContent = `${index + 1} / ${allImagesForModalNavigation.length}`;
+        modalImageCounter.textContent = `${index + 1} / ${modalImages.total}`;
 
         const tempImg = new Image();
         tempImg.onload = () => {
@@ -586,14 +798,20 @@ document.addEventListener('DOMContentLoaded', () => {
         tempImg.src = imageData.downloadUrl; // Start loading
 
         if(modalPrevButton) { modalPrevButton.disabled = (index === 0); modalPrevButton.classList.toggle('disabled', index === 0); }
-        if(modalNextButton) { modalNextButton.disabled = (index === allImagesForModalNavigation.length - 1); modalNextButton.classList.toggle('disabled', index === allImagesForModalNavigation.length - 1); }
+        if(modalNextButton) { modalNextButton.disabled = (index === modalImages.total - 1); modalNextButton.classList.toggle('disabled', index === modalImages.total - 1); }
     }
 
-    function openImageModal(clickedImageFullPath) {
-        if (!currentSessionId || !allImagesForModalNavigation || allImagesForModalNavigation.length === 0) return;
-        const initialIndex = allImagesForModalNavigation.findIndex(img => img.path === clickedImageFullPath);
+    async function openImageModal(clickedImageFullPath) {
+        if (!currentSessionId) return;
+        let initialIndex = -1;
+        try { // الصفحة التي تحتوي الصورة المختارة وموضعها بين كل صور الأرشيف
+            const data = await fetchModalImagesPage({ of: clickedImageFullPath });
+            initialIndex = data.position;
+        } catch (error) {
+            console.error('Error locating image for modal:', error);
+        }
 
-        if (initialIndex !== -1 && imageModal) {
+        if (initialIndex !== null && initialIndex !== -1 && imageModal) {
             imageModal.classList.remove('hidden');
             setTimeout(() => { imageModal.classList.add('flex'); imageModal.classList.remove('opacity-0'); }, 10); // For transition
             document.body.classList.add('modal-open');
@@ -626,7 +844,7 @@ document.addEventListener('DOMContentLoaded', () => {
         if (event.key === 'ArrowRight' && modalNextButton && !modalNextButton.disabled) modalNextButton.click(); // Right arrow for "next" (button on left)
     });
     if(modalPrevButton) modalPrevButton.addEventListener('click', (e) => { e.stopPropagation(); if (currentModalImageIndex > 0) displayImageInModal(currentModalImageIndex - 1); });
-    if(modalNextButton) modalNextButton.addEventListener('click', (e) => { e.stopPropagation(); if (currentModalImageIndex < allImagesForModalNavigation.length - 1) displayImageInModal(currentModalImageIndex + 1); });
+    if(modalNextButton) modalNextButton.addEventListener('click', (e) => { e.stopPropagation(); if (currentModalImageIndex < modalImages.total - 1) displayImageInModal(currentModalImageIndex + 1); });
 
 
     // --- Tab Functions ---
@@ -644,9 +862,7 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         if (targetTabId === 'images-only') {
-            const { files, folders } = getItemsForPath(currentPathInTree, fullArchiveStructure);
-            const pageItemsForInfo = [...folders, ...files].slice( (currentPageGlobal - 1) * filesPerPageGlobal, currentPageGlobal * filesPerPageGlobal);
-            updateImageListInfoForCurrentPath(pageItemsForInfo, currentDisplayedItems.length);
+            updateImageListInfoForCurrentPath(currentDisplayedItems, currentListing ? currentListing.total : 0);
         }
     }
     if (tabAllFilesButton) tabAllFilesButton.addEventListener('click', () => switchTab('all-files'));
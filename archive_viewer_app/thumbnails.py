@@ -0,0 +1,47 @@
+# coding: utf-8
+"""
+توليد الصور المصغرة داخل عمليات مجمع العمال (ProcessPoolExecutor) في app.py.
+وحدة مستقلة وخفيفة: العمليات العاملة تستوردها وحدها حين يُشغَّل التطبيق كوحدة مستوردة (flask run أو
+gunicorn). عند التشغيل بـ python app.py تعيد spawn تنفيذ app.py أيضًا كـ __mp_main__ في كل عملية، مع
+تخطي تهيئة التخزين فيها (IS_POOL_WORKER_PROCESS).
+"""
+import os
+import uuid
+
+try:
+    from PIL import Image, ImageOps
+except ImportError: # Pillow اختياري: بدونه تُخدم الصور الأصلية بدل المصغرة
+    Image = None
+    ImageOps = None
+
+THUMBNAIL_JPEG_QUALITY = 80
+
+
+def is_available():
+    return Image is not None
+
+
+def render_thumbnail(source_path, dest_path, max_side):
+    """ إنشاء صورة مصغرة JPEG لا يتجاوز ضلعها الأكبر max_side، وكتابتها ذريًا في dest_path. """
+    with Image.open(source_path) as image:
+        # draft يجعل فك ترميز JPEG يتم بمقياس مصغر مباشرة (أسرع بكثير للصور الكبيرة)
+        image.draft('RGB', (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        temp_path = f"{dest_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            image.save(temp_path, 'JPEG', quality=THUMBNAIL_JPEG_QUALITY, optimize=True)
+            os.replace(temp_path, dest_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    return dest_path
@@ -0,0 +1,96 @@
+# coding: utf-8
+"""
+مولدات أرشيفات اصطناعية حتمية (نفس البذرة = نفس المحتوى) لقياسات خط المعالجة الكامل:
+zip وtar وtar.gz وtar.bz2 و7z، و rar عند توفر أداة rar في PATH (لا تستطيع rarfile الكتابة).
+
+    python benchmarks/archive_generators.py --format zip --files 1000 --depth 3 --out /tmp/sample.zip
+"""
+import argparse
+import io
+import os
+import random
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import zipfile
+
+import py7zr
+
+ARCHIVE_SUFFIXES = {'zip': '.zip', 'tar': '.tar', 'tar.gz': '.tar.gz', 'tar.bz2': '.tar.bz2', '7z': '.7z', 'rar': '.rar'}
+FILE_EXTENSIONS = ('.txt', '.txt', '.json', '.bin', '.jpg') # نسبة تقريبية: نصوص أكثر، وبعض "الصور" والملفات الثنائية
+
+
+def synthetic_files(file_count, depth=2, file_size=64 * 1024, dirs_per_level=8, seed=0):
+    """ توليد (المسار، المحتوى) لـ file_count ملف موزعة على شجرة بعمق depth؛ الأحجام بين 0.5× و1.5× file_size. """
+    rng = random.Random(seed)
+    text_block = b"".join(f"line {i} of a synthetic benchmark file\n".encode() for i in range(256))
+    for i in range(file_count):
+        parts = [f"level{level}_{rng.randrange(dirs_per_level):02d}" for level in range(depth)]
+        extension = FILE_EXTENSIONS[i % len(FILE_EXTENSIONS)]
+        size = max(1, int(file_size * (0.5 + rng.random())))
+        if extension in ('.bin', '.jpg'): # غير قابل للضغط تقريبًا
+            data = rng.randbytes(size)
+        else:
+            data = (text_block * (size // len(text_block) + 1))[:size]
+        yield '/'.join(parts + [f"file{i:06d}{extension}"]), data
+
+
+def rar_available():
+    return shutil.which('rar') is not None
+
+
+def write_archive(path, archive_format, files):
+    """ كتابة الملفات (مولد من synthetic_files) في أرشيف بالصيغة المطلوبة؛ يعيد عدد الملفات. """
+    count = 0
+    if archive_format == 'zip':
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED, compresslevel=6) as zf:
+            for name, data in files:
+                zf.writestr(name, data)
+                count += 1
+    elif archive_format in ('tar', 'tar.gz', 'tar.bz2'):
+        mode = {'tar': 'w', 'tar.gz': 'w:gz', 'tar.bz2': 'w:bz2'}[archive_format]
+        with tarfile.open(path, mode) as tf:
+            for name, data in files:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = 1700000000 # ثابت حتى يبقى الأرشيف متطابقًا بين التشغيلات
+                tf.addfile(info, io.BytesIO(data))
+                count += 1
+    elif archive_format == '7z':
+        with py7zr.SevenZipFile(path, 'w') as szf:
+            for name, data in files:
+                szf.writestr(data, name)
+                count += 1
+    elif archive_format == 'rar':
+        if not rar_available():
+            raise RuntimeError("أداة rar غير موجودة في PATH؛ لا يمكن إنشاء أرشيف RAR.")
+        with tempfile.TemporaryDirectory() as source_dir:
+            for name, data in files:
+                file_path = os.path.join(source_dir, *name.split('/'))
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                with open(file_path, 'wb') as f:
+                    f.write(data)
+                count += 1
+            subprocess.run(['rar', 'a', '-r', '-idq', '-ep1', os.path.abspath(path), '.'], cwd=source_dir, check=True)
+    else:
+        raise ValueError(f"صيغة غير مدعومة: {archive_format}")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--format', choices=sorted(ARCHIVE_SUFFIXES), default='zip')
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--file-size-kb', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', required=True)
+    args = parser.parse_args()
+
+    count = write_archive(args.out, args.format, synthetic_files(args.files, args.depth, args.file_size_kb * 1024, seed=args.seed))
+    print(f"{args.out}: {count} files, {os.path.getsize(args.out) / 2 ** 20:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
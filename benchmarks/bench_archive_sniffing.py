@@ -0,0 +1,138 @@
+# coding: utf-8
+"""
+مقارنة كشف نوع الأرشيف بالتواقيع (sniff_archive) مع سلسلة الفحوص القديمة
+(rarfile.is_rarfile ثم zipfile.is_zipfile ثم tarfile.is_tarfile ثم فتح py7zr) على عينات كبيرة.
+
+    python benchmarks/bench_archive_sniffing.py --size-mb 64 --members 2000 --repeat 20
+
+الخيار --drop-caches يفرغ ذاكرة صفحات النظام قبل كل قياس (يتطلب صلاحيات root على Linux)
+لقياس كلفة القراءة من القرص فعلًا بدل الذاكرة.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import py7zr  # noqa: E402
+import rarfile  # noqa: E402
+
+from isolated_app import archive_app  # noqa: E402
+
+
+def legacy_get_archive_type(filepath):
+    """ نسخة من سلسلة الفحوص السابقة في get_archive_type (دون التسجيل) للمقارنة. """
+    filename = os.path.basename(filepath).lower()
+    try:
+        if rarfile.is_rarfile(filepath):
+            return 'rar'
+    except Exception:
+        pass
+    try:
+        if zipfile.is_zipfile(filepath):
+            return 'zip'
+    except Exception:
+        pass
+    try:
+        if tarfile.is_tarfile(filepath):
+            return 'tar'
+    except Exception:
+        pass
+    if filename.endswith('.7z'):
+        try:
+            with py7zr.SevenZipFile(filepath, 'r') as _:
+                return '7z'
+        except Exception:
+            pass
+    return archive_app.get_archive_type_by_extension(filename)
+
+
+def generate_samples(work_dir, size_mb, members):
+    """ إنشاء عينات بالحجم المطلوب تقريبًا وعدد العناصر المطلوب لكل صيغة. """
+    member_size = max(1, size_mb * 1024 * 1024 // members)
+    payloads = [(f'dir{i % 50}/file{i}.bin', os.urandom(member_size)) for i in range(members)]
+    samples = {}
+
+    samples['zip'] = os.path.join(work_dir, 'sample.zip')
+    with zipfile.ZipFile(samples['zip'], 'w', zipfile.ZIP_STORED) as zf:
+        for name, data in payloads:
+            zf.writestr(name, data)
+
+    for label, mode, suffix in (('tar', 'w', '.tar'), ('tar.gz', 'w:gz', '.tar.gz'), ('tar.bz2', 'w:bz2', '.tar.bz2'), ('tar.xz', 'w:xz', '.tar.xz')):
+        samples[label] = os.path.join(work_dir, 'sample' + suffix)
+        options = {'compresslevel': 1} if mode in ('w:gz', 'w:bz2') else ({'preset': 0} if mode == 'w:xz' else {})
+        with tarfile.open(samples[label], mode, **options) as tf:
+            for name, data in payloads:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tf.addfile(info, io.BytesIO(data))
+
+    samples['7z'] = os.path.join(work_dir, 'sample.7z')
+    with py7zr.SevenZipFile(samples['7z'], 'w', filters=[{'id': py7zr.FILTER_COPY}]) as szf:
+        for name, data in payloads:
+            szf.writestr(data, name)
+
+    # ملف ليس أرشيفًا: أسوأ حالة للسلسلة القديمة (تمر على كل الفحوص)
+    samples['not-an-archive'] = os.path.join(work_dir, 'sample.bin')
+    with open(samples['not-an-archive'], 'wb') as f:
+        f.write(os.urandom(size_mb * 1024 * 1024))
+    return samples
+
+
+def drop_page_cache():
+    os.sync()
+    with open('/proc/sys/vm/drop_caches', 'w') as f:
+        f.write('3\n')
+
+
+def time_detector(detector, path, repeat, drop_caches):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        if drop_caches:
+            drop_page_cache()
+        started_at = time.perf_counter()
+        result = detector(path)
+        timings.append(time.perf_counter() - started_at)
+    timings.sort()
+    return result, timings[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=64)
+    parser.add_argument('--members', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--drop-caches', action='store_true')
+    parser.add_argument('--json', dest='json_path', help="كتابة النتائج بصيغة JSON إلى هذا الملف")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        samples = generate_samples(work_dir, args.size_mb, args.members)
+        print(f"{'sample':<16}{'legacy':>12}{'sniff':>12}{'speedup':>10}  result")
+        for label, path in samples.items():
+            legacy_type, legacy_seconds = time_detector(legacy_get_archive_type, path, args.repeat, args.drop_caches)
+            sniffed, sniff_seconds = time_detector(archive_app.sniff_archive, path, args.repeat, args.drop_caches)
+            speedup = legacy_seconds / sniff_seconds if sniff_seconds else float('inf')
+            results.append({'sample': label, 'bytes': os.path.getsize(path), 'legacy_type': legacy_type,
+                            'sniffed_type': sniffed['type'], 'codec': sniffed['codec'],
+                            'legacy_ms': round(legacy_seconds * 1000, 3), 'sniff_ms': round(sniff_seconds * 1000, 3),
+                            'speedup': round(speedup, 1)})
+            print(f"{label:<16}{legacy_seconds * 1000:>10.3f}ms{sniff_seconds * 1000:>10.3f}ms{speedup:>9.1f}x  "
+                  f"{legacy_type} -> {sniffed['type']} ({sniffed['codec']})")
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({'benchmark': 'archive_sniffing', 'size_mb': args.size_mb, 'members': args.members,
+                       'drop_caches': args.drop_caches, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+# coding: utf-8
+"""
+قياس فك الضغط المتوازي: ZIP بالحلقة التسلسلية القديمة مقابل مجمع العمليات بعدد 1/2/4/8 عمليات،
+و TAR (tar.gz وtar غير مضغوط) بالاستخراج التسلسلي القديم مقابل خط فك الضغط والكتابة المتداخلين.
+
+    python benchmarks/bench_parallel_extract.py --size-mb 256 --members 2000 --workers 1,2,4,8
+
+المحتوى قابل للضغط (نص متكرر مع بايتات عشوائية) حتى يكون فك ضغط zlib هو الكلفة الغالبة كما في
+الأرشيفات الحقيقية. الخيار --drop-caches يفرغ ذاكرة صفحات النظام قبل كل قياس (يتطلب root على Linux).
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from isolated_app import archive_app  # noqa: E402
+
+
+def generate_payloads(size_mb, members):
+    """ عناصر بأحجام متفاوتة (1× إلى 4× المتوسط) موزعة على 50 مجلدًا. """
+    average_size = max(1, size_mb * 1024 * 1024 // members)
+    base_text = b"archive viewer benchmark line with some repeated words " * 64
+    payloads = []
+    for i in range(members):
+        member_size = average_size * (1 + i % 4) * 2 // 5
+        noise = os.urandom(max(1, member_size // 8))
+        data = (base_text + noise) * (member_size // (len(base_text) + len(noise)) + 1)
+        payloads.append((f'dir{i % 50}/file{i}.txt', data[:member_size]))
+    return payloads
+
+
+def generate_samples(work_dir, payloads):
+    samples = {'zip': os.path.join(work_dir, 'sample.zip')}
+    with zipfile.ZipFile(samples['zip'], 'w', zipfile.ZIP_DEFLATED, compresslevel=6) as zf:
+        for name, data in payloads:
+            zf.writestr(name, data)
+    for label, mode, suffix in (('tar.gz', 'w:gz', '.tar.gz'), ('tar', 'w', '.tar')):
+        samples[label] = os.path.join(work_dir, 'sample' + suffix)
+        with tarfile.open(samples[label], mode) as tf:
+            for name, data in payloads:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tf.addfile(info, io.BytesIO(data))
+    return samples
+
+
+def legacy_extract_zip(path, dest):
+    """ نسخة من حلقة فك ضغط ZIP السابقة في extract_archive. """
+    with zipfile.ZipFile(path, 'r') as zf:
+        for member in zf.infolist():
+            zf.extract(member, path=dest)
+
+
+def legacy_extract_tar(path, dest):
+    """ نسخة من حلقة فك ضغط TAR السابقة في extract_archive. """
+    with tarfile.open(path, 'r:*') as tf:
+        for member in tf:
+            tf.extract(member, path=dest)
+
+
+def drop_page_cache():
+    os.sync()
+    with open('/proc/sys/vm/drop_caches', 'w') as f:
+        f.write('3\n')
+
+
+def time_extraction(function, dest, repeat, drop_caches):
+    """ الوسيط من عدة تشغيلات، مع حذف مجلد الإخراج بين كل تشغيل وآخر (خارج التوقيت). """
+    timings = []
+    for _ in range(repeat):
+        shutil.rmtree(dest, ignore_errors=True)
+        if drop_caches:
+            drop_page_cache()
+        started_at = time.perf_counter()
+        function(dest)
+        os.sync() # الكتابة على القرص جزء من الكلفة وليست في ذاكرة الصفحات فقط
+        timings.append(time.perf_counter() - started_at)
+    shutil.rmtree(dest, ignore_errors=True)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=256, help="الحجم التقريبي للبيانات غير المضغوطة")
+    parser.add_argument('--members', type=int, default=2000)
+    parser.add_argument('--workers', default='1,2,4,8', help="أعداد عمليات مجمع ZIP المطلوب قياسها")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--drop-caches', action='store_true')
+    parser.add_argument('--json', dest='json_path', help="كتابة النتائج بصيغة JSON إلى هذا الملف")
+    args = parser.parse_args()
+
+    archive_app.logger.setLevel('WARNING')
+    worker_counts = [int(value) for value in args.workers.split(',') if value.strip()]
+    results = {'cpu_count': os.cpu_count(), 'zip': [], 'tar': []}
+    with tempfile.TemporaryDirectory() as work_dir:
+        payloads = generate_payloads(args.size_mb, args.members)
+        total_bytes = sum(len(data) for _, data in payloads)
+        samples = generate_samples(work_dir, payloads)
+        del payloads
+        dest = os.path.join(work_dir, 'out')
+        print(f"{total_bytes / 2 ** 20:.0f} MB in {args.members} members, {os.cpu_count()} CPUs")
+
+        legacy_seconds = time_extraction(lambda d: legacy_extract_zip(samples['zip'], d), dest, args.repeat, args.drop_caches)
+        results['zip'].append({'method': 'legacy', 'workers': 1, 'seconds': round(legacy_seconds, 3),
+                               'mb_per_s': round(total_bytes / legacy_seconds / 2 ** 20, 1)})
+        print(f"zip     legacy sequential      {legacy_seconds:>7.2f}s {total_bytes / legacy_seconds / 2 ** 20:>8.1f} MB/s")
+        with zipfile.ZipFile(samples['zip']) as zf:
+            members = zf.infolist()
+        for workers in worker_counts:
+            seconds = time_extraction(lambda d: archive_app.extract_zip_parallel(samples['zip'], members, d, workers=workers),
+                                      dest, args.repeat, args.drop_caches)
+            results['zip'].append({'method': 'process_pool', 'workers': workers, 'seconds': round(seconds, 3),
+                                   'mb_per_s': round(total_bytes / seconds / 2 ** 20, 1),
+                                   'speedup': round(legacy_seconds / seconds, 2)})
+            print(f"zip     process pool x{workers:<8}    {seconds:>7.2f}s {total_bytes / seconds / 2 ** 20:>8.1f} MB/s "
+                  f"{legacy_seconds / seconds:>6.2f}x")
+
+        for label in ('tar.gz', 'tar'):
+            legacy_seconds = time_extraction(lambda d: legacy_extract_tar(samples[label], d), dest, args.repeat, args.drop_caches)
+            stage_seconds = {}
+
+            def pipelined(d):
+                _, stage_seconds['decompress'], stage_seconds['write'] = archive_app.extract_tar_pipelined(samples[label], d)
+            seconds = time_extraction(pipelined, dest, args.repeat, args.drop_caches)
+            results['tar'].append({'sample': label, 'legacy_seconds': round(legacy_seconds, 3),
+                                   'pipelined_seconds': round(seconds, 3), 'speedup': round(legacy_seconds / seconds, 2),
+                                   'decompress_busy_seconds': round(stage_seconds['decompress'], 3),
+                                   'write_busy_seconds': round(stage_seconds['write'], 3)})
+            print(f"{label:<7} legacy {legacy_seconds:.2f}s, pipelined {seconds:.2f}s ({legacy_seconds / seconds:.2f}x; "
+                  f"decompress busy {stage_seconds['decompress']:.2f}s, write busy {stage_seconds['write']:.2f}s)")
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({'benchmark': 'parallel_extract', 'size_mb': args.size_mb, 'members': args.members,
+                       'total_bytes': total_bytes, 'drop_caches': args.drop_caches, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
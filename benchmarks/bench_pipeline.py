@@ -0,0 +1,208 @@
+# coding: utf-8
+"""
+قياس خط المعالجة الكامل من البداية للنهاية: توليد أرشيفات اصطناعية بأحجام وأعماق مختلفة، وخدمتها من
+خادم HTTP محلي (بسرعة محدودة ودعم Range اختياريًا)، ثم طلب /process-archive و/list و/view-file عبر
+عميل اختبار Flask وتسجيل أزمنة التحميل والكشف وفك الضغط وبناء الهيكل والخدمة، مع ذروة الذاكرة (RSS).
+
+    python benchmarks/bench_pipeline.py --formats zip,tar.gz,7z --files 100,1000,10000 --json results.json
+    python benchmarks/bench_pipeline.py --json new.json --compare results.json
+
+كل حالة تعمل في عملية Python مستقلة بمجلد رفع مؤقت خاص بها (ARCHIVE_UPLOAD_DIR)، فلا تتأثر ذروة
+الذاكرة ولا الكاش بالحالات السابقة. ملف JSON يحمل معرّف commit الحالي للمقارنة بين الإصدارات.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCHMARKS_DIR, '..', 'archive_viewer_app')
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from archive_generators import ARCHIVE_SUFFIXES, rar_available, synthetic_files, write_archive  # noqa: E402
+from throttled_http_server import ThrottledHTTPServer, parse_rate  # noqa: E402
+
+JOB_POLL_INTERVAL = 0.05
+JOB_TIMEOUT_SECONDS = 3600
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def cell(value, width, precision, unit=''):
+    """ خانة جدول بعرض ثابت، أو '-' عند غياب القيمة (مثل مراحل لا توجد في الوضع الكسول). """
+    text = f"{value:.{precision}f}{unit}" if value is not None else '-'
+    return text.rjust(width)
+
+
+def timed_get(client, url):
+    started_at = time.perf_counter()
+    response = client.get(url)
+    response.get_data() # قراءة الجسم كاملًا (send_file يعيد مولدًا)
+    return response.status_code, (time.perf_counter() - started_at) * 1000
+
+
+def run_case(spec):
+    """ تنفيذ حالة واحدة داخل العملية الفرعية: المعالجة ثم الخدمة؛ يعيد قاموس النتائج. """
+    sys.path.insert(0, APP_DIR)
+    import app as archive_app
+    archive_app.logger.setLevel('WARNING')
+    client = archive_app.app.test_client()
+
+    started_at = time.perf_counter()
+    response = client.post('/process-archive', json={'archive_url': spec['url'], 'mode': spec['mode'], 'async': True})
+    job_id = response.get_json()['job_id']
+    while True:
+        job = client.get(f'/job-status/{job_id}').get_json()
+        if job['status'] in ('done', 'error') or time.perf_counter() - started_at > JOB_TIMEOUT_SECONDS:
+            break
+        time.sleep(JOB_POLL_INTERVAL)
+    result = {'status': job['status'], 'error': job.get('error'), 'wall_seconds': round(time.perf_counter() - started_at, 3),
+              'stages': {stage: stats.get('seconds') for stage, stats in (job.get('stage_stats') or {}).items()},
+              'bytes_extracted': job.get('bytes_extracted')}
+
+    if job['status'] == 'done':
+        session_id = job['session_id']
+        list_status, result['list_root_ms'] = timed_get(client, f'/list/{session_id}?path=&per_page=100')
+        cold, warm, statuses = [], [], set()
+        for path in spec['sample_paths']:
+            status, elapsed_ms = timed_get(client, f'/view-file/{session_id}/{path}')
+            cold.append(elapsed_ms)
+            statuses.add(status)
+            warm.append(timed_get(client, f'/view-file/{session_id}/{path}')[1])
+        statuses.add(list_status)
+        result['serve'] = {'requests': len(cold) * 2, 'statuses': sorted(statuses),
+                           'cold_p50_ms': percentile(cold, 0.5), 'cold_p95_ms': percentile(cold, 0.95),
+                           'warm_p50_ms': percentile(warm, 0.5), 'warm_p95_ms': percentile(warm, 0.95)}
+
+    # ru_maxrss بالكيلوبايت على Linux؛ العمليات الفرعية (مجمع فك الضغط، megadl) تُحسب منفصلة
+    result['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    result['peak_rss_children_bytes'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    return result
+
+
+def run_case_in_subprocess(spec, upload_dir):
+    env = dict(os.environ, ARCHIVE_UPLOAD_DIR=upload_dir)
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--case', json.dumps(spec)],
+                               env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        return {'status': 'crashed', 'error': completed.stderr.strip().splitlines()[-1:] or None}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BENCHMARKS_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BENCHMARKS_DIR,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return {'commit': commit, 'dirty': dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'dirty': None}
+
+
+def case_key(result):
+    return f"{result['format']}/{result['files']}/{result['mode']}"
+
+
+def print_comparison(results, baseline_path):
+    """ نسبة الزمن الكلي وذروة الذاكرة مقارنة بملف نتائج سابق (أكبر من 1 = أبطأ أو أكبر الآن). """
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    baseline_cases = {case_key(result): result for result in baseline['results'] if 'files' in result}
+    print(f"\ncompared with {baseline_path} (commit {(baseline.get('git') or {}).get('commit')}):")
+    for result in results:
+        previous = baseline_cases.get(case_key(result))
+        if not previous or previous.get('status') != 'done' or result.get('status') != 'done':
+            continue
+        time_ratio = result['wall_seconds'] / previous['wall_seconds'] if previous['wall_seconds'] else float('inf')
+        rss_ratio = result['peak_rss_bytes'] / previous['peak_rss_bytes'] if previous['peak_rss_bytes'] else float('inf')
+        print(f"{case_key(result):<28} time {time_ratio:>6.2f}x  peak RSS {rss_ratio:>6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--formats', default='zip,tar,tar.gz,tar.bz2,7z,rar', help="الصيغ المطلوبة (rar يتطلب أداة rar)")
+    parser.add_argument('--files', default='100,1000', help="قائمة أعداد الملفات في كل أرشيف")
+    parser.add_argument('--depth', type=int, default=3, help="عمق شجرة المجلدات")
+    parser.add_argument('--file-size-kb', type=int, default=64, help="متوسط حجم الملف")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mode', default='extract', choices=('auto', 'extract', 'lazy', 'remote'))
+    parser.add_argument('--rate', type=parse_rate, default=0, help="حد سرعة الخادم المحلي لكل اتصال، مثل 8MB (0 = بلا حد)")
+    parser.add_argument('--no-ranges', action='store_true', help="خادم لا يدعم Range")
+    parser.add_argument('--view-samples', type=int, default=50, help="عدد الملفات المطلوبة عبر /view-file لكل حالة")
+    parser.add_argument('--json', dest='json_path', help="كتابة النتائج بصيغة JSON إلى هذا الملف")
+    parser.add_argument('--compare', help="ملف نتائج سابق للمقارنة")
+    parser.add_argument('--case', help=argparse.SUPPRESS) # داخلي: تشغيل حالة واحدة في العملية الفرعية
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case))))
+        return
+
+    formats = [value.strip() for value in args.formats.split(',') if value.strip()]
+    file_counts = [int(value) for value in args.files.split(',') if value.strip()]
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        serve_dir = os.path.join(work_dir, 'serve')
+        os.makedirs(serve_dir)
+        server = ThrottledHTTPServer(serve_dir, rate=args.rate, accept_ranges=not args.no_ranges).start_in_background()
+        print(f"{'case':<28}{'archive':>9}{'total':>8}{'download':>9}{'detect':>8}{'extract':>9}{'struct':>8}"
+              f"{'view p50':>10}{'view p95':>10}{'peak RSS':>10}")
+        for archive_format in formats:
+            if archive_format == 'rar' and not rar_available():
+                print("rar: skipped (rar tool not found in PATH)")
+                results.append({'format': 'rar', 'status': 'skipped', 'error': 'rar tool not found'})
+                continue
+            for file_count in file_counts:
+                archive_name = f"sample_{file_count}{ARCHIVE_SUFFIXES[archive_format]}"
+                archive_path = os.path.join(serve_dir, archive_name)
+                names = []
+
+                def recording(files):
+                    for name, data in files:
+                        names.append(name)
+                        yield name, data
+                write_archive(archive_path, archive_format,
+                              recording(synthetic_files(file_count, args.depth, args.file_size_kb * 1024, seed=args.seed)))
+                step = max(1, len(names) // max(1, args.view_samples))
+                spec = {'url': server.url_for(archive_name), 'mode': args.mode, 'sample_paths': names[::step][:args.view_samples]}
+
+                result = {'format': archive_format, 'files': file_count, 'depth': args.depth, 'mode': args.mode,
+                          'archive_bytes': os.path.getsize(archive_path)}
+                result.update(run_case_in_subprocess(spec, os.path.join(work_dir, f'uploads_{archive_format}_{file_count}')))
+                results.append(result)
+                os.remove(archive_path)
+
+                stages = result.get('stages') or {}
+                serve = result.get('serve') or {}
+                if result['status'] == 'done':
+                    print(f"{case_key(result):<28}{cell(result['archive_bytes'] / 2 ** 20, 9, 1, 'MB')}{cell(result['wall_seconds'], 8, 2, 's')}"
+                          f"{cell(stages.get('downloading'), 9, 2, 's')}{cell(stages.get('detecting'), 8, 3, 's')}"
+                          f"{cell(stages.get('extracting', stages.get('indexing')), 9, 2, 's')}{cell(stages.get('building_structure'), 8, 2, 's')}"
+                          f"{cell(serve.get('cold_p50_ms'), 10, 1, 'ms')}{cell(serve.get('cold_p95_ms'), 10, 1, 'ms')}"
+                          f"{cell(result['peak_rss_bytes'] / 2 ** 20, 10, 0, 'MB')}")
+                else:
+                    print(f"{case_key(result):<28} {result['status']}: {result.get('error')}")
+        server.shutdown()
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({'benchmark': 'pipeline', 'git': git_revision(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                       'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+                       'params': {key: value for key, value in vars(args).items() if key not in ('case', 'json_path', 'compare')},
+                       'results': results}, f, indent=2)
+    if args.compare:
+        print_comparison([result for result in results if 'files' in result], args.compare)
+
+
+if __name__ == '__main__':
+    main()
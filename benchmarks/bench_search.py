@@ -0,0 +1,87 @@
+# coding: utf-8
+"""
+قياس البحث في أسماء الملفات (/search) على أشجار اصطناعية كبيرة: زمن بناء فهرس البحث وحجمه، وزمن
+الاستعلامات النادرة والشائعة وبادئات الأسماء واستعلامات المسار، مقارنة بتصفية ملف الهيكل JSON كاملًا
+(ما كان على العميل فعله دون بحث في الخادم).
+
+    python benchmarks/bench_search.py --entries 200000,1000000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from isolated_app import archive_app  # noqa: E402
+from bench_structure_builder import synthetic_entries  # noqa: E402
+
+
+def structure_filter(structure, query):
+    """ تصفية الهيكل JSON كاملًا بمرور على كل العقد (بديل البحث في المتصفح). """
+    matches, pending = [], [structure]
+    while pending:
+        node = pending.pop()
+        for child in node.get('children', []):
+            if query in child['name'].lower():
+                matches.append(child['path'])
+            if child['type'] == 'directory':
+                pending.append(child)
+    return matches
+
+
+def median_ms(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - started_at) * 1000)
+    timings.sort()
+    return result, timings[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', default='200000,1000000', help="قائمة أحجام الأشجار الاصطناعية")
+    parser.add_argument('--files-per-dir', type=int, default=10)
+    parser.add_argument('--dirs-per-parent', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', dest='json_path', help="كتابة النتائج بصيغة JSON إلى هذا الملف")
+    args = parser.parse_args()
+
+    archive_app.logger.setLevel('WARNING')
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for count in [int(value) for value in args.entries.split(',') if value.strip()]:
+            entries = synthetic_entries(count, args.files_per_dir, args.dirs_per_parent)
+            structure, file_sizes = archive_app._build_tree_from_entries(entries)
+            index_path = os.path.join(work_dir, 'index.bin')
+            search_path = os.path.join(work_dir, 'search.bin')
+            archive_app.write_archive_index(structure, file_sizes, index_path)
+            archive_index = archive_app.ArchiveIndex(index_path)
+            _, build_ms = median_ms(lambda: archive_app.write_search_index(archive_index, search_path), 1)
+            search_index = archive_app.SearchIndex(search_path)
+
+            last_dir, last_file = entries[-1][0].rsplit('/', 1)
+            queries = {'rare': last_dir.rsplit('/', 1)[1][-9:], 'common': 'file0000', 'prefix': 'folder00001',
+                       'path': f"{last_dir[-6:]}/{last_file[:6]}".lower()}
+            result = {'entries': len(entries), 'search_index_bytes': os.path.getsize(search_path), 'build_ms': round(build_ms, 1)}
+            for label, query in queries.items():
+                (node_ids, complete), elapsed_ms = median_ms(lambda: search_index.search(archive_index, query), args.repeat)
+                result[f'{label}_ms'] = round(elapsed_ms, 2)
+                result[f'{label}_matches'] = len(node_ids)
+            _, result['json_filter_ms'] = median_ms(lambda: structure_filter(structure, queries['rare']), 1)
+            results.append(result)
+            print(f"{result['entries']:>9} entries: index {result['search_index_bytes'] / 2 ** 20:.1f} MB built in {build_ms:.0f}ms | "
+                  + ', '.join(f"{label} {result[f'{label}_ms']:.2f}ms ({result[f'{label}_matches']})" for label in queries)
+                  + f" | full JSON filter {result['json_filter_ms']:.0f}ms")
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({'benchmark': 'search', 'files_per_dir': args.files_per_dir, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
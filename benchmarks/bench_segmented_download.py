@@ -0,0 +1,69 @@
+# coding: utf-8
+"""
+قياس مكسب التحميل المقسّم المتوازي مقارنة بالاتصال الواحد، على خادم محلي بسرعة محدودة لكل اتصال.
+
+    python benchmarks/bench_segmented_download.py --size-mb 32 --rate 4MB --segments 2,4,8
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from isolated_app import archive_app  # noqa: E402
+from throttled_http_server import ThrottledHTTPServer, parse_rate  # noqa: E402
+
+
+def run_once(label, download):
+    started_at = time.perf_counter()
+    path = download()
+    elapsed = time.perf_counter() - started_at
+    size = os.path.getsize(path)
+    os.remove(path)
+    return {'label': label, 'seconds': round(elapsed, 3), 'bytes': size, 'mb_per_s': round(size / elapsed / (1024 * 1024), 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=32)
+    parser.add_argument('--rate', type=parse_rate, default=parse_rate('4MB'), help="حد السرعة لكل اتصال")
+    parser.add_argument('--segments', default='2,4,8', help="قائمة أعداد الأجزاء المتوازية")
+    parser.add_argument('--json', dest='json_path', help="كتابة النتائج بصيغة JSON إلى هذا الملف")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        serve_dir = os.path.join(work_dir, 'serve')
+        os.makedirs(serve_dir)
+        with open(os.path.join(serve_dir, 'archive.bin'), 'wb') as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+        archive_app.PARTIAL_DOWNLOADS_DIR = os.path.join(work_dir, 'partial')
+        server = ThrottledHTTPServer(serve_dir, rate=args.rate).start_in_background()
+        url = server.url_for('archive.bin')
+        dest = os.path.join(work_dir, 'downloaded.bin')
+
+        results = []
+        original_segments = archive_app.DOWNLOAD_SEGMENTS
+        archive_app.DOWNLOAD_SEGMENTS = 1 # المسار القديم: اتصال واحد بـ iter_content
+        results.append(run_once('single-connection', lambda: archive_app.download_http_file(url, work_dir, dest)))
+        archive_app.DOWNLOAD_SEGMENTS = original_segments
+        for segments in [int(value) for value in args.segments.split(',') if value.strip()]:
+            results.append(run_once(f'segmented-{segments}', lambda: archive_app.download_segmented(url, dest, args.size_mb * 1024 * 1024, segments=segments)))
+        server.shutdown()
+
+    baseline = results[0]['seconds']
+    print(f"{'variant':<20}{'seconds':>10}{'MB/s':>10}{'speedup':>10}")
+    for result in results:
+        result['speedup'] = round(baseline / result['seconds'], 2)
+        print(f"{result['label']:<20}{result['seconds']:>10.2f}{result['mb_per_s']:>10.2f}{result['speedup']:>9.2f}x")
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({'benchmark': 'segmented_download', 'size_mb': args.size_mb, 'rate_bytes_per_s': args.rate, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+# coding: utf-8
+"""
+قياس بناء هيكل الملفات على أشجار اصطناعية كبيرة (10^5 إلى 10^6 عنصر): البناء القديم (بحث خطي عن
+العقدة الأصل في كل مستوى) مقابل البناء في مرور واحد، مع زمن كتابة وتحميل JSON القديم (indent=2)
+والفهرس الثنائي الجديد.
+
+    python benchmarks/bench_structure_builder.py --entries 100000,1000000 --files-per-dir 50
+
+لا تُنشأ الملفات على القرص: يُحاكى os.walk من قائمة العناصر. الخيار --disk-entries يضيف قياسًا
+على شجرة حقيقية على القرص (build_file_structure كاملة، بما فيها قراءة المجلدات).
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from isolated_app import archive_app  # noqa: E402
+
+
+def synthetic_entries(count, files_per_dir, dirs_per_parent):
+    """ شجرة بمستويين من المجلدات وعدد ثابت من الملفات في كل مجلد؛ يعيد (المسار، هل هو مجلد، الحجم). """
+    entries = []
+    dir_count = max(1, count // (files_per_dir + 1))
+    for d in range(dir_count):
+        dir_path = f"group{d // dirs_per_parent:05d}/folder{d:07d}"
+        if d % dirs_per_parent == 0:
+            entries.append((dir_path.split('/')[0], True, 0))
+        entries.append((dir_path, True, 0))
+        for f in range(files_per_dir):
+            extension = '.jpg' if f % 4 == 0 else '.txt'
+            entries.append((f"{dir_path}/file{f:05d}{extension}", False, 1024 + f))
+    return entries[:count]
+
+
+def synthetic_walk(entries):
+    """ محاكاة os.walk (من الأعلى للأسفل) من قائمة العناصر: (المجلد النسبي، المجلدات، الملفات). """
+    children = {'': ([], [])}
+    for entry_path, is_dir, _ in entries:
+        parent_path, _, name = entry_path.rpartition('/')
+        children[parent_path][0 if is_dir else 1].append(name)
+        if is_dir:
+            children[entry_path] = ([], [])
+    pending = ['']
+    while pending:
+        rel_root = pending.pop(0)
+        dirs, files = children[rel_root]
+        yield rel_root, dirs, files
+        pending.extend(f"{rel_root}/{d}" if rel_root else d for d in dirs)
+
+
+def legacy_build_structure(walk):
+    """ نسخة من حلقة build_file_structure السابقة (البحث الخطي عن العقدة الأصل) للمقارنة. """
+    structure = {'name': 'root', 'type': 'directory', 'path': '', 'children': []}
+    for rel_root, dirs, files in walk:
+        parent_node = structure
+        if rel_root:
+            current_search_node = structure
+            found = True
+            for part in rel_root.split('/'):
+                child_node = next((c for c in current_search_node['children'] if c['name'] == part and c['type'] == 'directory'), None)
+                if child_node:
+                    current_search_node = child_node
+                else:
+                    found = False
+                    break
+            if not found:
+                continue
+            parent_node = current_search_node
+        for d_name in sorted(dirs):
+            dir_path_rel = f"{rel_root}/{d_name}" if rel_root else d_name
+            parent_node['children'].append({'name': d_name, 'type': 'directory', 'path': dir_path_rel, 'children': []})
+        for f_name in sorted(files):
+            file_path_rel = f"{rel_root}/{f_name}" if rel_root else f_name
+            is_image = f_name.lower().endswith(archive_app.SUPPORTED_IMAGE_EXTENSIONS)
+            parent_node['children'].append({'name': f_name, 'type': 'file', 'path': file_path_rel, 'is_image': is_image})
+    return structure
+
+
+def timed(function, *args):
+    started_at = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started_at
+
+
+def bench_in_memory(count, args, work_dir):
+    entries = synthetic_entries(count, args.files_per_dir, args.dirs_per_parent)
+    result = {'entries': len(entries)}
+
+    if len(entries) <= args.legacy_max:
+        legacy, result['legacy_build_s'] = timed(legacy_build_structure, synthetic_walk(entries))
+    else:
+        legacy, result['legacy_build_s'] = None, None
+    (structure, file_sizes), result['new_build_s'] = timed(archive_app._build_tree_from_entries, entries)
+    if legacy is not None and legacy != structure:
+        raise SystemExit(f"اختلاف في الهيكل الناتج عند {count} عنصر")
+
+    legacy_json_path = os.path.join(work_dir, 'legacy.json')
+    with open(legacy_json_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(structure, ensure_ascii=False, indent=2))
+    compact_json_path = os.path.join(work_dir, 'compact.json')
+    with open(compact_json_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(structure, ensure_ascii=False, separators=(',', ':')))
+    index_path = os.path.join(work_dir, 'index.bin')
+    _, result['index_write_s'] = timed(archive_app.write_archive_index, structure, file_sizes, index_path)
+
+    def load_json(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    _, result['legacy_json_load_s'] = timed(load_json, legacy_json_path)
+    index, result['index_load_s'] = timed(archive_app.ArchiveIndex, index_path)
+    probe_path = entries[-1][0]
+    _, result['index_find_s'] = timed(index.find, probe_path)
+    result['legacy_json_bytes'] = os.path.getsize(legacy_json_path)
+    result['compact_json_bytes'] = os.path.getsize(compact_json_path)
+    result['index_bytes'] = os.path.getsize(index_path)
+    return result
+
+
+def bench_on_disk(count, args, work_dir):
+    entries = synthetic_entries(count, args.files_per_dir, args.dirs_per_parent)
+    archive_app.EXTRACTED_FILES_DIR_FLASK_APP = work_dir
+    session_folder = os.path.join(work_dir, 'disk_session')
+    for entry_path, is_dir, _ in entries:
+        full_path = os.path.join(session_folder, entry_path)
+        if is_dir:
+            os.makedirs(full_path, exist_ok=True)
+        else:
+            open(full_path, 'wb').close()
+
+    def legacy_walk():
+        for root, dirs, files in os.walk(session_folder):
+            rel_root = os.path.relpath(root, session_folder).replace(os.sep, '/')
+            yield ('' if rel_root == '.' else rel_root), dirs, files
+
+    def legacy_build_and_save():
+        structure = legacy_build_structure(legacy_walk())
+        with open(os.path.join(work_dir, 'legacy_disk.json'), 'w', encoding='utf-8') as f:
+            json.dump(structure, f, ensure_ascii=False, indent=2)
+
+    _, legacy_seconds = timed(legacy_build_and_save)
+    _, new_seconds = timed(archive_app.build_file_structure, session_folder, 'disk_session')
+    shutil.rmtree(session_folder)
+    return {'entries': len(entries), 'legacy_build_s': legacy_seconds, 'new_build_s': new_seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', default='100000,1000000', help="قائمة أحجام الأشجار الاصطناعية")
+    parser.add_argument('--files-per-dir', type=int, default=10)
+    parser.add_argument('--dirs-per-parent', type=int, default=20000, help="عدد المجلدات داخل كل مجلد من المستوى الأول")
+    parser.add_argument('--legacy-max', type=int, default=300000, help="تخطي البناء القديم للأشجار الأكبر (بطيء جدًا)")
+    parser.add_argument('--disk-entries', type=int, default=0, help="حجم الشجرة الحقيقية على القرص (0 = بلا قياس)")
+    parser.add_argument('--json', dest='json_path', help="كتابة النتائج بصيغة JSON إلى هذا الملف")
+    args = parser.parse_args()
+
+    archive_app.logger.setLevel('WARNING')
+    results = {'in_memory': [], 'on_disk': None}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for count in [int(value) for value in args.entries.split(',') if value.strip()]:
+            result = bench_in_memory(count, args, work_dir)
+            results['in_memory'].append(result)
+            legacy = f"{result['legacy_build_s']:.2f}s" if result['legacy_build_s'] is not None else 'skipped'
+            print(f"{result['entries']:>9} entries: build legacy {legacy}, one-pass {result['new_build_s']:.2f}s | "
+                  f"load indent-2 JSON {result['legacy_json_load_s']:.2f}s ({result['legacy_json_bytes'] / 2 ** 20:.1f} MB), "
+                  f"index {result['index_load_s'] * 1000:.1f}ms ({result['index_bytes'] / 2 ** 20:.1f} MB), "
+                  f"write {result['index_write_s']:.2f}s, find {result['index_find_s'] * 1e6:.0f}us")
+        if args.disk_entries:
+            results['on_disk'] = bench_on_disk(args.disk_entries, args, work_dir)
+            print(f"on disk {results['on_disk']['entries']} entries: legacy walk+build+save {results['on_disk']['legacy_build_s']:.2f}s, "
+                  f"build_file_structure {results['on_disk']['new_build_s']:.2f}s")
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({'benchmark': 'structure_builder', 'files_per_dir': args.files_per_dir,
+                       'dirs_per_parent': args.dirs_per_parent, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,20 @@
+# coding: utf-8
+"""
+استيراد التطبيق بمجلد رفع مؤقت: استيراد app ينشئ مجلدات الرفع وقاعدة كاش الروابط (ويرحّل الكاش القديم)،
+فدون ARCHIVE_UPLOAD_DIR تُكتب داخل شجرة المستودع. يُحذف المجلد المؤقت عند انتهاء العملية.
+
+    from isolated_app import archive_app
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+if 'ARCHIVE_UPLOAD_DIR' not in os.environ: # عمليات المجمعات الفرعية (spawn) ترث مجلد العملية الأم
+    os.environ['ARCHIVE_UPLOAD_DIR'] = tempfile.mkdtemp(prefix='archive_viewer_bench_')
+    atexit.register(shutil.rmtree, os.environ['ARCHIVE_UPLOAD_DIR'], ignore_errors=True)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'archive_viewer_app'))
+
+import app as archive_app  # noqa: E402,F401
@@ -0,0 +1,164 @@
+# coding: utf-8
+"""
+خادم HTTP محلي يحاكي المضيفات البعيدة في القياسات: يخدم ملفات مجلد ما مع دعم طلبات Range
+وETag/If-Range (اختياريًا) وتحديد سرعة كل اتصال بالبايت/ثانية، ويحصي الطلبات والبايتات المرسلة.
+
+الاستخدام من سطر الأوامر:
+    python benchmarks/throttled_http_server.py --root /path/to/files --rate 2MB --port 8000
+"""
+import argparse
+import http.server
+import os
+import re
+import threading
+import time
+
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_rate(value):
+    """ تحويل نص مثل '2MB' أو '512KB' أو '0' (بلا حد) إلى بايت/ثانية. """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMG]?)B?\s*', str(value), re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f"سرعة غير صالحة: {value}")
+    multiplier = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}[match.group(2).upper()]
+    return int(float(match.group(1)) * multiplier)
+
+
+class ThrottledRangeHandler(http.server.SimpleHTTPRequestHandler):
+    server_version = "ThrottledRangeHTTP/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body):
+        file_path = self.translate_path(self.path.split('?', 1)[0])
+        if not os.path.isfile(file_path):
+            self.send_error(404)
+            return
+        file_stat = os.stat(file_path)
+        size = file_stat.st_size
+        start, end, status = 0, size - 1, 200
+        etag = f'"{file_stat.st_size:x}-{file_stat.st_mtime_ns:x}"' if self.server.etags else None
+
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if if_range and if_range != etag: # الملف تغيّر منذ الطلب السابق: إرساله كاملًا (200) كما تنص RFC 9110
+            range_header = None
+        if range_header and self.server.accept_ranges:
+            match = re.fullmatch(r'bytes=(\d*)-(\d*)', range_header.strip())
+            if match and (match.group(1) or match.group(2)):
+                if match.group(1):
+                    start = int(match.group(1))
+                    end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+                else: # نطاق لاحقة: آخر N بايت
+                    start = max(0, size - int(match.group(2)))
+                if start >= size or start > end:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{size}')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        if self.server.accept_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if etag:
+            self.send_header('ETag', etag)
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        self.server.record_request(status)
+        if send_body:
+            self._send_throttled(file_path, start, end - start + 1)
+
+    def _send_throttled(self, file_path, offset, length):
+        rate = self.server.rate
+        started_at = time.monotonic()
+        sent = 0
+        with open(file_path, 'rb') as f:
+            f.seek(offset)
+            while sent < length:
+                chunk = f.read(min(CHUNK_SIZE, length - sent))
+                if not chunk:
+                    break
+                try:
+                    self.wfile.write(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                sent += len(chunk)
+                self.server.record_bytes(len(chunk))
+                if rate: # تحديد السرعة لكل اتصال على حدة
+                    delay = sent / rate - (time.monotonic() - started_at)
+                    if delay > 0:
+                        time.sleep(delay)
+
+
+class ThrottledHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, root, host='127.0.0.1', port=0, rate=0, accept_ranges=True, verbose=False, etags=True):
+        self.root = os.path.abspath(root)
+        self.rate = rate
+        self.accept_ranges = accept_ranges
+        self.etags = etags # ETag قوي من الحجم ووقت التعديل، مع دعم If-Range
+        self.verbose = verbose
+        self.stats_lock = threading.Lock()
+        self.reset_stats()
+        handler = lambda *args, **kwargs: ThrottledRangeHandler(*args, directory=self.root, **kwargs)
+        super().__init__((host, port), handler)
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats = {'requests': 0, 'range_requests': 0, 'bytes_sent': 0}
+
+    def record_request(self, status):
+        with self.stats_lock:
+            self.stats['requests'] += 1
+            if status == 206:
+                self.stats['range_requests'] += 1
+
+    def record_bytes(self, amount):
+        with self.stats_lock:
+            self.stats['bytes_sent'] += amount
+
+    def url_for(self, filename):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/{filename}"
+
+    def start_in_background(self):
+        thread = threading.Thread(target=self.serve_forever, name='throttled-http-server', daemon=True)
+        thread.start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description="خادم HTTP محلي بسرعة محدودة ودعم Range.")
+    parser.add_argument('--root', default='.', help="المجلد الذي تُخدم ملفاته")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--rate', type=parse_rate, default=0, help="حد السرعة لكل اتصال، مثل 2MB (0 = بلا حد)")
+    parser.add_argument('--no-ranges', action='store_true', help="تجاهل ترويسة Range (محاكاة خادم لا يدعمها)")
+    args = parser.parse_args()
+
+    server = ThrottledHTTPServer(args.root, args.host, args.port, args.rate, not args.no_ranges, verbose=True)
+    print(f"يخدم {server.root} على {server.url_for('')} (السرعة: {args.rate or 'بلا حد'} بايت/ث لكل اتصال)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
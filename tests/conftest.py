@@ -0,0 +1,88 @@
+# coding: utf-8
+"""
+إعداد مشترك للاختبارات: استيراد التطبيق بمجلد رفع مؤقت (عبر benchmarks/isolated_app)، وخادم HTTP
+محلي يخدم الأرشيفات المولدة، ودالة تنشئ جلسة من أرشيف ZIP عبر /process-archive.
+"""
+import io
+import os
+import sys
+import uuid
+import zipfile
+
+import pytest
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks')
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from isolated_app import archive_app  # noqa: E402
+from throttled_http_server import ThrottledHTTPServer  # noqa: E402
+
+
+def make_png(width=32, height=24, color=(200, 40, 40)):
+    """ صورة PNG صغيرة صالحة (لاختبار الصور المصغرة)، أو بايتات PNG ثابتة إن غاب Pillow. """
+    try:
+        from PIL import Image
+    except ImportError:
+        return b'\x89PNG\r\n\x1a\n' + b'\0' * 64
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def write_zip(path, members):
+    """ كتابة ZIP من قاموس مسار -> بايتات (المسار المنتهي بـ / مجلد فارغ). """
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return path
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    return archive_app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture(scope='session')
+def served_dir(tmp_path_factory):
+    return tmp_path_factory.mktemp('served')
+
+
+@pytest.fixture(scope='session')
+def http_server(served_dir):
+    server = ThrottledHTTPServer(str(served_dir)).start_in_background()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def process_archive_bytes(client, served_dir, http_server):
+    """ خدمة بايتات أرشيف بأي صيغة ومعالجتها عبر /process-archive؛ يعيد (معرّف الجلسة، الرد). """
+    def _process_archive_bytes(data, filename, mode='extract'):
+        filename = f"{uuid.uuid4().hex}-{filename}" # رابط جديد لكل جلسة فلا يعيد كاش الروابط جلسة سابقة
+        with open(os.path.join(served_dir, filename), 'wb') as f:
+            f.write(data)
+        response = client.post('/process-archive', json={'archive_url': http_server.url_for(filename), 'mode': mode})
+        assert response.status_code == 200, response.get_json()
+        payload = response.get_json()
+        return payload['session_id'], payload
+
+    return _process_archive_bytes
+
+
+@pytest.fixture
+def make_session(process_archive_bytes):
+    """ إنشاء جلسة من أعضاء ZIP؛ يعيد (معرّف الجلسة، رد /process-archive). """
+    def _make_session(members, mode='extract', name='archive.zip'):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for member_name, data in members.items():
+                zf.writestr(member_name, data)
+        return process_archive_bytes(buffer.getvalue(), name, mode)
+
+    return _make_session
@@ -0,0 +1,137 @@
+# coding: utf-8
+""" الفهرس الثنائي للجلسة (AVIX): الكتابة والقراءة، find و_find_child، ومدى الصور بترتيب DFS. """
+import json
+import os
+import sys
+
+import pytest
+
+ENTRIES = [
+    ('b', True, 0),
+    ('b/z.png', False, 5),
+    ('b/a.txt', False, 7),
+    ('b/inner', True, 0),
+    ('b/inner/deep.jpg', False, 11),
+    ('a.zip', False, 13),
+    ('c.jpg', False, 17),
+    ('a', True, 0),
+    ('a/x.gif', False, 19),
+    ('same', True, 0),
+    ('same.txt', False, 23),
+    ('ملف عربي.png', False, 29),
+]
+
+
+@pytest.fixture
+def archive_index(app_module, tmp_path):
+    structure, file_sizes = app_module._build_tree_from_entries(ENTRIES)
+    index_file_path = str(tmp_path / app_module.ARCHIVE_INDEX_FILENAME)
+    app_module.write_archive_index(structure, file_sizes, index_file_path)
+    return app_module.ArchiveIndex(index_file_path)
+
+
+def all_paths(archive_index):
+    return {archive_index.path(node_id): node_id for node_id in range(1, len(archive_index))}
+
+
+def test_round_trip_keeps_names_sizes_and_flags(archive_index):
+    assert len(archive_index) == len(ENTRIES) + 1 # الجذر هو العقدة 0
+    paths = all_paths(archive_index)
+    assert set(paths) == {path for path, _, _ in ENTRIES}
+    for path, is_dir, size in ENTRIES:
+        node_id = paths[path]
+        assert archive_index.is_dir(node_id) == is_dir
+        assert archive_index.sizes[node_id] == size
+    assert archive_index.is_image(paths['ملف عربي.png'])
+    assert not archive_index.is_image(paths['b/a.txt'])
+    assert archive_index.is_archive(paths['a.zip'])
+
+
+def test_children_are_directories_first_then_sorted(archive_index):
+    names = [archive_index.name(child_id) for child_id in archive_index.children(0)]
+    assert names == ['a', 'b', 'same', 'a.zip', 'c.jpg', 'same.txt', 'ملف عربي.png']
+    assert archive_index.directory_child_count[0] == 3
+    assert archive_index.image_child_count[0] == 2
+
+
+def test_find_every_path(archive_index):
+    for path, node_id in all_paths(archive_index).items():
+        assert archive_index.find(path) == node_id
+        assert archive_index.find(f"/{path}/") == node_id
+    assert archive_index.find('') == 0
+
+
+@pytest.mark.parametrize('path', ['missing', 'b/missing', 'c.jpg/child', 'b/inner/deep.jpg/x', 'B', 'sam'])
+def test_find_missing_path(archive_index, path):
+    assert archive_index.find(path) is None
+
+
+def test_find_child_distinguishes_directory_and_file_with_close_names(archive_index):
+    same_dir = archive_index._find_child(0, 'same')
+    assert same_dir is not None and archive_index.is_dir(same_dir)
+    same_file = archive_index._find_child(0, 'same.txt')
+    assert same_file is not None and not archive_index.is_dir(same_file)
+    # الملفات تلي المجلدات فلا يكفي بحث ثنائي واحد على الاسم
+    assert archive_index._find_child(0, 'a.zip') == archive_index.find('a.zip')
+    assert archive_index._find_child(0, 'a') == archive_index.find('a')
+    assert archive_index._find_child(archive_index.find('a'), 'a') is None
+
+
+def test_images_follow_tree_order(archive_index):
+    images = [archive_index.path(image_id) for image_id in archive_index.images_under(0)]
+    assert images == ['a/x.gif', 'b/inner/deep.jpg', 'b/z.png', 'c.jpg', 'ملف عربي.png']
+    b_images = [archive_index.path(image_id) for image_id in archive_index.images_under(archive_index.find('b'))]
+    assert b_images == ['b/inner/deep.jpg', 'b/z.png']
+
+
+@pytest.mark.parametrize('kind', [None, 'directory', 'file', 'image'])
+def test_children_of_kind_matches_filtering(archive_index, kind):
+    predicates = {
+        None: lambda node_id: True,
+        'directory': archive_index.is_dir,
+        'file': lambda node_id: not archive_index.is_dir(node_id),
+        'image': archive_index.is_image,
+    }
+    for directory_path in ('', 'a', 'b', 'b/inner', 'same'):
+        node_id = archive_index.find(directory_path)
+        expected = [child_id for child_id in archive_index.children(node_id) if predicates[kind](child_id)]
+        assert list(archive_index.children_of_kind(node_id, kind)) == expected
+
+
+def test_rejects_unknown_version(app_module, archive_index, tmp_path):
+    index_file_path = tmp_path / app_module.ARCHIVE_INDEX_FILENAME
+    data = bytearray(index_file_path.read_bytes())
+    data[4] ^= 0xFF # الإصدار بعد التوقيع مباشرة
+    index_file_path.write_bytes(bytes(data))
+    with pytest.raises(ValueError):
+        app_module.ArchiveIndex(str(index_file_path))
+
+
+def test_ensure_archive_index_rebuilds_from_structure_json(app_module, tmp_path):
+    structure, _ = app_module._build_tree_from_entries(ENTRIES)
+    with open(tmp_path / app_module.STRUCTURE_FILENAME, 'w', encoding='utf-8') as f:
+        json.dump(structure, f)
+    archive_index = app_module.ensure_archive_index(str(tmp_path))
+    assert archive_index is not None
+    assert os.path.exists(tmp_path / app_module.ARCHIVE_INDEX_FILENAME)
+    assert archive_index.is_image(archive_index.find('b/inner/deep.jpg'))
+
+
+def test_paths_deeper_than_the_recursion_limit(app_module, tmp_path):
+    depth = sys.getrecursionlimit() * 2
+    deep_dir = '/'.join(f"d{level}" for level in range(depth))
+    entries = [(f"{deep_dir}/leaf.png", False, 3), ('d0/top.txt', False, 1)] # المجلدات الوسيطة غير مدرجة
+    structure, file_sizes = app_module._build_tree_from_entries(entries)
+    node = structure
+    for level in range(depth):
+        node = next(child for child in node['children'] if child['type'] == 'directory')
+        assert node['name'] == f"d{level}"
+    assert [child['path'] for child in node['children']] == [f"{deep_dir}/leaf.png"]
+
+    index_file_path = str(tmp_path / app_module.ARCHIVE_INDEX_FILENAME)
+    app_module.write_archive_index(structure, file_sizes, index_file_path)
+    archive_index = app_module.ArchiveIndex(index_file_path)
+    assert len(archive_index) == depth + 3
+    leaf_id = archive_index.find(f"{deep_dir}/leaf.png")
+    assert archive_index.sizes[leaf_id] == 3
+    assert archive_index.path(leaf_id) == f"{deep_dir}/leaf.png"
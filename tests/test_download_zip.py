@@ -0,0 +1,62 @@
+# coding: utf-8
+""" تنزيل مجلد أو تحديد كـ ZIP متدفق عبر /download-zip. """
+import io
+import zipfile
+
+import pytest
+
+MEMBERS = {
+    'album/a.jpg': b'a' * 5000,
+    'album/sub/b.txt': b'b' * 100,
+    'album/empty/': b'',
+    'other/c.bin': bytes(range(256)) * 40,
+    'صور/d.txt': 'نص'.encode('utf-8'),
+}
+
+
+@pytest.fixture
+def session_id(make_session):
+    session_id, _ = make_session(MEMBERS, mode='lazy')
+    return session_id
+
+
+def read_zip(response):
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+    with zipfile.ZipFile(io.BytesIO(response.data)) as zf:
+        assert zf.testzip() is None
+        return {name: zf.read(name) for name in zf.namelist()}
+
+
+def test_folder_download(client, session_id):
+    response = client.get(f'/download-zip/{session_id}', query_string={'path': 'album'})
+    assert 'Content-Length' not in response.headers
+    assert 'filename=album.zip' in response.headers['Content-Disposition']
+    files = read_zip(response)
+    assert files['album/a.jpg'] == MEMBERS['album/a.jpg']
+    assert files['album/sub/b.txt'] == MEMBERS['album/sub/b.txt']
+    assert 'album/empty/' in files
+    assert not any(name.startswith('other/') for name in files)
+
+
+def test_whole_archive_download(client, session_id):
+    files = read_zip(client.get(f'/download-zip/{session_id}'))
+    assert {name: data for name, data in files.items() if not name.endswith('/')} == {
+        name: data for name, data in MEMBERS.items() if not name.endswith('/')}
+
+
+def test_selection_download_with_post(client, session_id):
+    response = client.post(f'/download-zip/{session_id}', json={'paths': ['other/c.bin', 'صور']})
+    assert "filename*=UTF-8''" in response.headers['Content-Disposition']
+    files = read_zip(response)
+    assert set(files) >= {'other/c.bin', 'صور/d.txt'}
+    assert files['صور/d.txt'] == MEMBERS['صور/d.txt']
+
+
+@pytest.mark.parametrize('method, kwargs, status', [
+    ('get', {'query_string': {'path': 'missing'}}, 404),
+    ('post', {'json': {'paths': 'album'}}, 400),
+    ('post', {'json': {'paths': []}}, 400),
+])
+def test_download_zip_errors(client, session_id, method, kwargs, status):
+    assert getattr(client, method)(f'/download-zip/{session_id}', **kwargs).status_code == status
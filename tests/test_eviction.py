@@ -0,0 +1,114 @@
+# coding: utf-8
+""" حذف الجلسات الأقدم وصولًا عند تجاوز ميزانية التخزين: ترتيب LRU، تخطي الجلسات قيد الاستخدام أو البناء،
+وتنظيف مدخلات url_cache. """
+import os
+import time
+import uuid
+
+import pytest
+
+SESSION_BYTES = 1000
+
+
+@pytest.fixture
+def sessions_dir(app_module, monkeypatch, tmp_path):
+    # مجلد منفصل حتى لا يحذف عامل LRU جلسات الاختبارات الأخرى
+    monkeypatch.setattr(app_module, 'EXTRACTED_FILES_DIR_FLASK_APP', str(tmp_path))
+    monkeypatch.setattr(app_module, 'EVICTION_MIN_IDLE_SECONDS', 600)
+    return tmp_path
+
+
+def make_idle_session(app_module, sessions_dir, idle_seconds):
+    session_id = uuid.uuid4().hex
+    session_folder = sessions_dir / session_id
+    session_folder.mkdir()
+    (session_folder / 'data.bin').write_bytes(b'x' * SESSION_BYTES)
+    last_access = time.time() - idle_seconds
+    marker_path = session_folder / app_module.SESSION_ACCESS_FILENAME
+    marker_path.touch()
+    os.utime(marker_path, (last_access, last_access))
+    app_module.cache_put(f"url-{session_id}", session_id, str(session_folder / app_module.STRUCTURE_FILENAME))
+    return session_id
+
+
+def remaining_sessions(sessions_dir):
+    return {entry.name for entry in os.scandir(sessions_dir)}
+
+
+def test_nothing_is_evicted_within_budget(app_module, sessions_dir, monkeypatch):
+    session_ids = [make_idle_session(app_module, sessions_dir, 3600) for _ in range(3)]
+    monkeypatch.setattr(app_module, 'EXTRACTED_FILES_MAX_BYTES', 3 * SESSION_BYTES + 100)
+    assert app_module.evict_sessions_over_budget() == 0
+    assert remaining_sessions(sessions_dir) == set(session_ids)
+
+
+def test_least_recently_used_sessions_go_first(app_module, sessions_dir, monkeypatch):
+    oldest, older, newest = (make_idle_session(app_module, sessions_dir, idle) for idle in (3000, 2000, 1000))
+    monkeypatch.setattr(app_module, 'EXTRACTED_FILES_MAX_BYTES', 2 * SESSION_BYTES + 100)
+    assert app_module.evict_sessions_over_budget() == 1
+    assert remaining_sessions(sessions_dir) == {older, newest}
+    monkeypatch.setattr(app_module, 'EXTRACTED_FILES_MAX_BYTES', SESSION_BYTES + 100)
+    assert app_module.evict_sessions_over_budget() == 1
+    assert remaining_sessions(sessions_dir) == {newest}
+
+
+def test_evicted_sessions_leave_the_url_cache(app_module, sessions_dir, monkeypatch):
+    evicted, kept = make_idle_session(app_module, sessions_dir, 2000), make_idle_session(app_module, sessions_dir, 1000)
+    monkeypatch.setattr(app_module, 'EXTRACTED_FILES_MAX_BYTES', SESSION_BYTES + 100)
+    app_module.evict_sessions_over_budget()
+    assert app_module.cache_get(f"url-{evicted}") is None
+    assert app_module.cache_get(f"url-{kept}")['session_id'] == kept
+
+
+def test_sessions_in_use_are_skipped(app_module, sessions_dir, monkeypatch):
+    recently_used = make_idle_session(app_module, sessions_dir, 10)
+    active = make_idle_session(app_module, sessions_dir, 5000)
+    building = make_idle_session(app_module, sessions_dir, 4000)
+    stale_building = make_idle_session(app_module, sessions_dir, 3000)
+    idle = make_idle_session(app_module, sessions_dir, 2000)
+
+    (sessions_dir / building / app_module.SESSION_BUILDING_FILENAME).touch() # بناء جارٍ في عملية أخرى
+    stale_marker = sessions_dir / stale_building / app_module.SESSION_BUILDING_FILENAME
+    stale_marker.touch()
+    stale_time = time.time() - app_module.SESSION_BUILDING_STALE_SECONDS - 10 # عملية ماتت أثناء البناء
+    os.utime(stale_marker, (stale_time, stale_time))
+
+    monkeypatch.setattr(app_module, 'EXTRACTED_FILES_MAX_BYTES', 0)
+    app_module.acquire_session(active)
+    try:
+        assert app_module.evict_sessions_over_budget() == 2
+    finally:
+        app_module.release_session(active)
+    assert remaining_sessions(sessions_dir) == {recently_used, active, building}
+    assert app_module.cache_get(f"url-{idle}") is None
+
+
+def test_building_marker_is_refreshed_and_removed(app_module, monkeypatch, tmp_path):
+    monkeypatch.setattr(app_module, 'SESSION_BUILDING_HEARTBEAT_SECONDS', 0.01)
+    marker_path = tmp_path / app_module.SESSION_BUILDING_FILENAME
+    with app_module.session_building(str(tmp_path)):
+        assert app_module.is_session_building(str(tmp_path))
+        old_time = time.time() - 1000
+        os.utime(marker_path, (old_time, old_time))
+        deadline = time.monotonic() + 5
+        while os.stat(marker_path).st_mtime == old_time and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert os.stat(marker_path).st_mtime > old_time # خيط التحديث يبقي العلامة حديثة أثناء بناء طويل
+    assert not marker_path.exists()
+    assert not app_module.is_session_building(str(tmp_path))
+
+
+def test_pipeline_marks_the_session_while_building(app_module, make_session, monkeypatch):
+    seen = []
+    real_build = app_module.build_session_from_download
+
+    def build_and_check(original_archive_url, session_id, temp_session_folder, extracted_session_folder, *args):
+        seen.append(app_module.is_session_building(extracted_session_folder))
+        return real_build(original_archive_url, session_id, temp_session_folder, extracted_session_folder, *args)
+
+    monkeypatch.setattr(app_module, 'build_session_from_download', build_and_check)
+    session_id, _ = make_session({'a.txt': b'a'})
+    assert seen == [True]
+    session_folder = app_module.get_session_folder(session_id)
+    assert not os.path.exists(os.path.join(session_folder, app_module.SESSION_BUILDING_FILENAME))
+    assert os.path.exists(os.path.join(session_folder, app_module.SESSION_ACCESS_FILENAME))
@@ -0,0 +1,72 @@
+# coding: utf-8
+""" خدمة ملفات الجلسة /view-file: ETag و304 وطلبات Range ونسخ gzip المسبقة للملفات النصية. """
+import gzip
+import os
+
+import pytest
+
+BINARY_DATA = os.urandom(50_000)
+TEXT_DATA = ('سطر نصي للاختبار\n' * 2000).encode('utf-8')
+
+
+@pytest.fixture
+def session_id(make_session):
+    session_id, _ = make_session({'media/clip.bin': BINARY_DATA, 'docs/page.txt': TEXT_DATA}, mode='lazy')
+    return session_id
+
+
+def test_etag_and_immutable_caching(client, session_id):
+    response = client.get(f'/view-file/{session_id}/media/clip.bin')
+    assert response.status_code == 200
+    assert response.data == BINARY_DATA
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.cache_control.immutable and response.cache_control.public
+    assert response.get_etag()[0]
+
+
+def test_if_none_match_returns_304(client, session_id):
+    etag = client.get(f'/view-file/{session_id}/media/clip.bin').get_etag()[0]
+    response = client.get(f'/view-file/{session_id}/media/clip.bin', headers={'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.get_etag()[0] == etag
+    other = client.get(f'/view-file/{session_id}/media/clip.bin', headers={'If-None-Match': '"other"'})
+    assert other.status_code == 200
+
+
+@pytest.mark.parametrize('range_header, start, end', [
+    ('bytes=0-99', 0, 100),
+    ('bytes=49000-', 49000, 50000),
+    ('bytes=-500', 49500, 50000),
+])
+def test_range_requests(client, session_id, range_header, start, end):
+    response = client.get(f'/view-file/{session_id}/media/clip.bin', headers={'Range': range_header})
+    assert response.status_code == 206
+    assert response.data == BINARY_DATA[start:end]
+    assert response.headers['Content-Range'] == f'bytes {start}-{end - 1}/{len(BINARY_DATA)}'
+
+
+def test_unsatisfiable_range(client, session_id):
+    response = client.get(f'/view-file/{session_id}/media/clip.bin', headers={'Range': 'bytes=60000-'})
+    assert response.status_code == 416
+
+
+def test_text_is_served_gzip_to_clients_that_accept_it(client, session_id):
+    response = client.get(f'/view-file/{session_id}/docs/page.txt', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.vary
+    assert gzip.decompress(response.data) == TEXT_DATA
+    gzip_etag = response.get_etag()[0]
+    assert gzip_etag.endswith('-gz')
+
+    plain = client.get(f'/view-file/{session_id}/docs/page.txt')
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.data == TEXT_DATA
+    cached = client.get(f'/view-file/{session_id}/docs/page.txt', headers={'Accept-Encoding': 'gzip', 'If-None-Match': f'"{gzip_etag}"'})
+    assert cached.status_code == 304
+
+
+@pytest.mark.parametrize('path, status', [('media/missing.bin', 404), ('../../../etc/passwd', 403), ('media', 404)])
+def test_view_file_errors(client, session_id, path, status):
+    assert client.get(f'/view-file/{session_id}/{path}').status_code == status
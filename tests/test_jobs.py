@@ -0,0 +1,79 @@
+# coding: utf-8
+""" وضع المهام في /process-archive ‏("async": true) ومتابعة التقدم عبر /job-status. """
+import time
+import uuid
+
+import pytest
+
+from conftest import write_zip
+
+JOB_TIMEOUT_SECONDS = 60
+
+
+def wait_for_job(client, job_id):
+    deadline = time.monotonic() + JOB_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        snapshot = client.get(f'/job-status/{job_id}').get_json()
+        if snapshot['status'] in ('done', 'error'):
+            return snapshot
+        time.sleep(0.05)
+    pytest.fail(f"المهمة {job_id} لم تنته خلال {JOB_TIMEOUT_SECONDS} ثانية")
+
+
+def test_async_job_reports_result(client, served_dir, http_server):
+    filename = f"job-{uuid.uuid4().hex}.zip"
+    write_zip(served_dir / filename, {'dir/a.txt': b'a', 'dir/b.png': b'b'})
+    response = client.post('/process-archive', json={'archive_url': http_server.url_for(filename), 'async': True})
+    assert response.status_code == 202
+    payload = response.get_json()
+    assert payload['status_url'] == f"/job-status/{payload['job_id']}"
+
+    snapshot = wait_for_job(client, payload['job_id'])
+    assert snapshot['status'] == 'done'
+    assert snapshot['stage'] == 'done'
+    assert snapshot['status_code'] == 200
+    assert snapshot['session_id'] == snapshot['result']['session_id']
+    assert 'url_hash' not in snapshot
+    listing = client.get(f"/list/{snapshot['session_id']}", query_string={'path': 'dir'}).get_json()
+    assert [item['name'] for item in listing['items']] == ['a.txt', 'b.png']
+
+    # الطلب نفسه مرة أخرى يُخدم من كاش الروابط مباشرة
+    cached = client.post('/process-archive', json={'archive_url': http_server.url_for(filename), 'async': True})
+    assert cached.status_code == 200
+    assert cached.get_json()['session_id'] == snapshot['session_id']
+
+
+def test_async_job_reports_errors(client, http_server):
+    response = client.post('/process-archive', json={'archive_url': http_server.url_for(f"missing-{uuid.uuid4().hex}.zip"), 'async': True})
+    assert response.status_code == 202
+    snapshot = wait_for_job(client, response.get_json()['job_id'])
+    assert snapshot['status'] == 'error'
+    assert snapshot['status_code'] >= 400
+    assert snapshot['error']
+
+
+def test_job_status_is_served_from_the_shared_store(app_module, client, served_dir, http_server):
+    # عملية gunicorn أخرى لا تملك المهمة في ذاكرتها: تجيب من لقطة قاعدة SQLite
+    filename = f"job-{uuid.uuid4().hex}.zip"
+    write_zip(served_dir / filename, {'a.txt': b'a'})
+    job_id = client.post('/process-archive', json={'archive_url': http_server.url_for(filename), 'async': True}).get_json()['job_id']
+    in_memory = wait_for_job(client, job_id)
+    with app_module.jobs_lock:
+        del app_module.jobs[job_id]
+    stored = wait_for_job(client, job_id) # الحفظ في القاعدة يلي تحديث الذاكرة مباشرة
+    assert stored['status'] == 'done'
+    assert stored['session_id'] == in_memory['session_id']
+    assert stored['result'] == in_memory['result']
+
+
+def test_prune_removes_expired_jobs_from_the_store(app_module, monkeypatch):
+    job = app_module.new_progress(job_id=uuid.uuid4().hex)
+    app_module.update_progress(job, status='done')
+    assert app_module.load_job_state(job['job_id'])['status'] == 'done'
+    monkeypatch.setattr(app_module, 'JOB_RETENTION_SECONDS', -1)
+    app_module.prune_finished_jobs()
+    assert app_module.load_job_state(job['job_id']) is None
+
+
+def test_unknown_job(client):
+    assert client.get('/job-status/does-not-exist').status_code == 404
@@ -0,0 +1,121 @@
+# coding: utf-8
+""" الوضع الكسول: الفهرسة دون فك الضغط، والاستخراج عند أول عرض، وحد ذاكرة العناصر المستخرجة (LRU). """
+import io
+import os
+import tarfile
+import zipfile
+
+import py7zr
+import pytest
+
+MEMBERS = {
+    'docs/readme.txt': b'read me\n' * 50,
+    'docs/deep/notes.md': b'# notes\n',
+    'images/one.png': b'\x89PNG' + b'1' * 1000,
+}
+
+
+def zip_bytes(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return buffer.getvalue()
+
+
+def tar_bytes(members, mode='w'):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode) as tf:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def seven_zip_bytes(members):
+    buffer = io.BytesIO()
+    with py7zr.SevenZipFile(buffer, 'w') as szf:
+        for name, data in members.items():
+            szf.writestr(data, name)
+    return buffer.getvalue()
+
+
+ARCHIVE_BUILDERS = {
+    'archive.zip': zip_bytes,
+    'archive.tar': tar_bytes,
+    'archive.7z': seven_zip_bytes,
+}
+
+
+def member_files(app_module, session_id):
+    """ العناصر المستخرجة على القرص في مجلد الجلسة (دون الملفات الداخلية). """
+    session_folder = app_module.get_session_folder(session_id)
+    found = set()
+    for root, dirs, files in os.walk(session_folder):
+        if root == session_folder:
+            dirs[:] = [d for d in dirs if d not in app_module.SESSION_INTERNAL_NAMES]
+            files = [f for f in files if f not in app_module.SESSION_INTERNAL_NAMES]
+        found.update(os.path.relpath(os.path.join(root, f), session_folder).replace(os.sep, '/') for f in files)
+    return found
+
+
+@pytest.mark.parametrize('filename', sorted(ARCHIVE_BUILDERS))
+def test_members_are_extracted_on_first_view(app_module, client, process_archive_bytes, filename):
+    session_id, payload = process_archive_bytes(ARCHIVE_BUILDERS[filename](MEMBERS), filename, mode='lazy')
+    assert {child['name'] for child in payload['structure']['children']} == {'docs', 'images'}
+    assert member_files(app_module, session_id) == set() # فهرسة فقط
+
+    assert client.get(f'/view-file/{session_id}/docs/deep/notes.md').data == MEMBERS['docs/deep/notes.md']
+    assert member_files(app_module, session_id) == {'docs/deep/notes.md'}
+    assert client.get(f'/view-file/{session_id}/images/one.png').data == MEMBERS['images/one.png']
+    assert member_files(app_module, session_id) == {'docs/deep/notes.md', 'images/one.png'}
+    assert client.get(f'/view-file/{session_id}/docs/missing.txt').status_code == 404
+
+
+def test_compressed_tar_is_extracted_fully_instead_of_lazily(app_module, client, process_archive_bytes):
+    session_id, _ = process_archive_bytes(tar_bytes(MEMBERS, 'w:gz'), 'archive.tar.gz', mode='lazy')
+    assert member_files(app_module, session_id) == set(MEMBERS)
+    assert app_module.load_lazy_source(app_module.get_session_folder(session_id)) is None
+
+
+def test_compressed_tar_member_extraction(app_module, tmp_path):
+    # الأرشيفات المتداخلة تبقى كسولة حتى لو كانت tar مضغوطة
+    archive_path = tmp_path / 'nested.tar.gz'
+    archive_path.write_bytes(tar_bytes(MEMBERS, 'w:gz'))
+    app_module._extract_single_member(str(archive_path), 'tar', 'docs/readme.txt', str(tmp_path / 'out'))
+    assert (tmp_path / 'out' / 'docs' / 'readme.txt').read_bytes() == MEMBERS['docs/readme.txt']
+
+
+def test_member_cache_evicts_least_recently_used(app_module, client, make_session, monkeypatch):
+    members = {f"m{index}.bin": bytes([index]) * 1000 for index in range(4)}
+    session_id, _ = make_session(members, mode='lazy')
+    monkeypatch.setattr(app_module, 'LAZY_MEMBER_CACHE_MAX_BYTES', 2500)
+
+    client.get(f'/view-file/{session_id}/m0.bin')
+    client.get(f'/view-file/{session_id}/m1.bin')
+    client.get(f'/view-file/{session_id}/m0.bin') # m0 أحدث استخدامًا من m1
+    assert member_files(app_module, session_id) == {'m0.bin', 'm1.bin'}
+    client.get(f'/view-file/{session_id}/m2.bin')
+    assert member_files(app_module, session_id) == {'m0.bin', 'm2.bin'}
+
+    # العنصر المحذوف يُستخرج من جديد عند طلبه
+    assert client.get(f'/view-file/{session_id}/m1.bin').data == members['m1.bin']
+    assert member_files(app_module, session_id) == {'m2.bin', 'm1.bin'}
+    lru = app_module.member_cache_lru[session_id]
+    assert lru['bytes'] == 2000
+
+
+@pytest.mark.parametrize('route', [
+    '/view-file/{session_id}/.lazy_source/{filename}',
+    '/view-file/{session_id}/.lazy_source.json',
+    '/view-file/{session_id}/docs/../.lazy_source/{filename}',
+    '/thumb/{session_id}/.lazy_source/{filename}',
+    '/list/{session_id}?path=.lazy_source',
+    '/download-zip/{session_id}?path=.lazy_source',
+])
+def test_lazy_source_is_not_reachable(app_module, client, make_session, route):
+    session_id, _ = make_session(MEMBERS, mode='lazy')
+    filename = app_module.load_lazy_source(app_module.get_session_folder(session_id))['archive_filename']
+    response = client.get(route.format(session_id=session_id, filename=filename))
+    assert response.status_code in (400, 404)
@@ -0,0 +1,78 @@
+# coding: utf-8
+""" المسارات المجزأة /list و/images من الفهرس الثنائي للجلسة. """
+import pytest
+
+from conftest import write_zip
+
+MEMBERS = {
+    'gallery/2020/a.jpg': b'x',
+    'gallery/2020/b.png': b'x',
+    'gallery/cover.jpg': b'x',
+    'gallery/notes.txt': b'x',
+    'gallery/empty/': b'',
+    **{f"gallery/p{index:02d}.png": b'x' for index in range(5)},
+}
+
+
+@pytest.fixture(scope='module')
+def session_id(app_module, served_dir, http_server):
+    write_zip(served_dir / 'listing.zip', MEMBERS)
+    response = app_module.app.test_client().post('/process-archive', json={'archive_url': http_server.url_for('listing.zip')})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['session_id']
+
+
+def test_list_pages_directories_first(client, session_id):
+    payload = client.get(f'/list/{session_id}', query_string={'path': 'gallery', 'per_page': 4}).get_json()
+    assert payload['total'] == 9
+    assert (payload['folder_count'], payload['file_count'], payload['image_count']) == (2, 7, 6)
+    assert [item['name'] for item in payload['items']] == ['2020', 'empty', 'cover.jpg', 'notes.txt']
+    assert payload['items'][0] == {'name': '2020', 'type': 'directory', 'path': 'gallery/2020', 'child_count': 2, 'image_count': 2}
+
+    payload = client.get(f'/list/{session_id}', query_string={'path': 'gallery', 'per_page': 4, 'page': 3}).get_json()
+    assert [item['name'] for item in payload['items']] == ['p04.png']
+
+
+@pytest.mark.parametrize('kind, expected', [
+    ('directory', ['2020', 'empty']),
+    ('file', ['cover.jpg', 'notes.txt', 'p00.png', 'p01.png', 'p02.png', 'p03.png', 'p04.png']),
+    ('image', ['cover.jpg', 'p00.png', 'p01.png', 'p02.png', 'p03.png', 'p04.png']),
+])
+def test_list_filters_by_kind(client, session_id, kind, expected):
+    payload = client.get(f'/list/{session_id}', query_string={'path': 'gallery', 'kind': kind}).get_json()
+    assert [item['name'] for item in payload['items']] == expected
+    assert payload['total'] == len(expected)
+
+
+@pytest.mark.parametrize('query_string, status', [
+    ({'path': 'missing'}, 404),
+    ({'path': 'gallery/cover.jpg'}, 404),
+    ({'page': '0'}, 400),
+    ({'kind': 'video'}, 400),
+])
+def test_list_errors(client, session_id, query_string, status):
+    assert client.get(f'/list/{session_id}', query_string=query_string).status_code == status
+
+
+def test_list_unknown_session(client):
+    assert client.get('/list/' + 'f' * 32).status_code == 404
+
+
+def test_images_lists_subfolders_in_tree_order(client, session_id):
+    payload = client.get(f'/images/{session_id}', query_string={'path': 'gallery'}).get_json()
+    assert [item['path'] for item in payload['items']] == [
+        'gallery/2020/a.jpg', 'gallery/2020/b.png', 'gallery/cover.jpg',
+        'gallery/p00.png', 'gallery/p01.png', 'gallery/p02.png', 'gallery/p03.png', 'gallery/p04.png']
+    assert payload['position'] is None
+
+
+def test_images_of_returns_the_page_with_the_image(client, session_id):
+    payload = client.get(f'/images/{session_id}', query_string={'path': 'gallery', 'of': 'gallery/p02.png', 'per_page': 3}).get_json()
+    assert payload['position'] == 5
+    assert payload['page'] == 2
+    assert [item['name'] for item in payload['items']] == ['p00.png', 'p01.png', 'p02.png']
+
+    outside = client.get(f'/images/{session_id}', query_string={'path': 'gallery/2020', 'of': 'gallery/p02.png'})
+    assert outside.status_code == 400
+    not_image = client.get(f'/images/{session_id}', query_string={'path': 'gallery', 'of': 'gallery/notes.txt'})
+    assert not_image.status_code == 404
@@ -0,0 +1,91 @@
+# coding: utf-8
+""" /metrics بعد معالجة أرشيف: عدادات البايتات حسب المصدر والنوع، نسبة إصابة الكاش، المهام الجارية، وحجم القرص. """
+import threading
+import time
+import uuid
+
+import pytest
+
+from conftest import write_zip
+
+MEMBER_BYTES = 5000
+
+
+def read_metrics(client):
+    """ قيم السلاسل (السطر دون القيمة -> القيمة) من نص Prometheus. """
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    values = {}
+    for line in response.get_data(as_text=True).splitlines():
+        if line and not line.startswith('#'):
+            series, _, value = line.rpartition(' ')
+            values[series] = float(value)
+    return values
+
+
+@pytest.fixture
+def archive_url(served_dir, http_server):
+    filename = f"metrics-{uuid.uuid4().hex}.zip"
+    path = write_zip(served_dir / filename, {'dir/a.txt': b'a' * MEMBER_BYTES})
+    return http_server.url_for(filename), path
+
+
+@pytest.fixture
+def sessions_dir(app_module, monkeypatch, tmp_path):
+    # مجلد منفصل: حجم القرص المعروض يخص جلسة هذا الاختبار وحدها
+    monkeypatch.setattr(app_module, 'EXTRACTED_FILES_DIR_FLASK_APP', str(tmp_path))
+    return tmp_path
+
+
+def test_metrics_after_processing_an_archive(app_module, client, archive_url, sessions_dir):
+    url, path = archive_url
+    labels = '{stage="%s",source="direct",archive_type="zip"}'
+    before = read_metrics(client)
+
+    response = client.post('/process-archive', json={'archive_url': url})
+    assert response.status_code == 200
+    after = read_metrics(client)
+    delta = lambda series: after.get(series, 0) - before.get(series, 0)
+
+    assert delta('archive_stage_bytes_total' + labels % 'downloading') == path.stat().st_size
+    assert delta('archive_stage_bytes_total' + labels % 'extracting') == MEMBER_BYTES
+    for stage in ('downloading', 'detecting', 'extracting', 'building_structure', 'total'):
+        assert delta('archive_stage_duration_seconds_count' + labels % stage) == 1
+    assert delta('archive_jobs_total{source="direct",archive_type="zip",outcome="success"}') == 1
+    assert delta('url_cache_lookups_total{result="miss"}') == 1
+    assert after['archive_jobs_in_flight'] == 0
+
+    session_folder = app_module.get_session_folder(response.get_json()['session_id'])
+    assert after['extracted_files_sessions'] == 1
+    assert after['extracted_files_disk_bytes'] == app_module.get_folder_size(session_folder)
+    assert after['extracted_files_disk_bytes'] >= MEMBER_BYTES
+
+    # الطلب نفسه مرة أخرى إصابة في الكاش
+    assert client.post('/process-archive', json={'archive_url': url}).status_code == 200
+    cached = read_metrics(client)
+    hits, misses = cached['url_cache_lookups_total{result="hit"}'], cached['url_cache_lookups_total{result="miss"}']
+    assert hits - after.get('url_cache_lookups_total{result="hit"}', 0) == 1
+    assert cached['url_cache_hit_ratio'] == pytest.approx(hits / (hits + misses))
+    assert cached['url_cache_hit_ratio'] > 0
+
+
+def test_in_flight_jobs_gauge(app_module, client, archive_url, sessions_dir, monkeypatch):
+    url, _ = archive_url
+    release_download = threading.Event()
+    real_download = app_module.download_archive
+
+    def held_download(*args, **kwargs):
+        release_download.wait(10)
+        return real_download(*args, **kwargs)
+
+    monkeypatch.setattr(app_module, 'download_archive', held_download)
+    job_id = client.post('/process-archive', json={'archive_url': url, 'async': True}).get_json()['job_id']
+    try:
+        assert read_metrics(client)['archive_jobs_in_flight'] == 1
+    finally:
+        release_download.set()
+    deadline = time.monotonic() + 30
+    while client.get(f'/job-status/{job_id}').get_json()['status'] not in ('done', 'error') and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert read_metrics(client)['archive_jobs_in_flight'] == 0
@@ -0,0 +1,78 @@
+# coding: utf-8
+""" تركيب الأرشيفات المتداخلة كجلسات فرعية عبر /mount، وتصفحها بنفس مسارات الجلسات. """
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+
+def zip_bytes(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return buffer.getvalue()
+
+
+def tar_gz_bytes(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tf:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def session_id(make_session):
+    level3 = zip_bytes({'bottom.txt': b'bottom'})
+    level2 = zip_bytes({'level3.zip': level3})
+    level1 = zip_bytes({'level2.zip': level2})
+    session_id, _ = make_session({
+        'inner/photos.zip': zip_bytes({'a/cat.jpg': b'cat', 'readme.txt': b'hello'}),
+        'inner/logs.tar.gz': tar_gz_bytes({'logs/app.log': b'log line\n'}),
+        'deep/level1.zip': level1,
+        'plain.txt': b'not an archive',
+    }, mode='lazy')
+    return session_id
+
+
+def test_mount_returns_child_session_and_top_level(client, session_id):
+    response = client.post(f'/mount/{session_id}', json={'path': 'inner/photos.zip'})
+    assert response.status_code == 200
+    payload = response.get_json()
+    assert payload['parent_session_id'] == session_id
+    assert payload['archive_type'] == 'zip'
+    assert payload['depth'] == 1
+    assert {child['name'] for child in payload['structure']['children']} == {'a', 'readme.txt'}
+
+    nested_session_id = payload['session_id']
+    assert client.get(f'/view-file/{nested_session_id}/a/cat.jpg').data == b'cat'
+    listing = client.get(f'/list/{nested_session_id}', query_string={'path': 'a'}).get_json()
+    assert [item['name'] for item in listing['items']] == ['cat.jpg']
+    # التركيب مرة ثانية يعيد الجلسة نفسها من القرص
+    assert client.post(f'/mount/{session_id}', json={'path': 'inner/photos.zip'}).get_json()['session_id'] == nested_session_id
+
+
+def test_mount_tar_gz(client, session_id):
+    payload = client.post(f'/mount/{session_id}', json={'path': 'inner/logs.tar.gz'}).get_json()
+    assert payload['archive_type'] == 'tar'
+    assert client.get(f"/view-file/{payload['session_id']}/logs/app.log").data == b'log line\n'
+
+
+def test_mount_depth_limit(app_module, client, session_id, monkeypatch):
+    monkeypatch.setattr(app_module, 'NESTED_ARCHIVE_MAX_DEPTH', 2)
+    current_session_id = session_id
+    for depth, path in enumerate(['deep/level1.zip', 'level2.zip'], 1):
+        response = client.post(f'/mount/{current_session_id}', json={'path': path})
+        assert response.status_code == 200
+        current_session_id = response.get_json()['session_id']
+        assert app_module.get_nested_depth(current_session_id) == depth
+    assert client.post(f'/mount/{current_session_id}', json={'path': 'level3.zip'}).status_code == 400
+
+
+@pytest.mark.parametrize('body', [{'path': 'plain.txt'}, {'path': 'inner/missing.zip'}, {}, {'path': 'inner'}])
+def test_mount_rejects_non_archives(client, session_id, body):
+    assert client.post(f'/mount/{session_id}', json=body).status_code == 404
@@ -0,0 +1,100 @@
+# coding: utf-8
+""" فك الضغط المتوازي: ZIP في مجمع العمليات وTAR بخط فك الضغط/الكتابة، مع الحماية من المسارات والروابط
+الخارجة من مجلد الاستخراج. """
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+ZIP_MEMBERS = {f"dir{index % 3}/file{index}.bin": os.urandom(20_000) for index in range(12)}
+ZIP_MEMBERS['root.txt'] = b'root'
+
+
+@pytest.fixture
+def parallel_extract(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'EXTRACT_WORKERS', 2)
+    monkeypatch.setattr(app_module, 'PARALLEL_EXTRACT_MIN_BYTES', 0)
+    yield
+    app_module.reset_extract_executor() # مجمع بعدد العمال المؤقت لا يبقى للاختبارات التالية
+
+
+def extracted_files(folder):
+    found = {}
+    for root, _, files in os.walk(folder):
+        for f_name in files:
+            path = os.path.join(root, f_name)
+            if not os.path.islink(path):
+                with open(path, 'rb') as f:
+                    found[os.path.relpath(path, folder).replace(os.sep, '/')] = f.read()
+    return found
+
+
+def test_parallel_zip_extracts_every_member(app_module, parallel_extract, tmp_path):
+    archive_path = tmp_path / 'archive.zip'
+    with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('empty_dir/', b'')
+        for name, data in ZIP_MEMBERS.items():
+            zf.writestr(name, data)
+    dest = tmp_path / 'out'
+    progress = app_module.new_progress()
+
+    app_module.extract_archive(str(archive_path), 'zip', str(dest), progress)
+    assert extracted_files(dest) == ZIP_MEMBERS
+    assert (dest / 'empty_dir').is_dir()
+    assert progress['bytes_extracted'] == sum(map(len, ZIP_MEMBERS.values()))
+    assert 'zip_per_worker' in progress['stage_stats']
+
+
+def test_parallel_zip_keeps_traversal_inside_the_session(app_module, parallel_extract, tmp_path):
+    archive_path = tmp_path / 'evil.zip'
+    with zipfile.ZipFile(archive_path, 'w') as zf:
+        zf.writestr('../escaped.txt', b'evil')
+        zf.writestr('../../escaped_dir/', b'')
+        zf.writestr('ok/../../escaped2.txt', b'evil')
+        zf.writestr('safe.txt', b'safe')
+    dest = tmp_path / 'session' / 'out'
+
+    app_module.extract_archive(str(archive_path), 'zip', str(dest), app_module.new_progress())
+    outside = {os.path.relpath(os.path.join(root, name), tmp_path)
+               for root, dirs, files in os.walk(tmp_path) for name in dirs + files}
+    assert {path for path in outside if not path.startswith(os.path.join('session', 'out'))} == {'evil.zip', 'session'}
+    assert extracted_files(dest)['safe.txt'] == b'safe'
+
+
+def tar_with_links(path):
+    with tarfile.open(path, 'w:gz') as tf:
+        def add(info, data=b''):
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+
+        add(tarfile.TarInfo('docs/readme.txt'), b'read me')
+        add(tarfile.TarInfo('big.bin'), os.urandom(3 * 1024 * 1024)) # أكبر من عدة قطع في الطابور
+        for name, target in [('docs/link.txt', 'readme.txt'), ('abs_link', '/etc/passwd'), ('escape_link', '../../outside')]:
+            info = tarfile.TarInfo(name)
+            info.type = tarfile.SYMTYPE
+            info.linkname = target
+            add(info)
+        add(tarfile.TarInfo('/absolute.txt'), b'absolute')
+        add(tarfile.TarInfo('../outside.txt'), b'outside')
+
+
+def test_pipelined_tar_blocks_escaping_links_and_keeps_internal_ones(app_module, parallel_extract, tmp_path):
+    archive_path = tmp_path / 'links.tar.gz'
+    tar_with_links(archive_path)
+    dest = tmp_path / 'session' / 'out'
+    progress = app_module.new_progress()
+
+    app_module.extract_archive(str(archive_path), 'tar', str(dest), progress)
+    assert os.path.islink(dest / 'docs' / 'link.txt')
+    assert (dest / 'docs' / 'link.txt').read_bytes() == b'read me'
+    assert not os.path.lexists(dest / 'abs_link')
+    assert not os.path.lexists(dest / 'escape_link')
+    assert not (tmp_path / 'session' / 'outside.txt').exists()
+    assert not (tmp_path / 'outside.txt').exists()
+    assert (dest / 'absolute.txt').read_bytes() == b'absolute' # المسار المطلق يُستخرج نسبيًا داخل الجلسة
+
+    assert set(extracted_files(dest)) == {'docs/readme.txt', 'big.bin', 'absolute.txt'}
+    assert set(progress['stage_stats']) >= {'tar_decompress', 'disk_write'}
+    assert progress['stage_stats']['tar_decompress']['bytes'] == progress['bytes_extracted']
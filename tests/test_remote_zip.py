@@ -0,0 +1,89 @@
+# coding: utf-8
+""" تصفح ZIP البعيد (mode='remote') بطلبات Range على خادم محلي: الدليل المركزي، جلب عنصر واحد،
+تغيّر الملف البعيد (ETag/If-Range)، والرجوع إلى التحميل الكامل حين يتجاهل الخادم Range. """
+import os
+import uuid
+import zipfile
+
+import pytest
+
+from conftest import write_zip
+from throttled_http_server import ThrottledHTTPServer
+
+MEMBERS = {f"big/part{index}.bin": os.urandom(200_000) for index in range(10)}
+MEMBERS['small/hello.txt'] = b'hello from a remote zip'
+
+
+@pytest.fixture
+def remote_zip(served_dir, http_server):
+    filename = f"remote-{uuid.uuid4().hex}.zip"
+    path = write_zip(os.path.join(served_dir, filename), MEMBERS)
+    http_server.reset_stats()
+    return filename, path
+
+
+def process_remote(client, url):
+    response = client.post('/process-archive', json={'archive_url': url, 'mode': 'remote'})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['session_id']
+
+
+def test_listing_reads_only_the_central_directory(app_module, client, http_server, remote_zip):
+    filename, path = remote_zip
+    session_id = process_remote(client, http_server.url_for(filename))
+
+    lazy_source = app_module.load_lazy_source(app_module.get_session_folder(session_id))
+    assert lazy_source['archive_type'] == 'remote_zip'
+    listing = client.get(f'/list/{session_id}', query_string={'path': 'big'}).get_json()
+    assert listing['total'] == 10
+    assert {item['size'] for item in listing['items']} == {200_000}
+    assert http_server.stats['bytes_sent'] < os.path.getsize(path) / 10
+    assert http_server.stats['range_requests'] >= 1
+
+
+def test_view_fetches_a_single_member(client, http_server, remote_zip):
+    filename, path = remote_zip
+    session_id = process_remote(client, http_server.url_for(filename))
+    http_server.reset_stats()
+
+    response = client.get(f'/view-file/{session_id}/big/part3.bin')
+    assert response.data == MEMBERS['big/part3.bin']
+    # العنصر وحده (مع ترويسته) دون باقي الأرشيف
+    assert http_server.stats['bytes_sent'] < 2 * 200_000
+    assert client.get(f'/view-file/{session_id}/small/hello.txt').data == MEMBERS['small/hello.txt']
+
+
+def test_changed_remote_file_is_not_mixed_with_the_old_version(app_module, client, http_server, remote_zip):
+    filename, path = remote_zip
+    session_id = process_remote(client, http_server.url_for(filename))
+
+    # قراءة جارية بمقبض النسخة القديمة: If-Range لا يطابق فيعيد الخادم 200 ولا تُقبل بايتات النسخة الجديدة
+    zf, remote_file, zip_lock, _ = app_module.open_remote_zip(http_server.url_for(filename))
+    assert remote_file.validator
+    changed = dict(MEMBERS, **{'small/hello.txt': b'HELLO AFTER THE CHANGE!'})
+    write_zip(path, changed)
+    stat_result = os.stat(path)
+    os.utime(path, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 10 ** 9))
+    with zip_lock, pytest.raises(app_module.RangeNotSupportedError):
+        remote_file.seek(remote_file.size // 2) # خارج ذيل الملف المقروء عند الفتح
+        remote_file.read(100)
+
+    # الطلب التالي يفحص الرابط من جديد ويقرأ الدليل المركزي للنسخة الجديدة
+    assert client.get(f'/view-file/{session_id}/small/hello.txt').data == changed['small/hello.txt']
+
+
+def test_server_without_ranges_falls_back_to_a_full_download(app_module, client, served_dir, remote_zip):
+    filename, _ = remote_zip
+    server = ThrottledHTTPServer(str(served_dir), accept_ranges=False).start_in_background()
+    try:
+        session_id = process_remote(client, server.url_for(filename))
+        assert server.stats['range_requests'] == 0
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    lazy_source = app_module.load_lazy_source(app_module.get_session_folder(session_id))
+    assert lazy_source['archive_type'] == 'zip' # نسخة محلية في الوضع الكسول
+    with zipfile.ZipFile(lazy_source['archive_path']) as zf:
+        assert zf.testzip() is None
+    assert client.get(f'/view-file/{session_id}/small/hello.txt').data == MEMBERS['small/hello.txt']
@@ -0,0 +1,91 @@
+# coding: utf-8
+""" فهرس البحث (AVSI): ترتيب النتائج، استعلامات المسارات، الاقتطاع عند الحد، ومسار /search. """
+import pytest
+
+ENTRIES = [
+    ('photos', True, 0),
+    ('photos/2020', True, 0),
+    ('photos/2020/cat.jpg', False, 1),
+    ('photos/2020/Cat Sitting.png', False, 1),
+    ('photos/2021', True, 0),
+    ('photos/2021/cat.jpg', False, 1),
+    ('docs', True, 0),
+    ('docs/bobcat.txt', False, 1),
+    ('docs/my-cat.txt', False, 1),
+    ('docs/catalog.txt', False, 1),
+    ('cat', True, 0),
+]
+
+
+@pytest.fixture
+def indexes(app_module, tmp_path):
+    structure, file_sizes = app_module._build_tree_from_entries(ENTRIES)
+    index_file_path = str(tmp_path / app_module.ARCHIVE_INDEX_FILENAME)
+    app_module.write_archive_index(structure, file_sizes, index_file_path)
+    archive_index = app_module.ArchiveIndex(index_file_path)
+    search_index_file_path = str(tmp_path / app_module.SEARCH_INDEX_FILENAME)
+    app_module.write_search_index(archive_index, search_index_file_path)
+    return archive_index, app_module.SearchIndex(search_index_file_path)
+
+
+def search_paths(indexes, query, **kwargs):
+    archive_index, search_index = indexes
+    node_ids, complete = search_index.search(archive_index, query, **kwargs)
+    return [archive_index.path(node_id) for node_id in node_ids], complete
+
+
+def test_ranking_exact_then_prefix_then_word_start_then_anywhere(indexes):
+    paths, complete = search_paths(indexes, 'CAT')
+    assert complete
+    assert paths[0] == 'cat' # تطابق تام
+    assert paths[1:3] == ['photos/2020/cat.jpg', 'photos/2021/cat.jpg'] # بداية الاسم، الأقصر أولًا
+    assert paths[3:5] == ['docs/catalog.txt', 'photos/2020/Cat Sitting.png']
+    assert paths[5:] == ['docs/my-cat.txt', 'docs/bobcat.txt'] # بداية كلمة قبل أي موضع
+
+
+def test_path_query_matches_parent_tail_and_child_prefix(indexes):
+    paths, complete = search_paths(indexes, '2020/ca')
+    assert complete
+    assert paths == ['photos/2020/cat.jpg', 'photos/2020/Cat Sitting.png']
+    assert search_paths(indexes, 'photos/2021/cat')[0] == ['photos/2021/cat.jpg']
+    assert search_paths(indexes, 'docs/2020/cat')[0] == []
+
+
+def test_filters_by_extension_and_image_flag(indexes):
+    assert search_paths(indexes, 'cat', extensions=(b'.txt',))[0] == ['docs/catalog.txt', 'docs/my-cat.txt', 'docs/bobcat.txt']
+    assert 'cat' not in search_paths(indexes, 'cat', is_image=True)[0]
+    assert search_paths(indexes, 'cat', is_image=False)[0][0] == 'cat'
+
+
+def test_truncates_at_limit(indexes):
+    all_paths, _ = search_paths(indexes, 'cat')
+    paths, complete = search_paths(indexes, 'cat', limit=2)
+    # الفئات الأعلى أولًا؛ داخل الفئة المقتطعة تُجمع أول النتائج بترتيب العقد ثم تُرتب
+    assert paths[0] == 'cat' and set(paths) < set(all_paths[:5])
+    assert not complete
+    paths, complete = search_paths(indexes, 'cat', limit=7)
+    assert len(paths) == 7 and complete
+
+
+def test_empty_and_unmatched_queries(indexes):
+    assert search_paths(indexes, '  /  ') == ([], True)
+    assert search_paths(indexes, 'dog') == ([], True)
+
+
+def test_search_route(client, make_session):
+    session_id, _ = make_session({
+        'Photos/cat.jpg': b'x', 'Photos/kitten.png': b'x', 'notes/cat.txt': b'cat', 'notes/catalog.md': b'x',
+    })
+    payload = client.get(f'/search/{session_id}', query_string={'q': 'cat'}).get_json()
+    assert payload['complete'] is True
+    assert payload['total'] == 3
+    assert [item['path'] for item in payload['items']] == ['Photos/cat.jpg', 'notes/cat.txt', 'notes/catalog.md']
+
+    payload = client.get(f'/search/{session_id}', query_string={'q': 'cat', 'ext': 'md'}).get_json()
+    assert [item['path'] for item in payload['items']] == ['notes/catalog.md']
+    payload = client.get(f'/search/{session_id}', query_string={'q': 'photos/k', 'is_image': '1'}).get_json()
+    assert [item['path'] for item in payload['items']] == ['Photos/kitten.png']
+
+    assert client.get(f'/search/{session_id}').status_code == 400
+    assert client.get(f'/search/{session_id}', query_string={'q': 'cat', 'is_image': 'maybe'}).status_code == 400
+    assert client.get('/search/' + '0' * 32, query_string={'q': 'cat'}).status_code == 404
@@ -0,0 +1,173 @@
+# coding: utf-8
+""" التحميل المقسّم: الأجزاء المتوازية، الاستئناف من state.json، وتنقية أسماء الملفات المحملة. """
+import http.server
+import json
+import os
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def remote_file(served_dir, http_server):
+    data = os.urandom(300_000)
+    name = 'segmented.bin'
+    (served_dir / name).write_bytes(data)
+    http_server.reset_stats()
+    return http_server.url_for(name), data
+
+
+def test_download_segmented_writes_the_whole_file(app_module, remote_file, tmp_path):
+    url, data = remote_file
+    dest_path = str(tmp_path / 'out.bin')
+    progress = {}
+    app_module.download_segmented(url, dest_path, len(data), progress=progress, segments=4)
+    with open(dest_path, 'rb') as f:
+        assert f.read() == data
+    assert progress['bytes_downloaded'] == progress['bytes_total'] == len(data)
+    assert not os.path.exists(app_module._partial_download_folder(url))
+
+
+def test_download_segmented_resumes_from_state_file(app_module, remote_file, http_server, tmp_path):
+    url, data = remote_file
+    size = len(data)
+    partial_folder = app_module._partial_download_folder(url)
+    os.makedirs(partial_folder, exist_ok=True)
+    # تحميل سابق انقطع: الجزء الأول مكتمل والثاني نصفه، والثالث لم يبدأ
+    segments = [[0, 100_000, 100_000], [100_000, 200_000, 40_000], [200_000, size, 0]]
+    with open(os.path.join(partial_folder, 'data.part'), 'wb') as f:
+        f.truncate(size)
+        f.write(data[:100_000])
+        f.seek(100_000)
+        f.write(data[100_000:140_000])
+    with open(os.path.join(partial_folder, 'state.json'), 'w', encoding='utf-8') as f:
+        json.dump({'url': url, 'size': size, 'segments': segments}, f)
+
+    dest_path = str(tmp_path / 'resumed.bin')
+    app_module.download_segmented(url, dest_path, size, segments=3)
+    with open(dest_path, 'rb') as f:
+        assert f.read() == data
+    assert http_server.stats['range_requests'] == 2
+    assert http_server.stats['bytes_sent'] == size - 140_000
+    assert not os.path.exists(partial_folder)
+
+
+def test_download_segmented_ignores_state_for_another_size(app_module, remote_file, http_server, tmp_path):
+    url, data = remote_file
+    partial_folder = app_module._partial_download_folder(url)
+    os.makedirs(partial_folder, exist_ok=True)
+    with open(os.path.join(partial_folder, 'data.part'), 'wb') as f:
+        f.write(b'\0' * 10)
+    with open(os.path.join(partial_folder, 'state.json'), 'w', encoding='utf-8') as f:
+        json.dump({'url': url, 'size': 10, 'segments': [[0, 10, 10]]}, f)
+
+    dest_path = str(tmp_path / 'fresh.bin')
+    app_module.download_segmented(url, dest_path, len(data), segments=2)
+    with open(dest_path, 'rb') as f:
+        assert f.read() == data
+    assert http_server.stats['bytes_sent'] == len(data)
+
+
+def current_etag(http_server, url):
+    import requests
+    return requests.head(url, timeout=5).headers['ETag']
+
+
+def test_state_for_another_version_is_discarded(app_module, remote_file, http_server, tmp_path):
+    url, data = remote_file
+    size = len(data)
+    partial_folder = app_module._partial_download_folder(url)
+    os.makedirs(partial_folder, exist_ok=True)
+    # تحميل سابق بالحجم نفسه لكن لنسخة أخرى من الملف (ETag مختلف): بايتاته لا تصلح
+    with open(os.path.join(partial_folder, 'data.part'), 'wb') as f:
+        f.write(b'\xee' * size)
+    with open(os.path.join(partial_folder, 'state.json'), 'w', encoding='utf-8') as f:
+        json.dump({'url': url, 'size': size, 'validator': '"old-version"', 'segments': [[0, size, size // 2]]}, f)
+
+    dest_path = str(tmp_path / 'fresh.bin')
+    app_module.download_segmented(url, dest_path, size, segments=2, validator=current_etag(http_server, url))
+    with open(dest_path, 'rb') as f:
+        assert f.read() == data
+
+
+def test_changed_file_raises_and_drops_partial_state(app_module, remote_file, tmp_path):
+    url, data = remote_file
+    # الخادم يرى If-Range لا يطابق نسخته فيعيد 200 بالملف كاملًا
+    with pytest.raises(app_module.RemoteFileChangedError):
+        app_module.download_segmented(url, str(tmp_path / 'out.bin'), len(data), segments=2, validator='"stale"')
+    assert not os.path.exists(app_module._partial_download_folder(url))
+    assert not os.path.exists(tmp_path / 'out.bin')
+
+
+def test_download_restarts_when_the_file_changes(app_module, remote_file, monkeypatch, tmp_path):
+    url, data = remote_file
+    monkeypatch.setattr(app_module, 'SEGMENTED_DOWNLOAD_MIN_SIZE', 1)
+    real_probe = app_module.probe_download
+    probes = []
+
+    def probe_with_stale_etag_first(*args, **kwargs):
+        probe = real_probe(*args, **kwargs)
+        if not probes: # نسخة تغيرت بين الفحص وطلبات الأجزاء
+            probe['etag'] = '"stale"'
+        probes.append(probe)
+        return probe
+
+    monkeypatch.setattr(app_module, 'probe_download', probe_with_stale_etag_first)
+    progress = {}
+    path = app_module.download_http_file(url, str(tmp_path), str(tmp_path / 'archive_download'), progress)
+    assert len(probes) == 2
+    with open(path, 'rb') as f:
+        assert f.read() == data
+    assert progress['bytes_downloaded'] == len(data)
+
+
+class EmptyRangeHandler(http.server.BaseHTTPRequestHandler):
+    """ خادم معطوب يعيد 206 بجسم فارغ لكل طلب Range. """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.request_count += 1
+        start = int(self.headers['Range'].split('=')[1].split('-')[0])
+        self.send_response(206)
+        self.send_header('Content-Range', f'bytes {start}-{start + 99}/1000')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_empty_partial_responses_do_not_retry_forever(app_module, monkeypatch, tmp_path):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), EmptyRangeHandler)
+    server.request_count = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(app_module, 'DOWNLOAD_SEGMENT_RETRIES', 2)
+    monkeypatch.setattr(app_module.time, 'sleep', lambda seconds: None)
+    url = f"http://127.0.0.1:{server.server_address[1]}/empty.bin"
+    try:
+        with pytest.raises(app_module.ArchiveProcessingError):
+            app_module.download_segmented(url, str(tmp_path / 'out.bin'), 1000, segments=1)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert server.request_count == 3
+
+
+@pytest.mark.parametrize('filename, expected', [
+    ('archive.zip', 'archive.zip'),
+    ('../../etc/passwd', 'passwd'),
+    ('..\\..\\evil.rar', 'evil.rar'),
+    ('/abs/path/x.7z', 'x.7z'),
+    ('..', None),
+    ('dir/', None),
+    ('bad\x00name\n.zip', 'badname.zip'),
+    ('صور الرحلة.zip', 'صور الرحلة.zip'),
+])
+def test_sanitize_download_filename(app_module, filename, expected):
+    assert app_module._sanitize_download_filename(filename) == expected
+
+
+def test_sanitize_download_filename_keeps_extension_when_truncating(app_module):
+    filename = app_module._sanitize_download_filename('a' * 1000 + '.tar.gz')
+    assert len(filename) == app_module.DOWNLOAD_FILENAME_MAX_LENGTH
+    assert filename.endswith('.gz')
@@ -0,0 +1,101 @@
+# coding: utf-8
+""" الطلبات المتزامنة للرابط نفسه: تحميل واستخراج واحد، ينتظر الباقون نتيجة المنفذ، وتُنظف
+inflight_jobs وملف القفل حتى عند فشله. """
+import hashlib
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import write_zip
+
+CONCURRENT_REQUESTS = 4
+JOIN_TIMEOUT_SECONDS = 10
+
+
+@pytest.fixture
+def gated_download(app_module, monkeypatch):
+    """ يوقف تحميل المنفذ حتى تنضم كل الطلبات الأخرى إلى مهمته، ويعد استدعاءات التحميل والاستخراج. """
+    calls = {'download': 0, 'extract': 0, 'followers': 0, 'fail': False}
+    followers_joined = threading.Event()
+    calls_lock = threading.Lock()
+    real_get_or_create_job = app_module.get_or_create_job
+    real_download = app_module.download_archive
+    real_extract = app_module.extract_archive
+
+    def get_or_create_job(*args):
+        job, is_leader = real_get_or_create_job(*args)
+        if not is_leader:
+            with calls_lock:
+                calls['followers'] += 1
+                if calls['followers'] == CONCURRENT_REQUESTS - 1:
+                    followers_joined.set()
+        return job, is_leader
+
+    def download_archive(*args, **kwargs):
+        with calls_lock:
+            calls['download'] += 1
+        followers_joined.wait(JOIN_TIMEOUT_SECONDS)
+        if calls['fail']:
+            raise app_module.ArchiveProcessingError("فشل التحميل في الاختبار.", 502)
+        return real_download(*args, **kwargs)
+
+    def extract_archive(*args, **kwargs):
+        with calls_lock:
+            calls['extract'] += 1
+        return real_extract(*args, **kwargs)
+
+    monkeypatch.setattr(app_module, 'get_or_create_job', get_or_create_job)
+    monkeypatch.setattr(app_module, 'download_archive', download_archive)
+    monkeypatch.setattr(app_module, 'extract_archive', extract_archive)
+    return calls
+
+
+def post_concurrently(app_module, url):
+    def post(_):
+        with app_module.app.test_client() as client:
+            response = client.post('/process-archive', json={'archive_url': url, 'mode': 'extract'})
+            return response.status_code, response.get_json()
+
+    with ThreadPoolExecutor(CONCURRENT_REQUESTS) as executor:
+        return list(executor.map(post, range(CONCURRENT_REQUESTS)))
+
+
+def assert_cleaned_up(app_module, url):
+    url_hash = hashlib.md5(url.encode('utf-8')).hexdigest()
+    assert url_hash not in app_module.inflight_jobs
+    assert not os.path.exists(os.path.join(app_module.URL_LOCKS_DIR, f"{url_hash}.lock"))
+
+
+def test_identical_urls_share_one_download_and_extraction(app_module, served_dir, http_server, gated_download):
+    filename = f"single-flight-{uuid.uuid4().hex}.zip"
+    write_zip(served_dir / filename, {'dir/a.txt': b'a'})
+    url = http_server.url_for(filename)
+
+    results = post_concurrently(app_module, url)
+    assert gated_download['followers'] == CONCURRENT_REQUESTS - 1
+    assert gated_download['download'] == 1
+    assert gated_download['extract'] == 1
+    assert [status_code for status_code, _ in results] == [200] * CONCURRENT_REQUESTS
+    assert len({payload['session_id'] for _, payload in results}) == 1 # نتيجة المنفذ نفسها للجميع
+    assert_cleaned_up(app_module, url)
+
+
+def test_leader_failure_is_shared_and_cleaned_up(app_module, http_server, gated_download):
+    gated_download['fail'] = True
+    url = http_server.url_for(f"failing-{uuid.uuid4().hex}.zip")
+
+    results = post_concurrently(app_module, url)
+    assert gated_download['download'] == 1
+    assert gated_download['extract'] == 0
+    assert [status_code for status_code, _ in results] == [502] * CONCURRENT_REQUESTS
+    assert all(payload['error'] for _, payload in results)
+    assert_cleaned_up(app_module, url)
+
+    # الطلب التالي بعد الفشل يبدأ مهمة جديدة بدل الانضمام إلى المهمة المنتهية
+    gated_download['fail'] = False
+    with app_module.app.test_client() as client:
+        assert client.post('/process-archive', json={'archive_url': url}).status_code != 502
+    assert gated_download['download'] == 2
@@ -0,0 +1,92 @@
+# coding: utf-8
+""" كشف نوع الأرشيف من التواقيع: ZIP وRAR و7z وtar (ustar وv7 بمجموع التحقق) وtar المضغوط. """
+import gzip
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+
+def tar_bytes(mode='w', tar_format=tarfile.USTAR_FORMAT, members=(('a.txt', b'hello'),)):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode, format=tar_format) as tf:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def v7_tar_bytes():
+    """ tar بصيغة v7 (دون توقيع ustar): يُكشف بمجموع التحقق فقط. """
+    data = bytearray(tar_bytes())
+    data[257:265] = b'\0' * 8 # حذف "ustar\x0000"
+    data[148:156] = b' ' * 8 # الحقل نفسه يُحسب مسافات
+    data[148:156] = f"{sum(data[:512]):06o}\0 ".encode('ascii')
+    return bytes(data)
+
+
+def zip_bytes(compression=zipfile.ZIP_DEFLATED):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression) as zf:
+        zf.writestr('a.txt', b'hello' * 100)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def sniff(app_module, tmp_path):
+    def _sniff(data, name='archive.bin'):
+        path = tmp_path / name
+        path.write_bytes(data)
+        return app_module.sniff_archive(str(path))
+    return _sniff
+
+
+@pytest.mark.parametrize('mode, codec', [('w', None), ('w:gz', 'gzip'), ('w:bz2', 'bzip2'), ('w:xz', 'xz')])
+def test_tar_and_compressed_tar(sniff, mode, codec):
+    assert sniff(tar_bytes(mode)) == {'type': 'tar', 'codec': codec}
+
+
+def test_compressed_tar_with_large_first_member(sniff):
+    # bzip2 لا يخرج شيئًا قبل اكتمال كتلته: يجب أن يكفي فك ضغط بداية الملف
+    data = tar_bytes('w:bz2', members=(('big.bin', bytes(range(256)) * 20_000),))
+    assert sniff(data) == {'type': 'tar', 'codec': 'bzip2'}
+
+
+def test_v7_tar_detected_by_checksum(sniff):
+    assert sniff(v7_tar_bytes()) == {'type': 'tar', 'codec': None}
+
+
+def test_bad_tar_checksum_is_not_tar(sniff):
+    data = bytearray(v7_tar_bytes())
+    data[0] ^= 0x01 # يغير مجموع البايتات دون تحديث الحقل المخزن
+    assert sniff(bytes(data))['type'] is None
+
+
+def test_gzip_without_tar_inside(sniff):
+    assert sniff(gzip.compress(b'not a tar archive' * 100)) == {'type': None, 'codec': 'gzip'}
+
+
+@pytest.mark.parametrize('compression, codec', [(zipfile.ZIP_STORED, 'stored'), (zipfile.ZIP_DEFLATED, 'deflate'),
+                                                 (zipfile.ZIP_BZIP2, 'bzip2'), (zipfile.ZIP_LZMA, 'lzma')])
+def test_zip_codec(sniff, compression, codec):
+    assert sniff(zip_bytes(compression)) == {'type': 'zip', 'codec': codec}
+
+
+def test_self_extracting_zip_found_from_tail(sniff):
+    data = b'MZ' + b'\0' * 5000 + zip_bytes()
+    assert sniff(data)['type'] == 'zip'
+
+
+@pytest.mark.parametrize('data, expected', [
+    (b'Rar!\x1a\x07\x01\x00' + b'\0' * 32, {'type': 'rar', 'codec': 'rar5'}),
+    (b'Rar!\x1a\x07\x00' + b'\0' * 32, {'type': 'rar', 'codec': 'rar4'}),
+    (b'7z\xbc\xaf\x27\x1c' + b'\0' * 32, {'type': '7z', 'codec': None}),
+])
+def test_rar_and_7z_signatures(sniff, data, expected):
+    assert sniff(data) == expected
+
+
+def test_unknown_data(sniff):
+    assert sniff(b'plain text, not an archive\n' * 50)['type'] is None
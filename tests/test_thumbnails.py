@@ -0,0 +1,48 @@
+# coding: utf-8
+""" الصور المصغرة /thumb: التوليد في مجمع العمليات والكاش على القرص والتحويل للصورة الأصلية. """
+import io
+import os
+
+import pytest
+
+from conftest import make_png
+
+pytest.importorskip('PIL')
+from PIL import Image  # noqa: E402
+
+
+@pytest.fixture
+def session_id(make_session):
+    session_id, _ = make_session({'pics/photo.png': make_png(800, 600), 'pics/vector.svg': b'<svg/>', 'readme.txt': b'x'})
+    return session_id
+
+
+def test_thumb_is_a_resized_jpeg_and_cached(app_module, client, session_id):
+    response = client.get(f'/thumb/{session_id}/pics/photo.png', query_string={'size': 'small'})
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+    max_side = app_module.THUMBNAIL_SIZES['small']
+    with Image.open(io.BytesIO(response.data)) as image:
+        assert image.format == 'JPEG'
+        assert max(image.size) == max_side
+        assert image.width / image.height == pytest.approx(800 / 600, rel=0.05)
+
+    session_folder = app_module.get_session_folder(session_id)
+    thumbnail_path = app_module.get_thumbnail_path(session_folder, 'pics/photo.png', 'small')
+    assert os.path.isfile(thumbnail_path)
+    assert client.get(f'/thumb/{session_id}/pics/photo.png', query_string={'size': 'small'}).data == response.data
+
+
+def test_thumb_redirects_unsupported_formats_to_the_original(client, session_id):
+    response = client.get(f'/thumb/{session_id}/pics/vector.svg')
+    assert response.status_code == 302
+    assert response.location.endswith(f'/view-file/{session_id}/pics/vector.svg')
+
+
+@pytest.mark.parametrize('path, query_string, status', [
+    ('pics/photo.png', {'size': 'huge'}, 400),
+    ('pics/missing.png', {}, 404),
+    ('../../etc/passwd.png', {}, 403),
+])
+def test_thumb_errors(client, session_id, path, query_string, status):
+    assert client.get(f'/thumb/{session_id}/{path}', query_string=query_string).status_code == status
@@ -0,0 +1,73 @@
+# coding: utf-8
+""" كاش الروابط في SQLite: الإدراج والتحديث، البيانات الوصفية، حذف مدخلات جلسة، وترحيل ملف JSON القديم. """
+import json
+import os
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def url_hash():
+    return f"test-{uuid.uuid4().hex}"
+
+
+def test_metadata_round_trip(app_module, url_hash):
+    app_module.cache_put(url_hash, 'session-a', '/tmp/a/.archive_structure.json', archive_type='zip', mode='lazy', size_bytes=1234)
+    entry = app_module.cache_get(url_hash)
+    assert entry['session_id'] == 'session-a'
+    assert entry['structure_file'] == '/tmp/a/.archive_structure.json'
+    assert (entry['archive_type'], entry['mode'], entry['size_bytes']) == ('zip', 'lazy', 1234)
+    assert entry['created_at'] == entry['last_access']
+
+
+def test_put_replaces_the_existing_entry(app_module, url_hash):
+    app_module.cache_put(url_hash, 'session-old', '/old', archive_type='zip', mode='extract', size_bytes=1)
+    app_module.cache_put(url_hash, 'session-new', '/new', archive_type='7z')
+    entry = app_module.cache_get(url_hash)
+    assert (entry['session_id'], entry['structure_file'], entry['archive_type']) == ('session-new', '/new', '7z')
+    assert entry['mode'] is None and entry['size_bytes'] is None
+    count = app_module.get_cache_db().execute('SELECT COUNT(*) FROM url_cache WHERE url_hash = ?', (url_hash,)).fetchone()[0]
+    assert count == 1
+
+
+def test_touch_updates_last_access(app_module, url_hash):
+    app_module.cache_put(url_hash, 'session-a', '/a')
+    with app_module.get_cache_db() as connection:
+        connection.execute('UPDATE url_cache SET last_access = 0 WHERE url_hash = ?', (url_hash,))
+    app_module.cache_touch(url_hash)
+    assert app_module.cache_get(url_hash)['last_access'] > 0
+
+
+def test_delete_session_removes_every_entry_pointing_to_it(app_module, url_hash):
+    session_id = uuid.uuid4().hex
+    app_module.cache_put(url_hash, session_id, '/a')
+    app_module.cache_put(url_hash + '-volumes', session_id, '/a')
+    app_module.cache_put(url_hash + '-other', 'other-session', '/b')
+    assert app_module.cache_delete_session(session_id) == 2
+    assert app_module.cache_get(url_hash) is None
+    assert app_module.cache_get(url_hash + '-volumes') is None
+    assert app_module.cache_get(url_hash + '-other')['session_id'] == 'other-session'
+
+
+def test_legacy_json_cache_is_migrated_once(app_module, monkeypatch, tmp_path, url_hash):
+    legacy_path = tmp_path / '.url_cache.json'
+    existing_hash = url_hash + '-existing'
+    app_module.cache_put(existing_hash, 'session-current', '/current')
+    legacy_path.write_text(json.dumps({
+        url_hash: {'session_id': 'session-legacy', 'structure_file': '/legacy/.archive_structure.json'},
+        existing_hash: {'session_id': 'session-stale', 'structure_file': '/stale'}, # المدخل الحالي أحدث من الملف القديم
+        url_hash + '-broken': {'structure_file': '/no-session'},
+    }), encoding='utf-8')
+    monkeypatch.setattr(app_module, 'LEGACY_CACHE_FILENAME', str(legacy_path))
+
+    app_module.migrate_legacy_cache()
+    entry = app_module.cache_get(url_hash)
+    assert (entry['session_id'], entry['structure_file']) == ('session-legacy', '/legacy/.archive_structure.json')
+    assert app_module.cache_get(existing_hash)['session_id'] == 'session-current'
+    assert app_module.cache_get(url_hash + '-broken') is None
+    assert not legacy_path.exists()
+    assert os.path.exists(str(legacy_path) + '.migrated')
+
+    app_module.migrate_legacy_cache() # لا شيء لترحيله بعد إعادة التسمية
+    assert app_module.cache_get(url_hash)['session_id'] == 'session-legacy'
@@ -0,0 +1,172 @@
+# coding: utf-8
+""" الأرشيفات متعددة الأجزاء: توسيع الأنماط، تصنيف الأجزاء، إعادة كتابة مواضع ZIP المقسّم، وVolumeChainReader. """
+import os
+import shutil
+import subprocess
+import zipfile
+from concurrent.futures import Future
+
+import pytest
+
+
+def test_expand_volume_pattern_keeps_leading_zeros(app_module):
+    assert app_module.expand_volume_pattern('http://h/f.7z.{008..011}') == [
+        'http://h/f.7z.008', 'http://h/f.7z.009', 'http://h/f.7z.010', 'http://h/f.7z.011']
+    assert app_module.expand_volume_pattern('http://h/f.part{1..3}.rar') == [
+        'http://h/f.part1.rar', 'http://h/f.part2.rar', 'http://h/f.part3.rar']
+
+
+@pytest.mark.parametrize('pattern', ['http://h/f.rar', 'http://h/f.{3..1}', 'http://h/f.{1..9999}'])
+def test_expand_volume_pattern_rejects_invalid_ranges(app_module, pattern):
+    with pytest.raises(ValueError):
+        app_module.expand_volume_pattern(pattern)
+
+
+@pytest.mark.parametrize('filename, expected', [
+    ('Show.part01.rar', ('rar', 1)),
+    ('show.rar', ('rar', 0)),
+    ('show.r00', ('rar', 1)),
+    ('backup.z02', ('zip_split', 2)),
+    ('backup.zip', ('zip_split', None)),
+    ('backup.tar.gz.003', ('raw_split', 3)),
+    ('readme.txt', (None, 0)),
+])
+def test_classify_volume(app_module, filename, expected):
+    kind, order = app_module.classify_volume(filename)
+    assert kind == expected[0]
+    if expected[1] is not None:
+        assert order == expected[1]
+
+
+def test_order_volume_paths_puts_zip_last_and_rejects_mixed_sets(app_module):
+    assert app_module.order_volume_paths(['/t/a.zip', '/t/a.z02', '/t/a.z01']) == ('zip_split', ['/t/a.z01', '/t/a.z02', '/t/a.zip'])
+    with pytest.raises(app_module.ArchiveProcessingError):
+        app_module.order_volume_paths(['/t/a.zip', '/t/a.001'])
+
+
+def split_file(path, volume_size):
+    """ تقسيم ملف خامًا إلى .001 و.002 ... (كما تفعل أدوات التقسيم). """
+    with open(path, 'rb') as f:
+        data = f.read()
+    paths = []
+    for number, start in enumerate(range(0, len(data), volume_size), 1):
+        volume_path = f"{path}.{number:03d}"
+        with open(volume_path, 'wb') as f:
+            f.write(data[start:start + volume_size])
+        paths.append(volume_path)
+    return paths
+
+
+@pytest.mark.skipif(shutil.which('zip') is None, reason="أداة zip غير متوفرة لإنشاء ZIP مقسّم")
+def test_rewrite_split_zip_offsets_makes_joined_zip_readable(app_module, tmp_path):
+    source = tmp_path / 'source'
+    members = {f"d{index % 3}/f{index}.bin": os.urandom(3000) + bytes([index]) * 2000 for index in range(60)}
+    for name, data in members.items():
+        (source / os.path.dirname(name)).mkdir(parents=True, exist_ok=True)
+        (source / name).write_bytes(data)
+    subprocess.run(['zip', '-q', '-r', '-s', '64k', str(tmp_path / 'set.zip'), '.'], cwd=source, check=True)
+    volume_paths = sorted(str(path) for path in tmp_path.glob('set.z*'))
+    assert len(volume_paths) > 2
+
+    kind, ordered_paths = app_module.order_volume_paths(volume_paths)
+    volume_sizes = [os.path.getsize(path) for path in ordered_paths]
+    joined_path = str(tmp_path / 'joined.zip')
+    app_module.concatenate_volumes(ordered_paths, joined_path)
+    app_module.rewrite_split_zip_offsets(joined_path, volume_sizes)
+
+    assert kind == 'zip_split'
+    assert os.path.getsize(joined_path) == sum(volume_sizes)
+    with zipfile.ZipFile(joined_path) as zf:
+        assert zf.testzip() is None
+        assert {name: zf.read(name) for name in zf.namelist() if not name.endswith('/')} == members
+
+
+def test_rewrite_split_zip_offsets_rejects_missing_directory(app_module, tmp_path):
+    broken_path = tmp_path / 'broken.zip'
+    broken_path.write_bytes(b'PK\x07\x08' + b'\0' * 100)
+    with pytest.raises(zipfile.BadZipFile):
+        app_module.rewrite_split_zip_offsets(str(broken_path), [104])
+
+
+def done_future(value=None, error=None):
+    future = Future()
+    if error:
+        future.set_exception(error)
+    else:
+        future.set_result(value)
+    return future
+
+
+def test_volume_chain_reader_reads_in_order_and_removes_volumes(app_module, tmp_path):
+    original = os.urandom(200_000)
+    (tmp_path / 'data.bin').write_bytes(original)
+    volume_paths = split_file(str(tmp_path / 'data.bin'), 70_000)
+    reader = app_module.VolumeChainReader([done_future(path) for path in volume_paths])
+    with reader:
+        assert reader.read() == original
+    assert not any(os.path.exists(path) for path in volume_paths)
+
+
+def test_volume_chain_reader_raises_download_error(app_module, tmp_path):
+    (tmp_path / 'data.bin').write_bytes(b'x' * 100)
+    volume_paths = split_file(str(tmp_path / 'data.bin'), 60)
+    reader = app_module.VolumeChainReader([done_future(volume_paths[0]), done_future(error=OSError("download failed"))])
+    assert reader.read(60) == b'x' * 60
+    with pytest.raises(OSError, match="download failed"):
+        reader.read()
+    reader.close()
+
+
+def touch_files(folder, sizes):
+    paths = []
+    for name, size in sizes.items():
+        path = os.path.join(folder, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        paths.append(path)
+    return paths
+
+
+def test_downloaded_folder_with_one_archive_and_extras(app_module, tmp_path):
+    # مجلد MEGA بأرشيف واحد مع ملفات مرافقة ليس مجموعة أجزاء
+    paths = touch_files(tmp_path, {'README.txt': 10, 'photos.zip': 100, 'release.nfo': 20})
+    assert app_module.select_downloaded_archive(paths) == str(tmp_path / 'photos.zip')
+    paths = touch_files(tmp_path, {'notes.txt': 5, 'data.bin': 500}) # بلا امتداد أرشيف: الأكبر يُكشف من محتواه
+    assert app_module.select_downloaded_archive(paths) == str(tmp_path / 'data.bin')
+
+
+def test_downloaded_folder_with_a_volume_set_and_extras(app_module, tmp_path):
+    paths = touch_files(tmp_path, {'show.part2.rar': 50, 'README.txt': 10, 'show.part1.rar': 100})
+    assert app_module.select_downloaded_archive(paths) == str(tmp_path / 'show.part1.rar')
+
+
+def test_downloaded_folder_with_several_archives_is_rejected(app_module, tmp_path):
+    paths = touch_files(tmp_path, {'photos.zip': 100, 'docs.7z': 100})
+    with pytest.raises(app_module.ArchiveProcessingError):
+        app_module.select_downloaded_archive(paths)
+
+
+def test_volume_downloads_report_bytes_into_the_job(app_module, served_dir, http_server, monkeypatch, tmp_path):
+    volume_sizes = [70_000, 50_000, 30_000]
+    names = []
+    for number, size in enumerate(volume_sizes, 1):
+        names.append(f"progress-{os.getpid()}.bin.{number:03d}")
+        (served_dir / names[-1]).write_bytes(os.urandom(size))
+    progress = app_module.new_progress()
+    byte_updates = []
+    real_add_progress_bytes = app_module.add_progress_bytes
+
+    def recording_add_progress_bytes(target, field, amount):
+        real_add_progress_bytes(target, field, amount)
+        if target is progress and field == 'bytes_downloaded':
+            byte_updates.append(amount)
+
+    monkeypatch.setattr(app_module, 'add_progress_bytes', recording_add_progress_bytes)
+    executor, futures = app_module.start_volume_downloads([http_server.url_for(name) for name in names], str(tmp_path), progress)
+    with executor:
+        paths = [future.result() for future in futures]
+    assert [os.path.getsize(path) for path in paths] == volume_sizes
+    assert progress['bytes_downloaded'] == progress['bytes_total'] == sum(volume_sizes) # لا عد مزدوج للأجزاء
+    assert progress['volumes_downloaded'] == len(volume_sizes)
+    assert len(byte_updates) > len(volume_sizes) # تقدم أثناء تحميل كل جزء وليس عند انتهائه فقط
+    assert progress['stage'] == 'downloading'